@@ -1,32 +1,94 @@
 from flask import Flask, render_template, url_for
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 import os
+import click
+from config import config_by_name
+from app.database import RoutingSession
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
-def create_app():
+def create_app(config_name=None, config_overrides=None):
     app = Flask(__name__)
-    app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///site.db' 
-    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
-    # Session configuration
-    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
-    app.config['PERMANENT_SESSION_LIFETIME'] = 3600  # 1 hour
+    # Profile from the argument or REWEAR_CONFIG (development/production/testing)
+    config_name = config_name or os.environ.get('REWEAR_CONFIG', 'development')
+    app.config.from_object(config_by_name[config_name])
+
+    # Explicit settings (benchmarks, scripts) win over the profile
+    if config_overrides:
+        app.config.update(config_overrides)
 
     db.init_app(app)
 
+    from .database import init_database
+    init_database(app, db)
+
+    from .startup import init_templates
+    init_templates(app)
+
+    from .replicas import init_replicas
+    init_replicas(app)
+
+    from .metrics import init_metrics
+    init_metrics(app, db)
+
+    from .profiling import init_profiling
+    init_profiling(app)
+
+    from .passwords import init_passwords
+    init_passwords(app)
+
+    from .identity import init_identity
+    init_identity(app)
+
+    from .fragments import init_fragments
+    init_fragments(app)
+
+    from .images import init_images
+    init_images(app)
+
+    from .assets import init_assets
+    init_assets(app)
+
     from .routes.auth import auth
     from .routes.item import item
+    from .routes.admin import admin
+    from .routes.api import api
 
     app.register_blueprint(auth, url_prefix='/auth')
     app.register_blueprint(item, url_prefix='/items')
+    app.register_blueprint(admin, url_prefix='/admin')
+    app.register_blueprint(api, url_prefix='/api/v1')
 
     @app.route("/")
     def root():
         return render_template("items/landing.html")
 
 
-    migrate = Migrate(app, db)
+    from .search import init_search
+    init_search(app)
+
+    from .dataset import init_dataset
+    init_dataset(app)
+
+    from .matching import init_matching
+    init_matching(app)
+
+    from .events import init_events
+    init_events(app)
+
+    from .points import init_points
+    init_points(app)
+
+    from .jobs import init_jobs
+    init_jobs(app)
+
+    from .startup import init_migrations, warm_up
+    init_migrations(app, db)
+
+    # Serving processes only: a CLI command may run before the tables exist
+    if app.config['TEMPLATE_WARMUP'] and click.get_current_context(silent=True) is None:
+        statuses, seconds = warm_up(app)
+        app.logger.info('Warmed up in %.0f ms: %s', seconds * 1000, statuses)
 
     return app
\ No newline at end of file
@@ -0,0 +1,184 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import click
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:  # brotli is optional: without it only gzip siblings are written
+    brotli = None
+
+
+# Built, fingerprinted copies live under static/<ASSET_DIR>
+ASSET_DIR = 'dist'
+ASSET_SOURCES = ('css', 'js', 'images')
+ASSET_EXTENSIONS = ('.css', '.js', '.svg')
+
+# Paths whose names change whenever their content does, so clients may
+# keep them forever (built assets, image variants, uploads)
+IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+# Quoted strings and unquoted url(...) values, which minifying must not touch
+CSS_LITERAL = r"""(?P<literal>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|url\([^)"']*\))"""
+
+
+def _css_sub(pattern, replacement, source, flags=0):
+    """re.sub that copies CSS literals through unchanged"""
+    return re.sub(f'{pattern}|{CSS_LITERAL}',
+                  lambda match: match['literal'] or match.expand(replacement), source, flags=flags)
+
+
+def minify_css(source):
+    source = _css_sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = _css_sub(r'\s+', ' ', source)
+    source = _css_sub(r'\s*([{};,>])\s*', r'\1', source)
+    source = _css_sub(r':\s+', ':', source)
+    return _css_sub(r';}', '}', source).strip()
+
+
+def minify_js(source):
+    """Drop indentation, blank lines and whole-line comments.
+
+    Deliberately conservative (no renaming, no trailing comment removal),
+    and lines inside template literals are kept exactly as written.
+    """
+    lines = []
+    in_template = False
+    for line in source.splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('//'):
+                lines.append(stripped)
+        if line.replace('\\`', '').count('`') % 2:
+            in_template = not in_template
+    return '\n'.join(lines) + '\n'
+
+
+def _round_number(match):
+    value = ('%.1f' % float(match.group())).rstrip('0').rstrip('.')
+    return '0' if value == '-0' else value
+
+
+def minify_svg(source):
+    source = re.sub(r'<!--.*?-->', '', source, flags=re.S)
+    # Path coordinates come out of editors with six decimals, a tenth of
+    # a unit is invisible at any size the logo is shown
+    source = re.sub(r'-?\d+\.\d+', _round_number, source)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'>\s+<', '><', source)
+    return source.strip()
+
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js, '.svg': minify_svg}
+
+
+def _write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build_assets(static_folder):
+    """Minify, fingerprint and precompress the static assets.
+
+    Returns the manifest mapping source names (as passed to
+    url_for('static', filename=...)) to their fingerprinted names. Files
+    from earlier builds are kept, so pages still cached with old asset
+    URLs keep working across deploys.
+    """
+    manifest = {}
+    for source_dir in ASSET_SOURCES:
+        for root, _, files in os.walk(os.path.join(static_folder, source_dir)):
+            for name in sorted(files):
+                stem, ext = os.path.splitext(name)
+                if ext not in ASSET_EXTENSIONS:
+                    continue
+                source_path = os.path.join(root, name)
+                logical = os.path.relpath(source_path, static_folder).replace(os.sep, '/')
+
+                with open(source_path, encoding='utf-8') as f:
+                    data = MINIFIERS[ext](f.read()).encode('utf-8')
+                digest = hashlib.sha256(data).hexdigest()[:12]
+                built = f'{ASSET_DIR}/{os.path.dirname(logical)}/{stem}.{digest}{ext}'
+                built_path = os.path.join(static_folder, built)
+
+                _write(built_path, data)
+                _write(built_path + '.gz', gzip.compress(data, compresslevel=9, mtime=0))
+                if brotli is not None:
+                    _write(built_path + '.br', brotli.compress(data, quality=11))
+                manifest[logical] = built
+
+    _write(os.path.join(static_folder, ASSET_DIR, 'manifest.json'),
+           json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def _is_immutable(app, filename):
+    prefixes = (f'{ASSET_DIR}/', 'images/variants/', f'{app.config["UPLOAD_URL_PATH"]}/')
+    return filename.startswith(prefixes) and not filename.endswith('manifest.json')
+
+
+def init_assets(app):
+    manifest = {}
+    manifest_path = os.path.join(app.static_folder, ASSET_DIR, 'manifest.json')
+    if app.config['STATIC_FINGERPRINTS'] and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    app.extensions['asset_manifest'] = manifest
+
+    # Which compressed siblings each built file has, checked once at startup
+    precompressed = {
+        built: [(name, suffix) for name, suffix in ENCODINGS
+                if os.path.exists(os.path.join(app.static_folder, built + suffix))]
+        for built in manifest.values()
+    }
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        # url_for('static', filename='css/style.css') -> the built copy
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    default_static = app.view_functions['static']
+
+    def static(filename):
+        if not _is_immutable(app, filename):
+            return default_static(filename=filename)
+
+        served_name, encoding = filename, None
+        for name, suffix in precompressed.get(filename, ()):
+            if request.accept_encodings[name]:
+                served_name, encoding = filename + suffix, name
+                break
+
+        response = send_from_directory(app.static_folder, served_name, max_age=IMMUTABLE_MAX_AGE,
+                                       mimetype=mimetypes.guess_type(filename)[0])
+        if filename in precompressed:
+            response.vary.add('Accept-Encoding')
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+    app.view_functions['static'] = static
+
+    @app.cli.group('assets')
+    def assets_group():
+        """Static asset pipeline."""
+
+    @assets_group.command('build')
+    def build_command():
+        """Minify, fingerprint and precompress CSS, JS and SVG assets."""
+        for source, built in build_assets(app.static_folder).items():
+            click.echo(f'{source} -> {built}')
@@ -0,0 +1,88 @@
+from sqlalchemy import select, func, literal, union_all
+from sqlalchemy.orm import joinedload, contains_eager
+from app import db
+from app.models import Item, SwapRequest, SWAP_STATUSES
+
+
+# How many of the user's own swap requests the dashboard lists
+RECENT_OUTGOING_LIMIT = 5
+
+
+def get_swap_stats(user_id):
+    """Count incoming/outgoing swap requests per status in one round trip"""
+    incoming = db.session.query(
+        literal('incoming').label('direction'), SwapRequest.status, func.count().label('total')
+    ).join(Item, SwapRequest.item_id == Item.id).filter(Item.user_id == user_id).group_by(SwapRequest.status)
+
+    outgoing = db.session.query(
+        literal('outgoing').label('direction'), SwapRequest.status, func.count().label('total')
+    ).filter(SwapRequest.requester_id == user_id).group_by(SwapRequest.status)
+
+    stats = {f'{direction}_{status}': 0 for direction in ('incoming', 'outgoing') for status in SWAP_STATUSES}
+    for direction, status, total in db.session.execute(union_all(incoming.statement, outgoing.statement)):
+        stats[f'{direction}_{status}'] = total
+
+    stats['outgoing_total'] = sum(stats[f'outgoing_{status}'] for status in SWAP_STATUSES)
+    stats['completed_total'] = stats['incoming_completed'] + stats['outgoing_completed']
+    return stats
+
+
+def get_pending_counts(user_id):
+    """Map item id -> number of pending requests, for items owned by the user"""
+    rows = db.session.query(SwapRequest.item_id, func.count()) \
+        .join(Item, SwapRequest.item_id == Item.id) \
+        .filter(Item.user_id == user_id, SwapRequest.status == 'pending') \
+        .group_by(SwapRequest.item_id).all()
+    return dict(rows)
+
+
+def load_dashboard(user, batch_size=None):
+    """Everything items/dashboard.html needs, in a fixed number of queries.
+
+    Relationships the template walks (offered_item, requester, item, item.owner)
+    are eager loaded, and the counters come from SQL aggregates, so the query
+    count does not grow with the number of items or swaps the user has.
+
+    With a batch_size the user's items and incoming requests are left as
+    queries that fetch that many rows at a time while the page streams,
+    instead of lists loaded up front.
+    """
+    user_items = Item.query.filter_by(user_id=user.id) \
+        .order_by(Item.created_at.desc(), Item.id.desc())
+
+    # Pending requests for the user's items: the only incoming rows the page lists
+    incoming_requests = SwapRequest.query \
+        .join(Item, SwapRequest.item_id == Item.id) \
+        .filter(Item.user_id == user.id, SwapRequest.status == 'pending') \
+        .options(
+            contains_eager(SwapRequest.item),
+            joinedload(SwapRequest.offered_item),
+            joinedload(SwapRequest.requester)
+        ) \
+        .order_by(SwapRequest.created_at.desc())
+
+    outgoing_requests = SwapRequest.query.filter_by(requester_id=user.id) \
+        .options(
+            joinedload(SwapRequest.offered_item),
+            joinedload(SwapRequest.item).joinedload(Item.owner)
+        ) \
+        .order_by(SwapRequest.created_at.desc(), SwapRequest.id.desc()) \
+        .limit(RECENT_OUTGOING_LIMIT).all()
+
+    if batch_size:
+        item_count = db.session.scalar(select(func.count()).select_from(Item).where(Item.user_id == user.id))
+        user_items = user_items.yield_per(batch_size)
+        incoming_requests = incoming_requests.yield_per(batch_size)
+    else:
+        user_items = user_items.all()
+        incoming_requests = incoming_requests.all()
+        item_count = len(user_items)
+
+    return {
+        'user_items': user_items,
+        'item_count': item_count,
+        'incoming_requests': incoming_requests,
+        'outgoing_requests': outgoing_requests,
+        'stats': get_swap_stats(user.id),
+        'pending_counts': get_pending_counts(user.id)
+    }
@@ -0,0 +1,49 @@
+from flask import g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+# SQLALCHEMY_BINDS key of the read replica (see app/replicas.py)
+REPLICA_BIND = 'replica'
+
+
+def set_sqlite_pragmas(engine, pragmas):
+    """Run the configured PRAGMAs on every new connection of a SQLite engine"""
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+def init_database(app, db):
+    """Hook per-connection settings onto every engine Flask-SQLAlchemy created"""
+    with app.app_context():
+        for engine in db.engines.values():
+            set_sqlite_pragmas(engine, app.config.get('SQLITE_PRAGMAS'))
+
+
+class RoutingSession(Session):
+    """Session that sends a request's plain SELECTs to the replica bind.
+
+    Only when the request opted in by setting g.read_from_replica (GET
+    requests while the replica is fresh). Flushes, INSERT/UPDATE/DELETE and
+    SELECT ... FOR UPDATE always run on the primary, and the first of them
+    turns the flag off, so a request reads its own writes from then on.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            writing = self._flushing or getattr(clause, 'is_dml', False) or \
+                getattr(clause, '_for_update_arg', None) is not None
+            if writing:
+                g.db_wrote = True
+                g.read_from_replica = False
+            elif g.get('read_from_replica') and getattr(clause, 'is_select', False):
+                replica = self._db.engines.get(REPLICA_BIND)
+                if replica is not None:
+                    return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
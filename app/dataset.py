@@ -0,0 +1,343 @@
+import csv
+import json
+import os
+import random
+import time
+from array import array
+from datetime import datetime, timedelta
+from itertools import islice
+
+import click
+from sqlalchemy import insert, select, func, text
+
+from app import db
+from app.models import User, Item, SwapRequest
+from app.passwords import hash_password
+from app.search import ensure_search_index, SEARCH_TRIGGERS
+from app.http_cache import touch_catalog
+
+
+# Load order (foreign keys) and the file each table is exported to
+TABLES = (('users', User.__table__), ('items', Item.__table__), ('swap_requests', SwapRequest.__table__))
+FORMATS = ('jsonl', 'csv')
+
+# Realistic-looking mix for synthetic data; categories and sizes must stay
+# inside the CHECK constraints on items
+CATEGORY_WEIGHTS = {'male': 40, 'female': 45, 'kids': 15}
+SIZE_WEIGHTS = {'S': 25, 'M': 35, 'L': 25, 'XL': 15}
+STATUS_WEIGHTS = {'pending': 30, 'completed': 20, 'declined': 50}
+# Most listings already went through moderation, a backlog still waits
+ITEM_STATUS_WEIGHTS = {'approved': 95, 'pending': 4, 'rejected': 1}
+
+# Item owner = int(users * random() ** OWNER_SKEW): with 2.5 the busiest
+# 10% of users own ~40% of the items, like a real marketplace
+OWNER_SKEW = 2.5
+
+COLORS = ('Black', 'White', 'Navy', 'Red', 'Olive', 'Beige', 'Grey', 'Pink', 'Blue', 'Green', 'Mustard', 'Burgundy')
+ADJECTIVES = ('Vintage', 'Classic', 'Oversized', 'Slim', 'Cozy', 'Summer', 'Winter', 'Casual', 'Elegant', 'Sporty')
+GARMENTS = {
+    'male': ('Shirt', 'Jeans', 'Hoodie', 'Blazer', 'Chinos', 'T-Shirt', 'Jacket', 'Sweater'),
+    'female': ('Dress', 'Blouse', 'Skirt', 'Cardigan', 'Jeans', 'Coat', 'Jumpsuit', 'Top'),
+    'kids': ('Hoodie', 'Dungarees', 'T-Shirt', 'Raincoat', 'Pyjamas', 'Shorts', 'Jumper', 'Dress'),
+}
+CONDITIONS = ('like new', 'worn a few times', 'in good condition', 'with light signs of wear')
+
+SYNTHETIC_PASSWORD = 'password123'
+
+
+def _pool(weights):
+    # Each value repeated by its weight: one rng.choice() per draw, no cumulative sums
+    return tuple(value for value, weight in weights.items() for _ in range(weight))
+
+
+CATEGORY_POOL = _pool(CATEGORY_WEIGHTS)
+SIZE_POOL = _pool(SIZE_WEIGHTS)
+STATUS_POOL = _pool(STATUS_WEIGHTS)
+ITEM_STATUS_POOL = _pool(ITEM_STATUS_WEIGHTS)
+
+
+def generate_users(count, first_id, password_hash, seed=0, now=None):
+    """Yield user rows; every account shares one precomputed password hash"""
+    rng = random.Random(seed)
+    now = now or datetime.utcnow()
+    span = timedelta(days=730).total_seconds()
+    for n in range(count):
+        user_id = first_id + n
+        yield {
+            'id': user_id,
+            'username': f'user{user_id:07d}',
+            'email': f'user{user_id}@example.test',
+            'password': password_hash,
+            'points': min(5000, int(rng.lognormvariate(4.5, 0.8))),
+            'is_admin': False,
+            'created_at': now - timedelta(seconds=span * (1 - n / count) + rng.random() * 3600),
+        }
+
+
+def generate_items(count, first_id, user_ids, owners, seed=0, now=None):
+    """Yield item rows with skewed ownership, recording each owner in `owners`.
+
+    `user_ids` is the (first, last) id range to draw owners from and
+    `owners` an array('l') the swap generator later reads, so memory stays
+    at one integer per item however many rows are produced.
+    """
+    rng = random.Random(seed + 1)
+    now = now or datetime.utcnow()
+    span = timedelta(days=365).total_seconds()
+    first_user, last_user = user_ids
+    user_count = last_user - first_user + 1
+    for n in range(count):
+        category = rng.choice(CATEGORY_POOL)
+        garment = rng.choice(GARMENTS[category])
+        color = rng.choice(COLORS)
+        owner = first_user + min(user_count - 1, int(user_count * rng.random() ** OWNER_SKEW))
+        owners.append(owner)
+        yield {
+            'id': first_id + n,
+            'user_id': owner,
+            'title': f'{rng.choice(ADJECTIVES)} {color} {garment}',
+            'description': f'{color} {garment.lower()}, {rng.choice(CONDITIONS)}.',
+            'category': category,
+            'size': rng.choice(SIZE_POOL),
+            'image_url': None,
+            'image_hash': None,
+            'points_cost': max(10, min(500, int(rng.lognormvariate(4.2, 0.6)))),
+            'status': rng.choice(ITEM_STATUS_POOL),
+            # Newer ids are newer listings, as they would be in production
+            'created_at': now - timedelta(seconds=span * (1 - n / count) + rng.random() * 60),
+            'updated_at': now,
+        }
+
+
+def generate_swaps(count, first_id, first_item_id, owners, seed=0, now=None):
+    """Yield swap requests where the requester owns the offered item and
+    never also owns the requested one"""
+    rng = random.Random(seed + 2)
+    now = now or datetime.utcnow()
+    span = timedelta(days=365).total_seconds()
+    item_count = len(owners)
+    if item_count < 2:
+        return
+    offered_pending = bytearray(item_count)  # uq_swap_requests_pending_offer: one pending offer per item
+    n = 0
+    while n < count:
+        wanted = rng.randrange(item_count)
+        offered = rng.randrange(item_count)
+        if owners[wanted] == owners[offered]:
+            continue
+        status = rng.choice(STATUS_POOL)
+        if status == 'pending':
+            if offered_pending[offered]:
+                status = 'declined'
+            offered_pending[offered] = 1
+        yield {
+            'id': first_id + n,
+            'requester_id': owners[offered],
+            'item_id': first_item_id + wanted,
+            'offered_item_id': first_item_id + offered,
+            'status': status,
+            # Sometime after the newer of the two items was listed
+            'created_at': now - timedelta(seconds=span * (1 - max(wanted, offered) / item_count) * rng.random()),
+        }
+        n += 1
+
+
+def _batches(rows, size):
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+def load_rows(table, rows, batch_size=5000, commit_every=100000):
+    """Insert rows with executemany batches, committing every `commit_every` rows"""
+    loaded = pending = 0
+    for batch in _batches(rows, batch_size):
+        db.session.execute(insert(table), batch)
+        loaded += len(batch)
+        pending += len(batch)
+        if pending >= commit_every:
+            db.session.commit()
+            pending = 0
+    db.session.commit()
+    return loaded
+
+
+def _bulk_load_mode():
+    """Per-connection SQLite settings for the loader, and no FTS triggers.
+
+    The full-text index is rebuilt in one pass once loading is done, which
+    is far cheaper than updating it row by row through the triggers.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name != 'sqlite':
+        return
+    connection.exec_driver_sql('PRAGMA synchronous = OFF')
+    connection.exec_driver_sql('PRAGMA cache_size = -65536')
+    for trigger in SEARCH_TRIGGERS:
+        connection.exec_driver_sql(f'DROP TRIGGER IF EXISTS {trigger}')
+    db.session.commit()
+
+
+def _finish_bulk_load():
+    """Undo _bulk_load_mode; callers run it in a finally, so a failed load still gets its triggers back"""
+    db.session.rollback()  # Whatever batch the failure interrupted
+    touch_catalog()
+    ensure_search_index(db.session.connection(), rebuild=True)
+    db.session.commit()
+    if db.session.connection().dialect.name == 'sqlite':
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+
+
+def _next_id(model):
+    return (db.session.scalar(select(func.max(model.id))) or 0) + 1
+
+
+def synthetic_rows(users, items, swaps, first_ids=(1, 1, 1), seed=0):
+    """(name, table, rows) per table, rows generated lazily in load order"""
+    password_hash = hash_password(SYNTHETIC_PASSWORD)
+    now = datetime.utcnow()
+    first_user, first_item, first_swap = first_ids
+    owners = array('l')
+    sources = (
+        generate_users(users, first_user, password_hash, seed, now),
+        generate_items(items, first_item, (first_user, first_user + users - 1), owners, seed, now),
+        generate_swaps(swaps, first_swap, first_item, owners, seed, now),
+    )
+    return [(name, table, rows) for (name, table), rows in zip(TABLES, sources)]
+
+
+def load_synthetic(users, items, swaps, seed=0, batch_size=5000, report=None):
+    """Bulk load a synthetic dataset after the existing rows.
+
+    Returns the first new (user, item, swap) ids. `report(name, count,
+    started)` is called after each table when given.
+    """
+    first_ids = (_next_id(User), _next_id(Item), _next_id(SwapRequest))
+    _bulk_load_mode()
+    try:
+        for name, table, rows in synthetic_rows(users, items, swaps, first_ids, seed):
+            started = time.perf_counter()
+            count = load_rows(table, rows, batch_size)
+            if report:
+                report(name, count, started)
+    finally:
+        started = time.perf_counter()
+        _finish_bulk_load()
+    if report:
+        report('search index', items, started)
+    return first_ids
+
+
+def _encode(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def write_rows(path, rows, fmt, columns):
+    """Stream rows to a JSONL or CSV file, one line per row"""
+    written = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if fmt == 'csv':
+            writer = csv.writer(f)
+            writer.writerow(columns)
+            for row in rows:
+                writer.writerow(['' if row[c] is None else _encode(row[c]) for c in columns])
+                written += 1
+        else:
+            for row in rows:
+                f.write(json.dumps({c: _encode(row[c]) for c in columns}, separators=(',', ':')))
+                f.write('\n')
+                written += 1
+    return written
+
+
+def read_rows(path, fmt, table):
+    """Stream rows back from a file written by write_rows()"""
+    parsers = {}
+    for column in table.columns:
+        python_type = column.type.python_type
+        if python_type is datetime:
+            parsers[column.name] = datetime.fromisoformat
+        elif python_type is bool:
+            parsers[column.name] = lambda v: v if isinstance(v, bool) else v in ('1', 'True', 'true')
+        elif python_type is int:
+            parsers[column.name] = int
+
+    with open(path, newline='', encoding='utf-8') as f:
+        lines = csv.DictReader(f) if fmt == 'csv' else (json.loads(line) for line in f if line.strip())
+        for raw in lines:
+            row = {}
+            for name, value in raw.items():
+                if value is None or (fmt == 'csv' and value == ''):
+                    row[name] = None
+                else:
+                    parse = parsers.get(name)
+                    row[name] = parse(value) if parse else value
+            yield row
+
+
+def _report(name, count, started):
+    elapsed = time.perf_counter() - started
+    click.echo(f'{name}: {count} rows in {elapsed:.1f}s ({count / elapsed if elapsed else 0:,.0f} rows/s)')
+
+
+def init_dataset(app):
+    @app.cli.group('dataset')
+    def dataset_command():
+        """Generate, export and import large synthetic datasets."""
+
+    @dataset_command.command('generate')
+    @click.option('--users', default=1000, show_default=True)
+    @click.option('--items', default=20000, show_default=True)
+    @click.option('--swaps', default=50000, show_default=True)
+    @click.option('--seed', default=0, show_default=True, help='Random seed, same seed = same data')
+    @click.option('--out', type=click.Path(file_okay=False), help='Write files here instead of loading the database')
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default='jsonl', show_default=True)
+    @click.option('--batch-size', default=5000, show_default=True)
+    def generate_command(users, items, swaps, seed, out, fmt, batch_size):
+        """Create synthetic users, items and swap requests."""
+        if out:
+            os.makedirs(out, exist_ok=True)
+            for name, table, rows in synthetic_rows(users, items, swaps, seed=seed):
+                started = time.perf_counter()
+                count = write_rows(os.path.join(out, f'{name}.{fmt}'), rows, fmt, [c.name for c in table.columns])
+                _report(name, count, started)
+        else:
+            load_synthetic(users, items, swaps, seed, batch_size, report=_report)
+        click.echo(f'Synthetic accounts use the password "{SYNTHETIC_PASSWORD}"')
+
+    @dataset_command.command('export')
+    @click.argument('directory', type=click.Path(file_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default='jsonl', show_default=True)
+    @click.option('--batch-size', default=5000, show_default=True)
+    def export_command(directory, fmt, batch_size):
+        """Stream users, items and swap requests to DIRECTORY."""
+        os.makedirs(directory, exist_ok=True)
+        for name, table in TABLES:
+            started = time.perf_counter()
+            result = db.session.execute(
+                select(table).order_by(table.c.id).execution_options(yield_per=batch_size)
+            )
+            count = write_rows(os.path.join(directory, f'{name}.{fmt}'), (row._mapping for row in result),
+                               fmt, [c.name for c in table.columns])
+            _report(name, count, started)
+
+    @dataset_command.command('import')
+    @click.argument('directory', type=click.Path(exists=True, file_okay=False))
+    @click.option('--format', 'fmt', type=click.Choice(FORMATS), default='jsonl', show_default=True)
+    @click.option('--batch-size', default=5000, show_default=True)
+    def import_command(directory, fmt, batch_size):
+        """Bulk load files written by `dataset export` or `dataset generate --out`."""
+        _bulk_load_mode()
+        try:
+            for name, table in TABLES:
+                path = os.path.join(directory, f'{name}.{fmt}')
+                if not os.path.exists(path):
+                    continue
+                started = time.perf_counter()
+                _report(name, load_rows(table, read_rows(path, fmt, table), batch_size), started)
+        finally:
+            _finish_bulk_load()
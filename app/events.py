@@ -0,0 +1,375 @@
+import asyncio
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+from urllib.parse import urlsplit, parse_qs
+import click
+from flask import Response, g, request, session, current_app
+from sqlalchemy import event, insert, select, delete, literal, func, or_
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Item, SwapRequest, SwapEvent
+
+
+EVENT_FIELDS = ('id', 'swap_id', 'kind', 'requester_id', 'owner_id', 'item_id', 'offered_item_id', 'created_at')
+EVENT_COLUMNS = [getattr(SwapEvent, name) for name in EVENT_FIELDS]
+
+# Request ids bound per INSERT ... SELECT (SQLite allows 32766 parameters)
+RECORD_CHUNK = 5000
+
+# Events read per poll; a full batch polls again right away
+POLL_BATCH = 1000
+
+# How often a running broker deletes events older than EVENTS_RETENTION
+PRUNE_EVERY = 60
+
+# Brokers of this process, woken right after a local commit recorded events
+_brokers = []
+
+
+def record_swap_events(kind, swap_ids):
+    """Add a `kind` event for each request in `swap_ids` to the current transaction.
+
+    One INSERT ... SELECT per chunk, whatever the number of requests. The
+    owner is read from the wanted item, so record before ownership moves
+    and before a cancelled request is deleted.
+    """
+    swap_ids = list(swap_ids)
+    requests, items = SwapRequest.__table__, Item.__table__
+    now = datetime.utcnow()
+    for start in range(0, len(swap_ids), RECORD_CHUNK):
+        rows = select(
+            requests.c.id, literal(kind), requests.c.requester_id, items.c.user_id,
+            requests.c.item_id, requests.c.offered_item_id, literal(now, SwapEvent.created_at.type)
+        ).join(items, items.c.id == requests.c.item_id).where(requests.c.id.in_(swap_ids[start:start + RECORD_CHUNK]))
+        db.session.execute(insert(SwapEvent.__table__).from_select(
+            ['swap_id', 'kind', 'requester_id', 'owner_id', 'item_id', 'offered_item_id', 'created_at'], rows))
+        db.session.info['swap_events'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_brokers(session):
+    # Subscribers in this process hear about it now, other workers at their next poll
+    if session.info.pop('swap_events', False):
+        for broker in _brokers:
+            broker.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_events(session):
+    session.info.pop('swap_events', None)
+
+
+def latest_event_id():
+    return db.session.scalar(select(func.max(SwapEvent.id))) or 0
+
+
+def fetch_events(after_id, user_id=None, until_id=None, limit=1000):
+    """Events after `after_id` in id order, optionally only those involving `user_id`"""
+    query = select(*EVENT_COLUMNS).where(SwapEvent.id > after_id).order_by(SwapEvent.id).limit(limit)
+    if user_id is not None:
+        query = query.where(or_(SwapEvent.requester_id == user_id, SwapEvent.owner_id == user_id))
+    if until_id is not None:
+        query = query.where(SwapEvent.id <= until_id)
+    return db.session.execute(query).all()
+
+
+def sse_frame(row):
+    data = {name: value.isoformat() if isinstance(value, datetime) else value for name, value in zip(EVENT_FIELDS, row)}
+    return f"id: {row.id}\nevent: swap\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+# Tells the client it missed more than a replay covers and should reload
+RESYNC_FRAME = 'event: resync\ndata: {}\n\n'
+PING_FRAME = ': ping\n\n'
+
+
+class SwapEventBroker:
+    """In-process pub/sub for swap events, fed from the swap_events table.
+
+    One thread per process tails the table by id every `interval` seconds
+    (and right after a local commit recorded events), but only while
+    someone in the process is subscribed. The swap_events table is the
+    cross-worker bus: every worker and `flask events serve` sees the same
+    rows in the same order, since SQLite commits writers one at a time.
+    Each event is encoded once and handed to the callbacks of its requester
+    and owner, so an idle subscriber costs one dict entry here and no
+    database connection.
+    """
+
+    def __init__(self, app, interval=0.5, retention=86400):
+        self.app = app
+        self.interval = interval
+        self.retention = timedelta(seconds=retention)
+        self._subscribers = {}  # user id -> {callback: id of the last event it has}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._last_id = None
+        self._pruned_at = 0
+        _brokers.append(self)
+
+    @property
+    def subscriber_count(self):
+        with self._lock:
+            return sum(len(callbacks) for callbacks in self._subscribers.values())
+
+    def subscribe(self, user_id, callback, since_id):
+        """Call `callback(event_id, frame)` for the user's events from now on.
+
+        `since_id` is the last event the subscriber has seen. Returns the id
+        the live feed continues after: the subscriber replays the events in
+        between itself (fetch_events(since_id, user_id, until_id=...)).
+        Callbacks run on the broker thread and must not block.
+        """
+        with self._lock:
+            self._subscribers.setdefault(user_id, {})[callback] = since_id
+            if self._last_id is None:
+                self._last_id = since_id
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='swap-events', daemon=True)
+                self._thread.start()
+            return self._last_id
+
+    def unsubscribe(self, user_id, callback):
+        with self._lock:
+            callbacks = self._subscribers.get(user_id)
+            if callbacks is not None:
+                callbacks.pop(callback, None)
+                if not callbacks:
+                    del self._subscribers[user_id]
+
+    def wake(self):
+        self._wake.set()
+
+    def _run(self):
+        with self.app.app_context():
+            while True:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                try:
+                    self.poll()
+                except Exception:
+                    self.app.logger.exception('Swap event poll failed')
+                finally:
+                    db.session.remove()
+
+    def poll(self):
+        """Deliver the events committed since the last poll, returns how many"""
+        with self._lock:
+            if not self._subscribers:
+                self._last_id = None  # Nobody listening: nothing to keep up with
+                return 0
+            after_id = self._last_id
+
+        rows = fetch_events(after_id, limit=POLL_BATCH)
+        if rows:
+            with self._lock:
+                for row in rows:
+                    frame = sse_frame(row)
+                    for user_id in {row.requester_id, row.owner_id}:
+                        for callback, since_id in self._subscribers.get(user_id, {}).items():
+                            if row.id > since_id:  # Joined while the feed was catching up
+                                callback(row.id, frame)
+                self._last_id = rows[-1].id
+            if len(rows) == POLL_BATCH:
+                self._wake.set()
+
+        if time.monotonic() - self._pruned_at > PRUNE_EVERY:
+            self._pruned_at = time.monotonic()
+            db.session.execute(delete(SwapEvent).where(SwapEvent.created_at < datetime.utcnow() - self.retention))
+            db.session.commit()
+        return len(rows)
+
+
+class StreamQueue:
+    """Frames waiting for one blocking (thread or greenlet) stream"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.overflowed = False
+        self._frames = deque()
+        self._ready = threading.Condition()
+
+    def __call__(self, event_id, frame):
+        with self._ready:
+            if len(self._frames) >= self.limit:
+                self.overflowed = True  # The client catches up from Last-Event-ID instead
+            else:
+                self._frames.append(frame)
+            self._ready.notify()
+
+    def get(self, timeout):
+        with self._ready:
+            if not self._frames and not self.overflowed:
+                self._ready.wait(timeout)
+            frames = list(self._frames)
+            self._frames.clear()
+            return frames
+
+
+def parse_last_event_id(value):
+    try:
+        return max(0, int(value)) if value else None
+    except ValueError:
+        return None
+
+
+def open_stream(broker, user_id, last_event_id, callback, replay_limit):
+    """Subscribe and build the opening frames (backlog since `last_event_id`)"""
+    since_id = latest_event_id() if last_event_id is None else last_event_id
+    position = broker.subscribe(user_id, callback, since_id)
+    backlog = fetch_events(since_id, user_id, until_id=position, limit=replay_limit + 1)
+    db.session.remove()  # Streams never hold a database connection
+    if len(backlog) > replay_limit:
+        return 'retry: 3000\n\n' + RESYNC_FRAME
+    return 'retry: 3000\n\n' + ''.join(sse_frame(row) for row in backlog)
+
+
+class EventStreamServer:
+    """`flask events serve`: the stream endpoint on a single asyncio loop.
+
+    A parked stream is a socket, a coroutine and a queue, so thousands of
+    idle subscribers take a few megabytes and no threads. Sessions are
+    read from the same signed cookie the app sets; run it behind the proxy
+    at EVENTS_PATH next to the WSGI workers.
+    """
+
+    def __init__(self, app, broker):
+        self.app = app
+        self.broker = broker
+        self.path = app.config['EVENTS_PATH']
+        self.heartbeat = app.config['EVENTS_HEARTBEAT']
+        self.max_age = app.config['EVENTS_STREAM_MAX_AGE']
+        self.queue_size = app.config['EVENTS_QUEUE_SIZE']
+        self.replay_limit = app.config['EVENTS_REPLAY_LIMIT']
+
+    def session_user(self, cookie):
+        with self.app.test_request_context(headers={'Cookie': cookie} if cookie else {}):
+            return session.get('user_id')
+
+    def prepare(self, user_id, last_event_id, callback):
+        with self.app.app_context():
+            return open_stream(self.broker, user_id, last_event_id, callback, self.replay_limit)
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        user_id = callback = None
+        try:
+            head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 10)
+            lines = head.decode('latin-1').split('\r\n')
+            method, target, _ = lines[0].split(' ', 2)
+            headers = {name.strip().lower(): value.strip()
+                       for name, _, value in (line.partition(':') for line in lines[1:] if line)}
+            url = urlsplit(target)
+            if method != 'GET' or url.path != self.path:
+                writer.write(b'HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+            user_id = self.session_user(headers.get('cookie'))
+            if user_id is None:
+                writer.write(b'HTTP/1.1 401 Unauthorized\r\nContent-Length: 0\r\nConnection: close\r\n\r\n')
+                return
+
+            queue = asyncio.Queue()
+
+            def put(frame):
+                queue.put_nowait(None if queue.qsize() >= self.queue_size else frame)
+
+            def callback(event_id, frame):
+                loop.call_soon_threadsafe(put, frame)
+
+            last_event_id = parse_last_event_id(headers.get('last-event-id') or
+                                                parse_qs(url.query).get('last_event_id', [None])[0])
+            opening = await loop.run_in_executor(None, self.prepare, user_id, last_event_id, callback)
+            writer.write(b'HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n'
+                         b'X-Accel-Buffering: no\r\nConnection: close\r\n\r\n' + opening.encode())
+            await writer.drain()
+
+            deadline = loop.time() + self.max_age
+            while loop.time() < deadline:
+                try:
+                    frame = await asyncio.wait_for(queue.get(), self.heartbeat)
+                except asyncio.TimeoutError:
+                    frame = PING_FRAME
+                frames = [frame]
+                while not queue.empty():
+                    frames.append(queue.get_nowait())
+                if None in frames:
+                    break  # Fell behind: the client reconnects and replays
+                writer.write(''.join(frames).encode())
+                await writer.drain()
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError, ConnectionError):
+            pass
+        finally:
+            if callback is not None:
+                self.broker.unsubscribe(user_id, callback)
+            writer.close()
+
+    async def serve(self, host, port):
+        server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        async with server:
+            await server.serve_forever()
+
+
+def get_broker(app=None):
+    return (app or current_app).extensions['swap_events']
+
+
+def register_stream_route(app):
+    """Serve EVENTS_PATH from the WSGI workers (one parked thread per open stream)"""
+    @app.route(app.config['EVENTS_PATH'])
+    def swapEventStream():
+        """Server-Sent Events for the logged in user's swaps.
+
+        Served by any WSGI worker, where each open stream parks a thread
+        (or a greenlet under a gevent worker); `flask events serve` holds
+        them on an asyncio loop instead.
+        """
+        user_id = session.get('user_id')
+        if user_id is None:
+            return Response('Authentication required', 401)
+
+        # The replay has to see every event the broker may send next, so not a lagging replica
+        g.read_from_replica = False
+        queue = StreamQueue(app.config['EVENTS_QUEUE_SIZE'])
+        broker = get_broker()
+        last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID') or request.args.get('last_event_id'))
+        opening = open_stream(broker, user_id, last_event_id, queue, app.config['EVENTS_REPLAY_LIMIT'])
+        heartbeat, max_age = app.config['EVENTS_HEARTBEAT'], app.config['EVENTS_STREAM_MAX_AGE']
+
+        def stream():
+            try:
+                yield opening
+                deadline = time.monotonic() + max_age
+                while time.monotonic() < deadline:
+                    frames = queue.get(heartbeat)
+                    if queue.overflowed:
+                        return
+                    yield ''.join(frames) if frames else PING_FRAME
+            finally:
+                broker.unsubscribe(user_id, queue)
+
+        return Response(stream(), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+def init_events(app):
+    """Create the process broker, the WSGI stream route (EVENTS_WSGI_STREAM) and `flask events serve`"""
+    app.extensions['swap_events'] = SwapEventBroker(app, app.config['EVENTS_POLL_INTERVAL'],
+                                                    app.config['EVENTS_RETENTION'])
+    if app.config['EVENTS_WSGI_STREAM']:
+        register_stream_route(app)
+
+    @app.cli.group('events')
+    def events_group():
+        """Swap event notifications."""
+
+    @events_group.command('serve')
+    @click.option('--host', default='127.0.0.1', show_default=True)
+    @click.option('--port', default=5001, show_default=True)
+    def serve_command(host, port):
+        """Serve the event stream from an asyncio loop (route EVENTS_PATH here)."""
+        click.echo(f"Streaming swap events on http://{host}:{port}{app.config['EVENTS_PATH']}")
+        asyncio.run(EventStreamServer(app, get_broker(app)).serve(host, port))
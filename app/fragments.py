@@ -0,0 +1,136 @@
+import threading
+from collections import OrderedDict
+from flask import current_app, url_for
+from markupsafe import Markup
+
+
+# Marks where the per-viewer "Edit" button goes inside a cached card
+EDIT_SLOT = '<!--edit-slot-->'
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered HTML fragments, bounded by entries and bytes.
+
+    Keys are (kind, item_id, version). The version is a fingerprint of the
+    columns the fragment displays, so an entry can never be served for a row
+    that changed, even when the change happened in another worker process.
+    Write paths still call invalidate_item() so dead entries are freed
+    straight away instead of waiting to be evicted.
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=32 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._by_item = {}
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value[0]
+
+    def set(self, key, fragment):
+        size = sum(len(part) for part in fragment)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (fragment, size)
+            self._by_item.setdefault(key[1], set()).add(key)
+            self._size += size
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                self._discard(next(iter(self._entries)))
+
+    def invalidate_item(self, item_id):
+        with self._lock:
+            for key in list(self._by_item.get(item_id, ())):
+                self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_item.clear()
+            self._size = 0
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._size -= entry[1]
+        keys = self._by_item.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_item[key[1]]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def get_fragment_cache():
+    return current_app.extensions['fragment_cache']
+
+
+def invalidate_items(*item_ids):
+    """Drop cached fragments for items changed by a write path"""
+    cache = get_fragment_cache()
+    for item_id in item_ids:
+        cache.invalidate_item(item_id)
+
+
+def _card_version(it):
+    return (it.title, it.category, it.size, it.points_cost, it.image_url, it.image_hash)
+
+
+def _cached_fragment(kind, template_name, it):
+    """(before edit slot, edit button, after edit slot) for one item"""
+    cache = get_fragment_cache()
+    key = (kind, it.id, _card_version(it))
+    fragment = cache.get(key)
+    if fragment is None:
+        html = current_app.jinja_env.get_template(template_name).render(it=it)
+        head, _, tail = html.partition(EDIT_SLOT)
+        edit = f'<a class="btn secondary" href="{url_for("item.renderEditPage", item_id=it.id)}">Edit</a>'
+        fragment = (head, edit, tail)
+        cache.set(key, fragment)
+    return fragment
+
+
+def render_listing_cards(items, current_user=None):
+    """Listing grid cards, served from the fragment cache when warm"""
+    viewer_id = current_user.id if current_user else None
+    parts = []
+    for it in items:
+        head, edit, tail = _cached_fragment('listing-card', 'items/_listing_card.html', it)
+        parts.append(head)
+        if viewer_id is not None and viewer_id == it.user_id:
+            parts.append(edit)
+        parts.append(tail)
+    return Markup(''.join(parts))
+
+
+def render_swap_item_cards(items):
+    """Cards of the viewer's own items in the swap modal on items/show.html"""
+    parts = []
+    for it in items:
+        head, _, tail = _cached_fragment('swap-card', 'items/_swap_item_card.html', it)
+        parts.append(head + tail)
+    return Markup(''.join(parts))
+
+
+def init_fragments(app):
+    app.extensions['fragment_cache'] = FragmentCache(
+        max_entries=app.config['FRAGMENT_CACHE_MAX_ENTRIES'],
+        max_bytes=app.config['FRAGMENT_CACHE_MAX_BYTES']
+    )
+    app.jinja_env.globals['listing_cards'] = render_listing_cards
+    app.jinja_env.globals['swap_item_cards'] = render_swap_item_cards
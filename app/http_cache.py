@@ -0,0 +1,102 @@
+import hashlib
+from datetime import datetime
+from flask import request, session, make_response, current_app
+from sqlalchemy import event, update, insert
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Item, CatalogState
+
+
+CATALOG_STATE_ID = 1
+
+
+def touch_catalog(session=None):
+    """Bump the catalog version inside the current transaction"""
+    session = session or db.session
+    now = datetime.utcnow()
+    bumped = session.execute(
+        update(CatalogState).where(CatalogState.id == CATALOG_STATE_ID)
+        .values(version=CatalogState.version + 1, changed_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not bumped:
+        session.execute(insert(CatalogState).values(id=CATALOG_STATE_ID, version=1, changed_at=now))
+
+
+def get_catalog_state():
+    """(version, changed_at) of the catalog, one primary key lookup"""
+    row = db.session.execute(
+        db.select(CatalogState.version, CatalogState.changed_at).where(CatalogState.id == CATALOG_STATE_ID)
+    ).first()
+    if row is None:
+        return 0, datetime(2025, 1, 1)
+    return row.version, row.changed_at
+
+
+@event.listens_for(Session, 'before_flush')
+def touch_catalog_on_item_change(session, flush_context, instances):
+    # ORM writes to items bump the version automatically; bulk UPDATEs
+    # (e.g. the swap engine) call touch_catalog() themselves
+    changed = any(isinstance(obj, Item) for obj in session.new) \
+        or any(isinstance(obj, Item) for obj in session.deleted) \
+        or any(isinstance(obj, Item) and session.is_modified(obj) for obj in session.dirty)
+    if changed:
+        touch_catalog(session)
+
+
+def make_etag(*parts):
+    release = current_app.config.get('CACHE_RELEASE', '')
+    return hashlib.sha1(repr((release,) + parts).encode()).hexdigest()[:20]
+
+
+def _is_public():
+    # Only anonymous responses without pending flash messages may be shared
+    return 'user_id' not in session and not session.get('_flashes')
+
+
+def _set_validators(response, etag, last_modified):
+    # Weak: the tag stands for what the page shows, not its bytes, which
+    # differ between the gzip, br and identity encodings of a streamed page
+    response.set_etag(etag, weak=True)
+    response.last_modified = last_modified
+    if _is_public():
+        max_age = current_app.config['BROWSE_CACHE_MAX_AGE']
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        response.cache_control.s_maxage = current_app.config['BROWSE_CACHE_SHARED_MAX_AGE']
+    else:
+        # Personalised page: browsers may keep it but must revalidate
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def not_modified(etag, last_modified):
+    """A 304 response when the client's copy is current, otherwise None.
+
+    Called before any template is rendered, so a revalidation costs only
+    the queries needed to build the validators.
+    """
+    if session.get('_flashes'):
+        # The cached copy can't contain the message waiting to be shown
+        return None
+
+    if request.if_none_match:
+        # If-None-Match compares weakly, so W/"x" and "x" both match
+        fresh = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and _is_public():
+        # Last-Modified only tracks the catalog, not the viewer, so it can
+        # only validate the shared anonymous page
+        fresh = last_modified.replace(microsecond=0) <= request.if_modified_since.replace(tzinfo=None)
+    else:
+        fresh = False
+
+    if not fresh:
+        return None
+    return _set_validators(make_response('', 304), etag, last_modified)
+
+
+def with_validators(body, etag, last_modified):
+    """Wrap a rendered page with ETag/Last-Modified/Cache-Control headers"""
+    return _set_validators(make_response(body), etag, last_modified)
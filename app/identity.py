@@ -0,0 +1,167 @@
+import time
+from collections import namedtuple
+from flask import g, session, has_request_context, current_app
+from sqlalchemy import event, select, inspect
+from app import db
+from app.models import User
+
+
+# Bump when the snapshot layout changes so old cookies are simply reloaded
+IDENTITY_SNAPSHOT_VERSION = 2
+
+# The few user fields that pages render on every request
+Identity = namedtuple('Identity', ['id', 'username', 'is_admin', 'points'])
+
+_SNAPSHOT_FIELDS = ('username', 'is_admin', 'points')
+
+# user id -> (identity_version, balance, monotonic time read) as last read
+# from the row by this process; bounded by clearing it when it gets large
+_verified = {}
+_VERIFIED_LIMIT = 10000
+
+
+def _snapshot(user):
+    return {
+        'v': IDENTITY_SNAPSHOT_VERSION,
+        'id': user.id,
+        'username': user.username,
+        'is_admin': user.is_admin,
+        'points': user.balance,
+        'iv': user.identity_version,
+        'ts': int(time.time())
+    }
+
+
+def remember_user(user):
+    """Store the logged in user id plus a fresh identity snapshot in the session"""
+    session['user_id'] = user.id
+    session['identity'] = _snapshot(user)
+    g._identity = Identity(user.id, user.username, user.is_admin, user.balance)
+
+
+def get_current_user():
+    """The logged in User row, loaded at most once per request"""
+    if 'user_id' not in session:
+        return None
+
+    if '_current_user' not in g:
+        user = db.session.get(User, session['user_id'])
+        g._current_user = user
+        if user is not None:
+            identity = Identity(user.id, user.username, user.is_admin, user.balance)
+            # Only rewrite the cookie when the snapshot actually went stale
+            snapshot = session.get('identity')
+            if not snapshot or snapshot.get('v') != IDENTITY_SNAPSHOT_VERSION or \
+                    snapshot.get('iv') != user.identity_version or \
+                    Identity(snapshot.get('id'), snapshot.get('username'), snapshot.get('is_admin'), snapshot.get('points')) != identity:
+                session['identity'] = _snapshot(user)
+            g._identity = identity
+    return g._current_user
+
+
+def get_current_identity():
+    """Lightweight view of the logged in user for rendering.
+
+    Served from the signed session snapshot while it is younger than
+    IDENTITY_SNAPSHOT_TTL and still matches the row. The row's
+    identity_version and balance are read with one primary key lookup at
+    most every IDENTITY_VERIFY_INTERVAL seconds per user and process;
+    in between the snapshot is checked against that last read, which this
+    process drops as soon as it changes the user itself. A change made by
+    another process is therefore seen within IDENTITY_VERIFY_INTERVAL.
+    Falls back to loading the row when the snapshot is missing, expired,
+    from an older layout or out of date, and returns None once the user
+    is deleted.
+    """
+    if 'user_id' not in session:
+        return None
+
+    if '_identity' not in g:
+        snapshot = session.get('identity')
+        ttl = current_app.config.get('IDENTITY_SNAPSHOT_TTL', 300)
+        current = None
+        if snapshot and snapshot.get('v') == IDENTITY_SNAPSHOT_VERSION \
+                and snapshot.get('id') == session['user_id'] \
+                and time.time() - snapshot.get('ts', 0) < ttl:
+            current = _read_identity_version(session['user_id'])
+            if current is None:
+                # Deleted since the snapshot was taken
+                session.pop('identity', None)
+                g._current_user = None
+                return None
+        # Balance is compared directly: credits land in the points shards and
+        # never write the users row, so they don't bump identity_version
+        if current is not None and tuple(current) == (snapshot.get('iv'), snapshot['points']):
+            g._identity = Identity(snapshot['id'], snapshot['username'], snapshot['is_admin'], snapshot['points'])
+        else:
+            user = get_current_user()
+            if user is None:
+                return None
+            # get_current_user may have left an up to date snapshot untouched
+            session['identity'] = _snapshot(user)
+    return g._identity
+
+
+def _read_identity_version(user_id):
+    """(identity_version, balance) of the user, or None once deleted"""
+    verified = _verified.get(user_id)
+    interval = current_app.config.get('IDENTITY_VERIFY_INTERVAL', 2)
+    if verified is not None and time.monotonic() - verified[2] < interval:
+        return verified[:2]
+    current = db.session.execute(select(User.identity_version, User.balance)
+                                 .where(User.id == user_id)).first()
+    if current is None:
+        _verified.pop(user_id, None)
+        return None
+    if len(_verified) >= _VERIFIED_LIMIT:
+        _verified.clear()
+    _verified[user_id] = (current[0], current[1], time.monotonic())
+    return tuple(current)
+
+
+def forget_user():
+    session.clear()
+    g.pop('_current_user', None)
+    g.pop('_identity', None)
+
+
+def mark_identity_stale(user_id):
+    """Drop the user's cached identity at the end of this request (points ledger writes)"""
+    if has_request_context():
+        g.setdefault('_stale_identities', set()).add(user_id)
+
+
+def _mark_identity_stale(target, value, oldvalue, initiator):
+    """Drop the cached identity when points, admin status or username change"""
+    if value != oldvalue:
+        mark_identity_stale(target.id)
+
+
+for _field in _SNAPSHOT_FIELDS:
+    event.listen(getattr(User, _field), 'set', _mark_identity_stale)
+
+
+@event.listens_for(User, 'before_update')
+def _bump_identity_version(mapper, connection, target):
+    """Invalidate every session's snapshot of the user, not just the requester's"""
+    state = inspect(target)
+    if any(state.attrs[field].history.has_changes() for field in ('username', 'is_admin')):
+        target.identity_version = User.identity_version + 1
+
+
+def init_identity(app):
+    @app.after_request
+    def refresh_identity_snapshot(response):
+        # Changes are only known to be durable once the request finished, so
+        # drop the snapshot and let the next request reload it from the row
+        stale = g.get('_stale_identities')
+        if stale:
+            for user_id in stale:
+                _verified.pop(user_id, None)
+            if session.get('user_id') in stale:
+                session.pop('identity', None)
+        return response
+
+    @app.context_processor
+    def inject_identity():
+        return {'current_identity': get_current_identity}
@@ -0,0 +1,213 @@
+import hashlib
+import io
+import json
+import os
+import tempfile
+import click
+from flask import current_app, url_for
+from sqlalchemy import update
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional: without it uploads are rejected
+    Image = None
+
+from app import db
+from app.models import Item
+from app.jobs import task, enqueue
+
+
+# Every stored image is served as these widths, in WebP and JPEG
+IMAGE_WIDTHS = (160, 320, 640, 1280)
+ACCEPTED_FORMATS = {'JPEG', 'PNG', 'WEBP', 'GIF'}
+
+PLACEHOLDER_DIR = 'images/variants'
+PLACEHOLDER_SOURCES = ('image1.jpg', 'image2.jpg', 'image3.jpg', 'image4.jpg')
+
+
+class ImageRejected(ValueError):
+    """The upload is not an image we can process"""
+
+
+def _atomic_write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def variant_name(digest, width, ext):
+    """Content-hashed file name of one variant, sharded by the first hash byte"""
+    return f'{digest[:2]}/{digest}-{width}.{ext}'
+
+
+def write_variants(source, digest, target_dir, widths=IMAGE_WIDTHS):
+    """Resize `source` (bytes) to every width and write WebP + JPEG files"""
+    with Image.open(io.BytesIO(source)) as im:
+        im = ImageOps.exif_transpose(im)
+        if im.mode not in ('RGB', 'L'):
+            background = Image.new('RGB', im.size, (255, 255, 255))
+            rgba = im.convert('RGBA')
+            background.paste(rgba, mask=rgba.split()[-1])
+            im = background
+        im = im.convert('RGB')
+
+        for width in widths:
+            # Never upscale: small sources are stored at their own size
+            scaled = im
+            if im.width > width:
+                scaled = im.resize((width, max(1, round(im.height * width / im.width))), Image.LANCZOS)
+
+            for ext, options in (('webp', {'quality': 75, 'method': 4}),
+                                 ('jpg', {'quality': 80, 'optimize': True, 'progressive': True})):
+                buffer = io.BytesIO()
+                scaled.save(buffer, 'WEBP' if ext == 'webp' else 'JPEG', **options)
+                _atomic_write(os.path.join(target_dir, variant_name(digest, width, ext)), buffer.getvalue())
+
+
+def accept_upload(file_storage):
+    """Validate an uploaded image and return (digest, bytes).
+
+    Only the cheap checks run on the request path; resizing and encoding
+    happen later in the image worker pool.
+    """
+    if Image is None:
+        raise ImageRejected('Image uploads need Pillow installed on the server')
+
+    data = file_storage.read()
+    if not data:
+        raise ImageRejected('The uploaded file is empty')
+
+    try:
+        with Image.open(io.BytesIO(data)) as im:
+            image_format = im.format
+            im.verify()
+    except Exception:
+        raise ImageRejected('The uploaded file is not a valid image')
+
+    if image_format not in ACCEPTED_FORMATS:
+        raise ImageRejected('Please upload a JPEG, PNG, WebP or GIF image')
+
+    return hashlib.sha256(data).hexdigest(), data
+
+
+def _variants_exist(digest):
+    folder = current_app.config['UPLOAD_FOLDER']
+    return all(os.path.exists(os.path.join(folder, variant_name(digest, width, ext)))
+               for width in IMAGE_WIDTHS for ext in ('webp', 'jpg'))
+
+
+def staged_upload_path(digest):
+    """Where an accepted upload waits for the images.process job (outside static/, EXIF intact)"""
+    return os.path.join(current_app.config['UPLOAD_STAGING_FOLDER'], digest[:2], digest)
+
+
+@task('images.process')
+def process_upload(item_id, digest):
+    """Write the variants of a staged upload and point the item at them"""
+    staged = staged_upload_path(digest)
+    if not _variants_exist(digest):
+        # Gone if another job for the same image finished in between: the retry finds its variants
+        with open(staged, 'rb') as f:
+            write_variants(f.read(), digest, current_app.config['UPLOAD_FOLDER'])
+    attach_image(item_id, digest)
+    try:
+        os.remove(staged)
+    except FileNotFoundError:
+        pass
+
+
+def attach_image(item_id, digest):
+    """Point an item at processed variants (remote image_url is cleared)"""
+    from app.http_cache import touch_catalog
+    from app.fragments import invalidate_items
+
+    db.session.execute(
+        update(Item).where(Item.id == item_id)
+        .values(image_hash=digest, image_url=None)
+        .execution_options(synchronize_session=False)
+    )
+    touch_catalog()
+    db.session.commit()
+    invalidate_items(item_id)
+
+
+def schedule_processing(item_id, digest, data):
+    """Stage the upload and queue its resizing as a job, or attach at once when
+    the same image was already processed (identical content, identical hash)"""
+    if _variants_exist(digest):
+        attach_image(item_id, digest)
+        return
+    _atomic_write(staged_upload_path(digest), data)
+    enqueue('images.process', {'item_id': item_id, 'digest': digest})
+    db.session.commit()
+
+
+def _srcsets(url_for_variant):
+    webp = ', '.join(f'{url_for_variant(width, "webp")} {width}w' for width in IMAGE_WIDTHS)
+    jpeg = ', '.join(f'{url_for_variant(width, "jpg")} {width}w' for width in IMAGE_WIDTHS)
+    return webp, jpeg
+
+
+def item_image(it, placeholder='image1.jpg'):
+    """src/srcset data for an item's picture: processed upload, remote URL or
+    the pre-shrunk bundled placeholder"""
+    if it.image_hash:
+        upload_url = current_app.config['UPLOAD_URL_PATH']
+        webp, jpeg = _srcsets(lambda width, ext: url_for('static', filename=f'{upload_url}/{variant_name(it.image_hash, width, ext)}'))
+        return {'src': url_for('static', filename=f'{upload_url}/{variant_name(it.image_hash, 640, "jpg")}'),
+                'webp_srcset': webp, 'jpeg_srcset': jpeg}
+    if it.image_url:
+        return {'src': it.image_url}
+    return placeholder_image(placeholder)
+
+
+def placeholder_image(name):
+    manifest = current_app.extensions.get('image_placeholders', {})
+    digest = manifest.get(name)
+    if not digest:
+        return {'src': url_for('static', filename=f'images/{name}')}
+    webp, jpeg = _srcsets(lambda width, ext: url_for('static', filename=f'{PLACEHOLDER_DIR}/{variant_name(digest, width, ext)}'))
+    return {'src': url_for('static', filename=f'{PLACEHOLDER_DIR}/{variant_name(digest, 640, "jpg")}'),
+            'webp_srcset': webp, 'jpeg_srcset': jpeg}
+
+
+def build_placeholders(app):
+    """Pre-shrink the bundled placeholder photos the same way as uploads"""
+    target_dir = os.path.join(app.static_folder, PLACEHOLDER_DIR)
+    manifest = {}
+    for name in PLACEHOLDER_SOURCES:
+        with open(os.path.join(app.static_folder, 'images', name), 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        write_variants(data, digest, target_dir)
+        manifest[name] = digest
+    _atomic_write(os.path.join(target_dir, 'manifest.json'), json.dumps(manifest, indent=2, sort_keys=True).encode())
+    return manifest
+
+
+def init_images(app):
+    app.config.setdefault('UPLOAD_FOLDER', os.path.join(app.static_folder, app.config['UPLOAD_URL_PATH']))
+    app.config.setdefault('UPLOAD_STAGING_FOLDER', os.path.join(app.instance_path, 'uploads-pending'))
+
+    manifest_path = os.path.join(app.static_folder, PLACEHOLDER_DIR, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            app.extensions['image_placeholders'] = json.load(f)
+
+    app.jinja_env.globals['item_image'] = item_image
+    app.jinja_env.globals['placeholder_image'] = placeholder_image
+
+    @app.cli.group('images')
+    def images_group():
+        """Listing images."""
+
+    @images_group.command('placeholders')
+    def placeholders_command():
+        """Regenerate the resized variants of the bundled placeholder images."""
+        if Image is None:
+            raise click.ClickException('Pillow is not installed')
+        for name, digest in build_placeholders(app).items():
+            click.echo(f'{name} -> {digest[:12]}')
@@ -0,0 +1,403 @@
+import json
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import click
+from flask import current_app
+from sqlalchemy import event, select, update, delete, func, case
+from sqlalchemy.dialects import sqlite, postgresql
+from sqlalchemy.orm import Session
+from app import db
+from app.models import Job, JobSchedule
+
+# Job name -> function called with the job's payload as keyword arguments
+TASKS = {}
+
+# Finished jobs deleted per statement when pruning
+PRUNE_CHUNK = 1000
+
+# Schedule rows are created without overwriting another worker's, per dialect
+_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+# Embedded workers of this process, woken right after a local commit enqueued jobs
+_workers = []
+
+
+def task(name):
+    """Register the decorated function as the job `name`"""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=None):
+    """Add a `name` job to the current transaction; it can run once that commits.
+
+    A worker calls the function registered as `name` with the payload (a
+    JSON serializable dict) as keyword arguments, `delay` seconds from now
+    at the earliest.
+    """
+    if name not in TASKS:
+        raise KeyError(f'No job registered as {name!r}')
+    job = Job(name=name, payload=json.dumps(payload or {}), status='queued', attempts=0,
+              run_at=datetime.utcnow() + timedelta(seconds=delay),
+              max_attempts=max_attempts or current_app.config['JOBS_MAX_ATTEMPTS'])
+    db.session.add(job)
+    db.session.info['jobs'] = True
+    return job
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_workers(session):
+    # An embedded worker picks the job up now, pool workers at their next poll
+    if session.info.pop('jobs', False):
+        for worker in _workers:
+            worker.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _forget_jobs(session):
+    session.info.pop('jobs', None)
+
+
+class JobWorker:
+    """Runs due jobs one at a time, and enqueues the periodic ones in JOB_SCHEDULE.
+
+    Claims are one guarded UPDATE ... RETURNING (with SKIP LOCKED where the
+    database has it), so any number of workers in any number of processes
+    share the table and each job goes to exactly one of them, which holds
+    it for a lease and renews it while the job runs. A worker that dies
+    mid-job stops renewing, loses the lease and the job is queued again. Failures are retried with exponential backoff up to the
+    job's max_attempts, then kept as failed with their traceback. Idle polls
+    only read, so waiting workers never take SQLite's write lock.
+    """
+
+    def __init__(self, app, name=None):
+        config = app.config
+        self.app = app
+        self.name = name
+        self.interval = config['JOBS_POLL_INTERVAL']
+        self.lease = timedelta(seconds=config['JOBS_LEASE'])
+        self.backoff = config['JOBS_RETRY_BACKOFF']
+        self.schedule = dict(config['JOB_SCHEDULE'])
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def wake(self):
+        self._wake.set()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def start(self):
+        """Run on a daemon thread of this process (once)"""
+        with self._lock:
+            if self._thread is None:
+                _workers.append(self)
+                self._thread = threading.Thread(target=self.run, name='job-worker', daemon=True)
+                self._thread.start()
+
+    def run(self, once=False):
+        """Work until stop(), or with `once` until nothing is due; returns the number of jobs run"""
+        # Named here, not in __init__, so forked workers get their own pid
+        self.name = self.name or f'{socket.gethostname()}:{os.getpid()}'
+        total = 0
+        with self.app.app_context():
+            scheduled = False
+            while not self._stop.is_set():
+                try:
+                    if not scheduled:
+                        ensure_schedules(self.schedule)
+                        scheduled = True
+                    ran = self.run_pending()
+                except Exception:
+                    self.app.logger.exception('Job worker pass failed')
+                    db.session.rollback()
+                    ran = 0
+                finally:
+                    db.session.remove()
+                total += ran
+                if not ran:
+                    if once:
+                        break
+                    self._wake.wait(self.interval)
+                    self._wake.clear()
+        return total
+
+    def run_pending(self):
+        """Enqueue due periodic jobs, requeue expired leases, then run one job; returns 1 if one ran"""
+        self.enqueue_scheduled()
+        self.requeue_expired()
+        job = self.claim()
+        if job is None:
+            return 0
+        self.execute(job)
+        return 1
+
+    def enqueue_scheduled(self):
+        now = datetime.utcnow()
+        due = db.session.scalars(select(JobSchedule.name).where(JobSchedule.next_run_at <= now)).all()
+        for name in due:
+            if name not in self.schedule:
+                continue  # Dropped from JOB_SCHEDULE
+            claimed = db.session.execute(
+                update(JobSchedule)
+                .where(JobSchedule.name == name, JobSchedule.next_run_at <= now)
+                .values(next_run_at=now + timedelta(seconds=self.schedule[name]))
+            ).rowcount
+            if claimed:
+                enqueue(name)
+        db.session.commit()
+
+    def requeue_expired(self):
+        now = datetime.utcnow()
+        expired = Job.status == 'running', Job.locked_until < now
+        if db.session.scalar(select(Job.id).where(*expired).limit(1)) is None:
+            return 0
+        gave_up = Job.attempts >= Job.max_attempts
+        lost = db.session.execute(
+            update(Job).where(*expired)
+            .values(status=case((gave_up, 'failed'), else_='queued'), finished_at=case((gave_up, now), else_=None),
+                    locked_by=None, locked_until=None, last_error='Lease expired: the worker running it was lost')
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        db.session.commit()
+        return lost
+
+    def claim(self):
+        """Take the next due job: a row with id, name, payload, attempts, max_attempts (None when idle)"""
+        while True:
+            now = datetime.utcnow()
+            due = select(Job.id).where(Job.status == 'queued', Job.run_at <= now).order_by(Job.run_at, Job.id).limit(1)
+            if db.session.scalar(due) is None:
+                return None
+            job = db.session.execute(
+                update(Job)
+                .where(Job.id.in_(due.with_for_update(skip_locked=True)), Job.status == 'queued')
+                .values(status='running', attempts=Job.attempts + 1, locked_by=self.name,
+                        locked_until=now + self.lease)
+                .returning(Job.id, Job.name, Job.payload, Job.attempts, Job.max_attempts)
+                .execution_options(synchronize_session=False)
+            ).first()
+            db.session.commit()
+            if job is not None:
+                return job
+            # Another worker got there first: try the next one
+
+    def execute(self, job):
+        """Run a claimed job and record the outcome; returns whether it succeeded"""
+        started = time.perf_counter()
+        try:
+            func = TASKS.get(job.name)
+            if func is None:
+                raise LookupError(f'No job registered as {job.name!r}')
+            with self._renewing_lease(job.id):
+                func(**json.loads(job.payload))
+                db.session.commit()  # Whatever the job left in the session
+        except Exception:
+            db.session.rollback()
+            now = datetime.utcnow()
+            if job.attempts < job.max_attempts:
+                retry_in = self.backoff * 2 ** (job.attempts - 1)
+                self._finish(job.id, status='queued', run_at=now + timedelta(seconds=retry_in),
+                             last_error=traceback.format_exc())
+                self.app.logger.warning('Job %s %s failed (attempt %d of %d), retrying in %.0fs',
+                                        job.id, job.name, job.attempts, job.max_attempts, retry_in)
+            else:
+                self._finish(job.id, status='failed', finished_at=now, last_error=traceback.format_exc())
+                self.app.logger.error('Job %s %s failed for good after %d attempts', job.id, job.name, job.attempts)
+            return False
+        # A retry that succeeded leaves no error behind from the attempts before it
+        self._finish(job.id, status='done', finished_at=datetime.utcnow(), last_error=None)
+        self.app.logger.info('Job %s %s done in %.0f ms', job.id, job.name, (time.perf_counter() - started) * 1000)
+        return True
+
+    @contextmanager
+    def _renewing_lease(self, job_id):
+        """Keep pushing the job's lease forward while the body runs.
+
+        Otherwise a job running longer than JOBS_LEASE (a large upload, a
+        long expiry sweep) would be requeued and run a second time while
+        the first run is still going.
+        """
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._renew_lease, args=(db.engine, job_id, done),
+                                     name='job-lease', daemon=True)
+        heartbeat.start()
+        try:
+            yield
+        finally:
+            done.set()
+            heartbeat.join()
+
+    def _renew_lease(self, engine, job_id, done):
+        # Every third of the lease, so one renewal stuck behind a long write can be late
+        while not done.wait(self.lease.total_seconds() / 3):
+            try:
+                with engine.begin() as connection:
+                    renewed = connection.execute(
+                        update(Job).where(Job.id == job_id, Job.status == 'running', Job.locked_by == self.name)
+                        .values(locked_until=datetime.utcnow() + self.lease)
+                    ).rowcount
+            except Exception:
+                self.app.logger.exception('Renewing the lease of job %s failed', job_id)
+                continue
+            if not renewed:
+                self.app.logger.warning('Job %s lost its lease while running', job_id)
+                return
+
+    def _finish(self, job_id, **values):
+        # Only while the lease is ours: an expired one may belong to another worker now
+        db.session.execute(
+            update(Job).where(Job.id == job_id, Job.status == 'running', Job.locked_by == self.name)
+            .values(locked_by=None, locked_until=None, **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+
+
+def ensure_schedules(schedule):
+    """Create the missing job_schedules rows, due now"""
+    if not schedule:
+        return
+    now = datetime.utcnow()
+    stmt = _INSERTS[db.engine.dialect.name](JobSchedule.__table__).on_conflict_do_nothing(index_elements=['name'])
+    db.session.execute(stmt, [{'name': name, 'next_run_at': now} for name in schedule])
+    db.session.commit()
+
+
+@task('jobs.prune')
+def prune_jobs(retention=None):
+    """Delete jobs that finished successfully and were due more than `retention` seconds ago"""
+    cutoff = datetime.utcnow() - timedelta(seconds=retention or current_app.config['JOBS_RETENTION'])
+    total = 0
+    while True:
+        deleted = db.session.execute(
+            delete(Job).where(Job.id.in_(
+                select(Job.id).where(Job.status == 'done', Job.run_at < cutoff).limit(PRUNE_CHUNK)))
+        ).rowcount
+        db.session.commit()
+        total += deleted
+        if deleted < PRUNE_CHUNK:
+            return total
+
+
+def _work_in_child(app):
+    worker = JobWorker(app)
+    # The pool stops children with SIGTERM; they finish the job at hand first
+    signal.signal(signal.SIGTERM, lambda signum, frame: worker.stop())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker.run()
+
+
+def run_pool(app, processes):
+    """Keep `processes` forked workers running until SIGINT/SIGTERM, replacing any that die"""
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose()  # No pooled connections across the fork
+    context = multiprocessing.get_context('fork')
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda signum, frame: stopping.set())
+
+    children = []
+    while not stopping.is_set():
+        for child in [child for child in children if not child.is_alive()]:
+            click.echo(f'worker {child.pid} exited with {child.exitcode}, replacing it', err=True)
+            children.remove(child)
+        while len(children) < processes:
+            child = context.Process(target=_work_in_child, args=(app,), name='job-worker')
+            child.start()
+            children.append(child)
+        stopping.wait(1)
+
+    for child in children:
+        child.terminate()  # SIGTERM
+    for child in children:
+        child.join(app.config['JOBS_LEASE'])
+        if child.is_alive():
+            child.kill()
+
+
+def init_jobs(app):
+    """The optional in-process worker, and `flask jobs ...`"""
+    if app.config['JOBS_EMBEDDED_WORKER']:
+        worker = JobWorker(app)
+        app.extensions['job_worker'] = worker
+
+        @app.before_request
+        def start_job_worker():
+            # Started by traffic, so scripts and `flask` commands don't get one
+            worker.start()
+
+    @app.cli.group('jobs')
+    def jobs_group():
+        """Background jobs."""
+
+    @jobs_group.command('work')
+    @click.option('--processes', type=int, default=None, help='Worker processes (JOBS_PROCESSES).')
+    @click.option('--once', is_flag=True, help='Run what is due in this process, then exit.')
+    def work_command(processes, once):
+        """Run queued and scheduled jobs until interrupted."""
+        processes = processes or app.config['JOBS_PROCESSES']
+        if once:
+            click.echo(f'ran {JobWorker(app).run(once=True)} jobs')
+        elif processes == 1:
+            worker = JobWorker(app)
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda signum, frame: worker.stop())
+            worker.run()
+        else:
+            click.echo(f'{processes} job workers, jobs: {", ".join(sorted(TASKS))}')
+            run_pool(app, processes)
+
+    @jobs_group.command('status')
+    def status_command():
+        """Jobs per name and status, and the next scheduled runs."""
+        rows = db.session.execute(
+            select(Job.name, Job.status, func.count(), func.min(Job.run_at))
+            .group_by(Job.name, Job.status).order_by(Job.name, Job.status)
+        ).all()
+        if not rows:
+            click.echo('no jobs')
+        for name, status, count, first_run_at in rows:
+            click.echo(f'{name:<20} {status:<8} {count:>7}' +
+                       (f'  next due {first_run_at:%Y-%m-%d %H:%M:%S}' if status == 'queued' else ''))
+        for schedule in db.session.scalars(select(JobSchedule).order_by(JobSchedule.name)):
+            interval = app.config['JOB_SCHEDULE'].get(schedule.name)
+            click.echo(f'schedule {schedule.name:<20} next {schedule.next_run_at:%Y-%m-%d %H:%M:%S}, ' +
+                       (f'every {interval:g}s' if interval else 'not in JOB_SCHEDULE'))
+
+    @jobs_group.command('enqueue')
+    @click.argument('name')
+    @click.option('--payload', default='{}', help='Keyword arguments as a JSON object.')
+    @click.option('--delay', type=float, default=0, help='Seconds before it may run.')
+    def enqueue_command(name, payload, delay):
+        """Queue a job by name."""
+        if name not in TASKS:
+            raise click.ClickException(f'No job named {name!r} (known: {", ".join(sorted(TASKS))})')
+        job = enqueue(name, json.loads(payload), delay)
+        db.session.commit()
+        click.echo(f'queued job {job.id} {name}')
+
+    @jobs_group.command('retry')
+    @click.option('--name', default=None, help='Only jobs with this name.')
+    def retry_command(name):
+        """Queue failed jobs again with fresh attempts."""
+        query = update(Job).where(Job.status == 'failed')
+        if name:
+            query = query.where(Job.name == name)
+        retried = db.session.execute(query.values(status='queued', attempts=0, run_at=datetime.utcnow(),
+                                                  finished_at=None)).rowcount
+        db.session.commit()
+        click.echo(f'{retried} failed jobs queued again')
@@ -0,0 +1,240 @@
+import time
+from collections import Counter, deque
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import select
+from app import db
+from app.models import SwapRequest, SwapEvent
+from app.events import latest_event_id
+from app.swaps import complete_cycle, SwapConflict
+from app.fragments import invalidate_items
+
+
+class SwapGraph:
+    """Pending swap requests as edges offered item -> wanted item.
+
+    A request reads "I hand over offered_item_id for item_id", so a ring
+    of requests where each one offers the item the one before it asked
+    for lets every requester give what they offered and get what they
+    asked for. Such a ring is a cycle in this graph.
+
+    The graph is kept in step with the database edge by edge (add/remove)
+    and remembers which edges arrived since the last search: every cycle
+    not found before must use one of them, so a search only starts from
+    those. An item can only be offered in one pending request, so most
+    items have at most one outgoing edge and a search is a short walk.
+    """
+
+    def __init__(self):
+        self.edges = {}    # swap id -> (offered item id, wanted item id)
+        self.offers = {}   # item id -> swap ids offering it
+        self.fresh = set()
+
+    def __len__(self):
+        return len(self.edges)
+
+    def add(self, swap_id, offered_item_id, item_id):
+        edge = (offered_item_id, item_id)
+        if self.edges.get(swap_id) == edge:
+            return
+        self.remove(swap_id)
+        self.edges[swap_id] = edge
+        self.offers.setdefault(offered_item_id, set()).add(swap_id)
+        self.fresh.add(swap_id)
+
+    def remove(self, swap_id):
+        edge = self.edges.pop(swap_id, None)
+        if edge is None:
+            return
+        offering = self.offers.get(edge[0])
+        offering.discard(swap_id)
+        if not offering:
+            del self.offers[edge[0]]
+        self.fresh.discard(swap_id)
+
+    def _cycle_candidates(self):
+        """Edges that may lie on a cycle.
+
+        An edge whose offered item nobody asks for can't be on one, and
+        dropping it may leave its wanted item unasked for in turn. Peeling
+        those repeatedly leaves the rings plus the few edges that branch
+        between them, out of however many chains and trees lead nowhere.
+        """
+        edges, offers = self.edges, self.offers
+        asked_for = Counter(wanted for _, wanted in edges.values())
+        candidates = set(edges)
+        unwanted = [item for item in offers if not asked_for[item]]
+        while unwanted:
+            for swap_id in offers[unwanted.pop()]:
+                candidates.discard(swap_id)
+                wanted = edges[swap_id][1]
+                asked_for[wanted] -= 1
+                if not asked_for[wanted] and wanted in offers:
+                    unwanted.append(wanted)
+        return candidates
+
+    def find_cycles(self, max_length, budget=1000, everything=False):
+        """Item-disjoint cycles through fresh edges (or all edges), oldest requests first.
+
+        `budget` caps the edges examined per starting edge, so a dense
+        corner of the graph can't stall a pass. Clears the fresh set.
+        """
+        starts = self.edges if everything else self.fresh
+        if len(starts) * 8 > len(self.edges):
+            # Most of the graph to search: prune it in linear time first
+            starts = self._cycle_candidates().intersection(starts)
+        starts = sorted(starts)
+        self.fresh = set()
+        edges, offers = self.edges, self.offers
+        used = set()
+        in_cycles = set()
+        cycles = []
+
+        for start in starts:
+            if start not in edges or start in in_cycles:
+                continue
+            origin, wanted = edges[start]
+            if origin in used or wanted in used:
+                self.fresh.add(start)  # Its items just went into another ring, retry next pass
+                continue
+            # Breadth-first over (path, item the path still needs someone to offer),
+            # so the shortest ring through the start edge wins
+            queue = deque([([start], wanted)])
+            seen_items = {origin, wanted}
+            steps = 0
+            found = None
+            while queue and found is None and steps < budget:
+                path, needed = queue.popleft()
+                for swap_id in offers.get(needed, ()):
+                    steps += 1
+                    next_wanted = edges[swap_id][1]
+                    if next_wanted == origin:
+                        found = path + [swap_id]
+                        break
+                    if len(path) + 1 < max_length and next_wanted not in used and next_wanted not in seen_items:
+                        seen_items.add(next_wanted)
+                        queue.append((path + [swap_id], next_wanted))
+            if found:
+                cycles.append(found)
+                in_cycles.update(found)
+                used.update(edges[swap_id][0] for swap_id in found)
+        return cycles
+
+
+class SwapMatcher:
+    """Keeps a SwapGraph in sync with swap_requests and executes the rings it finds.
+
+    The first sync loads every pending request; later ones only read rows
+    whose updated_at moved since the previous sync (created, declined,
+    accepted, or declined as a side effect of another swap), re-reading
+    `overlap` seconds to catch transactions that committed late.
+    Cancelled requests are deleted rows that feed can't show, so each sync
+    also reads the 'cancelled' and 'expired' swap_events after the last
+    event id it saw and drops those requests from the graph.
+    """
+
+    def __init__(self, max_length=5, budget=1000, overlap=10.0):
+        self.graph = SwapGraph()
+        self.max_length = max_length
+        self.budget = budget
+        self.overlap = timedelta(seconds=overlap)
+        self.synced_at = None
+        self.event_id = None
+
+    def sync(self):
+        started = datetime.utcnow()
+        changed = 0
+        last_event_id = latest_event_id()
+        if self.event_id is not None:
+            # Before the rows: a deleted request's id may already belong to a new one
+            gone = db.session.scalars(
+                select(SwapEvent.swap_id)
+                .where(SwapEvent.id > self.event_id, SwapEvent.id <= last_event_id,
+                       SwapEvent.kind.in_(('cancelled', 'expired')))
+            ).all()
+            for swap_id in gone:
+                self.graph.remove(swap_id)
+            changed += len(gone)
+        query = select(SwapRequest.id, SwapRequest.status, SwapRequest.offered_item_id, SwapRequest.item_id)
+        if self.synced_at is None:
+            query = query.where(SwapRequest.status == 'pending')
+        else:
+            query = query.where(SwapRequest.updated_at >= self.synced_at - self.overlap)
+        for swap_id, status, offered_item_id, item_id in db.session.execute(query):
+            if status == 'pending':
+                self.graph.add(swap_id, offered_item_id, item_id)
+            else:
+                self.graph.remove(swap_id)
+            changed += 1
+        db.session.rollback()  # End the read transaction
+        self.synced_at = started
+        self.event_id = last_event_id
+        return changed
+
+    def refresh(self, swap_ids):
+        """Re-read some requests, dropping the ones gone or no longer pending"""
+        pending = dict(db.session.execute(
+            select(SwapRequest.id, SwapRequest.offered_item_id)
+            .where(SwapRequest.id.in_(swap_ids), SwapRequest.status == 'pending')
+        ).all())
+        db.session.rollback()
+        for swap_id in swap_ids:
+            if swap_id not in pending:
+                self.graph.remove(swap_id)
+
+    def run_pass(self, everything=False):
+        """Sync, search and execute; returns a stats dict"""
+        started = time.perf_counter()
+        changed = self.sync()
+        synced = time.perf_counter()
+        cycles = self.graph.find_cycles(self.max_length, self.budget, everything)
+        searched = time.perf_counter()
+
+        executed = conflicts = 0
+        for cycle in cycles:
+            try:
+                item_ids = complete_cycle(cycle)
+            except SwapConflict:
+                conflicts += 1
+                self.refresh(cycle)
+                continue
+            executed += 1
+            for swap_id in cycle:
+                self.graph.remove(swap_id)
+            invalidate_items(*item_ids)
+
+        return {
+            'changed': changed, 'pending': len(self.graph), 'cycles': len(cycles),
+            'executed': executed, 'conflicts': conflicts,
+            'sync_s': synced - started, 'search_s': searched - synced,
+            'execute_s': time.perf_counter() - searched,
+        }
+
+
+def make_matcher(app):
+    return SwapMatcher(app.config['SWAP_CYCLE_MAX_LENGTH'], app.config['SWAP_CYCLE_SEARCH_BUDGET'],
+                       app.config['SWAP_MATCH_OVERLAP'])
+
+
+def init_matching(app):
+    """Register `flask swaps match`"""
+    @app.cli.group('swaps')
+    def swaps_group():
+        """Multi-party swap matching."""
+
+    @swaps_group.command('match')
+    @click.option('--loop', is_flag=True, help='Keep matching every --interval seconds.')
+    @click.option('--interval', type=float, default=None, help='Seconds between passes (SWAP_MATCH_INTERVAL).')
+    def match_command(loop, interval):
+        """Find rings of pending swap requests and execute them."""
+        matcher = make_matcher(app)
+        interval = interval or app.config['SWAP_MATCH_INTERVAL']
+        while True:
+            stats = matcher.run_pass()
+            click.echo(f"{stats['pending']} pending, {stats['changed']} changed: {stats['executed']} of "
+                       f"{stats['cycles']} rings executed ({stats['conflicts']} stale) - sync "
+                       f"{stats['sync_s'] * 1000:.0f} ms, search {stats['search_s'] * 1000:.0f} ms, "
+                       f"execute {stats['execute_s'] * 1000:.0f} ms")
+            if not loop:
+                return
+            time.sleep(interval)
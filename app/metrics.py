@@ -0,0 +1,384 @@
+import atexit
+import glob
+import hmac
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+import click
+from flask import g, request, current_app, has_app_context, Response, abort, template_rendered, before_render_template
+from sqlalchemy import event
+
+try:
+    import fcntl
+except ImportError:  # No flock (Windows): files of exited workers are then simply kept
+    fcntl = None
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+HISTOGRAMS = {
+    'rewear_request_duration_seconds': ('Total request latency', LATENCY_BUCKETS),
+    'rewear_request_db_seconds': ('Time spent executing SQL per request', LATENCY_BUCKETS),
+    'rewear_request_render_seconds': ('Time spent rendering templates per request', LATENCY_BUCKETS),
+    'rewear_request_statements': ('SQL statements executed per request', STATEMENT_BUCKETS),
+}
+# Summed counts of exited worker processes, in METRICS_DIR
+RETIRED_FILE = 'retired.json'
+
+COUNTERS = {
+    'rewear_http_requests_total': 'Requests handled, sampled or not',
+    'rewear_slow_queries_total': 'Statements slower than SLOW_QUERY_MS',
+    'rewear_n_plus_one_total': 'Requests repeating one statement N_PLUS_ONE_THRESHOLD times or more',
+}
+
+
+class MetricsRegistry:
+    """Counters and histograms of one worker process.
+
+    With METRICS_DIR set every process also dumps its values to
+    METRICS_DIR/<pid>-<random>.json (at most once per flush interval and
+    at exit), and the /metrics view sums all of those files, so any worker
+    can answer a scrape for the whole pool. The random part keeps a
+    process that inherits a dead worker's pid from overwriting its file.
+    Files of exited workers are folded into retired.json on the next
+    scrape, so their counts stay part of the monotonic totals without the
+    directory growing with every restart.
+    """
+
+    def __init__(self, directory=None, flush_interval=1.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.counters = {}
+        self.histograms = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+        self._pid = self._name = None
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            atexit.register(self.flush)
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        buckets = HISTOGRAMS[name][1]
+        key = (name, labels)
+        with self._lock:
+            entry = self.histograms.get(key)
+            if entry is None:
+                entry = self.histograms[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    entry[0][i] += 1
+                    break
+            else:
+                entry[0][-1] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'counters': [[name, list(labels), value] for (name, labels), value in self.counters.items()],
+                'histograms': [[name, list(labels), list(entry[0]), entry[1], entry[2]]
+                               for (name, labels), entry in self.histograms.items()],
+            }
+
+    def maybe_flush(self):
+        if self.directory and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        if not self.directory:
+            return
+        self._last_flush = time.monotonic()
+        if self._pid != os.getpid():
+            # Named once per process (again after a fork)
+            self._pid = os.getpid()
+            self._name = f'{self._pid}-{uuid.uuid4().hex[:12]}'
+        _write_json(os.path.join(self.directory, f'{self._name}.json'), self.snapshot())
+
+    def retire_exited(self):
+        """Fold the files of processes that are gone into retired.json.
+
+        Under an exclusive lock, so two workers answering scrapes at once
+        can't both fold the same file. The names folded are recorded with
+        the totals, so a crash before the files are removed doesn't count
+        them twice.
+        """
+        if fcntl is None:
+            return
+        dead = []
+        for path in glob.glob(os.path.join(self.directory, '*-*.json')):
+            name = os.path.basename(path)
+            try:
+                os.kill(int(name.split('-', 1)[0]), 0)
+            except ProcessLookupError:
+                dead.append(name)
+            except (OSError, ValueError):
+                continue  # Alive under another user, or not ours
+        if not dead:
+            return
+
+        retired_path = os.path.join(self.directory, RETIRED_FILE)
+        with self._locked(fcntl.LOCK_EX):
+            retired = self._read_retired()
+            folded = set(retired['folded'])
+            snapshots = [retired]
+            for name in dead:
+                if name in folded:
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # Removed by another worker meanwhile
+                folded.add(name)
+            merged = _to_snapshot(*_sum_snapshots(snapshots))
+            merged['folded'] = sorted(name for name in folded
+                                      if os.path.exists(os.path.join(self.directory, name)))
+            _write_json(retired_path, merged)
+            for name in merged['folded']:
+                os.remove(os.path.join(self.directory, name))
+            # Everything in the list is gone now
+            merged['folded'] = []
+            _write_json(retired_path, merged)
+
+    def collect(self):
+        """Snapshots of every process (just this one without METRICS_DIR)"""
+        if not self.directory:
+            return [self.snapshot()]
+        self.flush()
+        self.retire_exited()
+        # Shared lock: never halfway through a fold, where a file's counts
+        # would be missing from both it and retired.json, or in both
+        with self._locked(fcntl and fcntl.LOCK_SH):
+            retired = self._read_retired()
+            snapshots = [retired]
+            for path in glob.glob(os.path.join(self.directory, '*-*.json')):
+                if os.path.basename(path) in retired['folded']:
+                    continue  # Counted in retired.json, removal interrupted
+                try:
+                    with open(path) as f:
+                        snapshots.append(json.load(f))
+                except (OSError, ValueError):
+                    continue  # Being replaced right now, picked up next scrape
+        return snapshots
+
+    @contextmanager
+    def _locked(self, mode):
+        if fcntl is None:
+            yield
+            return
+        with open(os.path.join(self.directory, 'retired.lock'), 'a') as lock:
+            fcntl.flock(lock, mode)
+            yield
+
+    def _read_retired(self):
+        try:
+            with open(os.path.join(self.directory, RETIRED_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'counters': [], 'histograms': [], 'folded': []}
+
+
+def _write_json(path, data):
+    with open(f'{path}.tmp', 'w') as f:
+        json.dump(data, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def _sum_snapshots(snapshots):
+    """({(name, labels): value}, {(name, labels): [buckets, sum, count]}) over all snapshots"""
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot['counters']:
+            key = (name, tuple(map(tuple, labels)))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, buckets, total, count in snapshot['histograms']:
+            key = (name, tuple(map(tuple, labels)))
+            entry = histograms.setdefault(key, [[0] * len(buckets), 0.0, 0])
+            entry[0] = [a + b for a, b in zip(entry[0], buckets)]
+            entry[1] += total
+            entry[2] += count
+    return counters, histograms
+
+
+def _to_snapshot(counters, histograms):
+    return {
+        'counters': [[name, [list(pair) for pair in labels], value] for (name, labels), value in counters.items()],
+        'histograms': [[name, [list(pair) for pair in labels], buckets, total, count]
+                       for (name, labels), (buckets, total, count) in histograms.items()],
+    }
+
+
+def _format_labels(labels, extra=()):
+    pairs = [f'{key}="{value}"' for key, value in tuple(labels) + tuple(extra)]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def render_prometheus(snapshots, sample_rate):
+    counters, histograms = _sum_snapshots(snapshots)
+
+    lines = ['# HELP rewear_metrics_sample_rate Fraction of requests with SQL, render and latency histograms',
+             '# TYPE rewear_metrics_sample_rate gauge',
+             f'rewear_metrics_sample_rate {sample_rate}']
+    for name, help_text in COUNTERS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (metric, labels), value in sorted(counters.items()):
+            if metric == name:
+                lines.append(f'{name}{_format_labels(labels)} {value}')
+    for name, (help_text, bounds) in HISTOGRAMS.items():
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for (metric, labels), (buckets, total, count) in sorted(histograms.items()):
+            if metric != name:
+                continue
+            cumulative = 0
+            for bound, bucket in zip(bounds, buckets):
+                cumulative += bucket
+                lines.append(f'{name}_bucket{_format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels, [("le", "+Inf")])} {count}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {round(total, 6)}')
+            lines.append(f'{name}_count{_format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+
+class RequestMetrics:
+    __slots__ = ('started', 'statements', 'db_time', 'render_time', 'render_depth', 'render_started', 'status', 'seen')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.render_time = 0.0
+        self.render_depth = 0
+        self.render_started = 0.0
+        self.status = 500
+        self.seen = Counter()
+
+
+def _current():
+    return g.get('_metrics') if has_app_context() else None
+
+
+def _parameter_shape(parameters, executemany):
+    """Types of the bound parameters, never their values"""
+    def shape(params):
+        if isinstance(params, dict):
+            return '{' + ', '.join(f'{k}: {type(v).__name__}' for k, v in params.items()) + '}'
+        return '(' + ', '.join(type(v).__name__ for v in params or ()) + ')'
+    if executemany:
+        return f'{len(parameters)} x {shape(parameters[0]) if parameters else "()"}'
+    return shape(parameters)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current()
+    if metrics is not None:
+        conn.info.setdefault('metrics_started', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    metrics = _current()
+    if metrics is None or not conn.info.get('metrics_started'):
+        return
+    elapsed = time.perf_counter() - conn.info['metrics_started'].pop()
+    metrics.statements += 1
+    metrics.db_time += elapsed
+    metrics.seen[statement] += 1
+
+    if elapsed * 1000 >= current_app.config['SLOW_QUERY_MS']:
+        endpoint = request.endpoint or 'unmatched'
+        current_app.extensions['metrics'].inc('rewear_slow_queries_total', (('endpoint', endpoint),))
+        current_app.logger.warning('Slow query (%.1f ms) in %s: %s -- params %s',
+                                   elapsed * 1000, endpoint, ' '.join(statement.split()),
+                                   _parameter_shape(parameters, executemany))
+
+
+def _before_render(sender, template, context, **extra):
+    metrics = _current()
+    if metrics is not None:
+        if metrics.render_depth == 0:
+            metrics.render_started = time.perf_counter()
+        metrics.render_depth += 1
+
+
+def _after_render(sender, template, context, **extra):
+    metrics = _current()
+    if metrics is not None and metrics.render_depth:
+        metrics.render_depth -= 1
+        if metrics.render_depth == 0:
+            metrics.render_time += time.perf_counter() - metrics.render_started
+
+
+def init_metrics(app, db):
+    if not app.config['METRICS_ENABLED']:
+        return
+    token = app.config['METRICS_TOKEN']
+    if not token and app.config['METRICS_REQUIRE_TOKEN'] and click.get_current_context(silent=True) is None:
+        # CLI commands never serve /metrics, so only a server fails to start
+        raise RuntimeError('Set METRICS_TOKEN (or METRICS_ENABLED=0) to serve /metrics with this config')
+    registry = MetricsRegistry(app.config['METRICS_DIR'])
+    app.extensions['metrics'] = registry
+    sample_rate = app.config['METRICS_SAMPLE_RATE']
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_after_render, app)
+
+    @app.before_request
+    def start_request_metrics():
+        # Unsampled requests only pay for this check and one counter
+        if sample_rate >= 1 or random.random() < sample_rate:
+            g._metrics = RequestMetrics()
+
+    @app.after_request
+    def note_response_status(response):
+        metrics = g.get('_metrics')
+        if metrics is not None:
+            metrics.status = response.status_code
+        registry.inc('rewear_http_requests_total', (('endpoint', request.endpoint or 'unmatched'),
+                                                    ('method', request.method),
+                                                    ('status', str(response.status_code))))
+        return response
+
+    @app.teardown_request
+    def record_request_metrics(exc):
+        metrics = g.pop('_metrics', None)
+        if metrics is None:
+            registry.maybe_flush()
+            return
+        labels = (('endpoint', request.endpoint or 'unmatched'),)
+        registry.observe('rewear_request_duration_seconds', labels, time.perf_counter() - metrics.started)
+        registry.observe('rewear_request_db_seconds', labels, metrics.db_time)
+        registry.observe('rewear_request_render_seconds', labels, metrics.render_time)
+        registry.observe('rewear_request_statements', labels, metrics.statements)
+
+        statement, repeats = metrics.seen.most_common(1)[0] if metrics.seen else (None, 0)
+        if repeats >= app.config['N_PLUS_ONE_THRESHOLD']:
+            registry.inc('rewear_n_plus_one_total', labels)
+            app.logger.warning('Possible N+1 in %s: statement ran %d times: %s',
+                               labels[0][1], repeats, ' '.join(statement.split()))
+        registry.maybe_flush()
+
+    @app.route('/metrics')
+    def metrics():
+        if token:
+            # Constant time, so response timing doesn't reveal how much of a guess matched
+            if not hmac.compare_digest(request.headers.get('Authorization', '').encode(), f'Bearer {token}'.encode()):
+                abort(403)
+        elif app.config['METRICS_REQUIRE_TOKEN']:
+            abort(403)  # e.g. `flask run` with the production config and no token
+        body = render_prometheus(registry.collect(), sample_rate)
+        return Response(body, mimetype='text/plain; version=0.0.4')
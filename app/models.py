@@ -2,6 +2,13 @@ from app import db
 from datetime import datetime
 from sqlalchemy import CheckConstraint
 
+# Allowed values, mirrored by the CHECK constraints on items
+ITEM_CATEGORIES = ('male', 'female', 'kids')
+ITEM_SIZES = ('S', 'M', 'L', 'XL')
+# Moderation states: new listings wait as pending, only approved ones are public
+ITEM_STATUSES = ('pending', 'approved', 'rejected')
+# Pending swap requests end up completed, declined or (after SWAP_REQUEST_TTL) expired
+SWAP_STATUSES = ('pending', 'completed', 'declined', 'expired')
 
 class User(db.Model):
     __tablename__ = 'users'
@@ -13,6 +20,9 @@ class User(db.Model):
     points = db.Column(db.Integer, default=10, nullable=False)
     is_admin = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Bumped whenever the username or admin flag changes, so session identity
+    # snapshots taken before can be told apart from the row (app/identity.py)
+    identity_version = db.Column(db.Integer, default=0, server_default='0', nullable=False)
     
     # Relationships
     items = db.relationship('Item', backref='owner', lazy=True, cascade='all, delete-orphan')
@@ -26,20 +36,29 @@ class Item(db.Model):
     __tablename__ = 'items'
     
     id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False, index=True)
     title = db.Column(db.String(100), nullable=False)
     description = db.Column(db.Text, nullable=True)
     category = db.Column(db.String(50), default='male', nullable=False)
     size = db.Column(db.String(20), default='M', nullable=True)
     image_url = db.Column(db.String(200), nullable=True)
+    image_hash = db.Column(db.String(64), nullable=True)  # sha256 of an uploaded image, variants on disk
     points_cost = db.Column(db.Integer, default=10, nullable=False)
-    # status = db.Column(db.String(20), default='pending', nullable=False)  # pending/approved
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending/approved/rejected
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.current_timestamp(), nullable=False)
     
     # Check constraints
     __table_args__ = (
         CheckConstraint("category IN ('male', 'female', 'kids')", name='check_category'),
         CheckConstraint("size IN ('S', 'M', 'L', 'XL')", name='check_size'),
+        CheckConstraint("status IN ('pending', 'approved', 'rejected')", name='check_item_status'),
+        # Keyset pagination within one status: the public (approved) feed
+        # newest first and the moderation queue oldest first
+        db.Index('ix_items_status_created_at', 'status', 'created_at', 'id'),
+        # Facet-filtered feed (category, optionally size) in the same order
+        db.Index('ix_items_status_category_size_created_at', 'status', 'category', 'size', 'created_at', 'id'),
     )
     
     # Relationships
@@ -56,11 +75,29 @@ class SwapRequest(db.Model):
     requester_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     item_id = db.Column(db.Integer, db.ForeignKey('items.id'), nullable=False)  
     offered_item_id = db.Column(db.Integer, db.ForeignKey('items.id'), nullable=False)
-    status = db.Column(db.String(20), default='pending', nullable=False)  # pending/completed/declined
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending/completed/declined/expired
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Also set by bulk UPDATE statements: the change feed the swap matcher follows
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow,
+                           server_default=db.func.current_timestamp(), nullable=False)
     
     __table_args__ = (
-        CheckConstraint("status IN ('pending', 'completed', 'declined')", name='check_status'),
+        CheckConstraint("status IN ('pending', 'completed', 'declined', 'expired')", name='check_status'),
+        # Dashboard lookups: requests per item by status, and a user's requests newest first
+        db.Index('ix_swap_requests_item_status', 'item_id', 'status'),
+        db.Index('ix_swap_requests_requester_created_at', 'requester_id', 'created_at'),
+        # Pending offers of an item (swap validation, conflict resolution)
+        db.Index('ix_swap_requests_offered_item_status', 'offered_item_id', 'status'),
+        # An item is offered in at most one pending request at a time: the swap
+        # modal, swap submission and the ring matcher rely on it, so the
+        # database enforces it instead of a check-then-insert in the route
+        db.Index('uq_swap_requests_pending_offer', 'offered_item_id', unique=True,
+                 sqlite_where=db.text("status = 'pending'"), postgresql_where=db.text("status = 'pending'")),
+        # Requests changed since a point in time (swap matcher sync)
+        db.Index('ix_swap_requests_updated_at', 'updated_at'),
+        # Oldest pending requests first (expiry sweep), without the settled ones
+        db.Index('ix_swap_requests_pending_created_at', 'created_at',
+                 sqlite_where=db.text("status = 'pending'"), postgresql_where=db.text("status = 'pending'")),
     )
     
     # Relationships
@@ -69,3 +106,135 @@ class SwapRequest(db.Model):
     def __repr__(self):
         return f'<SwapRequest {self.id}>'
 
+
+# Swap lifecycle notifications, written in the same transaction as the
+# change they describe. Every worker tails this table to push them to the
+# requester and the owner of the wanted item (see app/events.py)
+SWAP_EVENT_KINDS = ('created', 'accepted', 'declined', 'cancelled', 'expired')
+
+class SwapEvent(db.Model):
+    __tablename__ = 'swap_events'
+
+    id = db.Column(db.Integer, primary_key=True)
+    swap_id = db.Column(db.Integer, nullable=False)  # No foreign key: cancelled requests are deleted
+    kind = db.Column(db.String(20), nullable=False)
+    requester_id = db.Column(db.Integer, nullable=False)
+    owner_id = db.Column(db.Integer, nullable=False)
+    item_id = db.Column(db.Integer, nullable=False)
+    offered_item_id = db.Column(db.Integer, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+    def __repr__(self):
+        return f'<SwapEvent {self.id} {self.kind}>'
+
+
+# Points movements, append-only: rows are never updated or deleted, so the
+# ledger is the audit trail behind every balance (see app/points.py)
+POINTS_REASONS = ('signup', 'admin', 'transfer', 'redeem', 'sale')
+
+class PointsEntry(db.Model):
+    __tablename__ = 'points_ledger'
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
+    delta = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(20), nullable=False)
+    ref_id = db.Column(db.Integer, nullable=True)  # Item or swap request the movement is about
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # A user's history newest first
+        db.Index('ix_points_ledger_user_id_id', 'user_id', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<PointsEntry {self.user_id} {self.delta:+d}>'
+
+
+# Credits not yet folded into users.points, spread over a few rows per user
+# so concurrent credits to a popular seller don't queue on one row lock.
+# A user's balance is users.points plus the sum of their shards
+class PointsShard(db.Model):
+    __tablename__ = 'points_shards'
+
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), primary_key=True)
+    shard = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    balance = db.Column(db.Integer, default=0, nullable=False)
+
+    def __repr__(self):
+        return f'<PointsShard {self.user_id}/{self.shard} {self.balance}>'
+
+
+# Spendable balance, read with the user row in one statement
+User.balance = db.column_property(
+    User.points + db.select(db.func.coalesce(db.func.sum(PointsShard.balance), 0))
+    .where(PointsShard.user_id == User.id).correlate_except(PointsShard).scalar_subquery()
+)
+
+
+# Single row whose version changes whenever any listing is added, edited,
+# deleted or changes hands: the cheap freshness signal for catalog pages
+class CatalogState(db.Model):
+    __tablename__ = 'catalog_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<CatalogState {self.version}>'
+
+
+# Background jobs, claimed by `flask jobs work` processes and run with their
+# JSON payload as keyword arguments (see app/jobs.py). Enqueued in the
+# transaction of the change they follow up on, so they exist iff it does
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+
+class Job(db.Model):
+    __tablename__ = 'jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, default='{}', nullable=False)
+    status = db.Column(db.String(20), default='queued', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)  # Not before; retries back off
+    locked_by = db.Column(db.String(100), nullable=True)
+    locked_until = db.Column(db.DateTime, nullable=True)  # Lease: a lost worker's job is retried after it
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        CheckConstraint("status IN ('queued', 'running', 'done', 'failed')", name='check_job_status'),
+        # Due jobs in order (claims), expired leases and old finished jobs
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.name} {self.status}>'
+
+
+# Next run of each periodic job in JOB_SCHEDULE: the worker that moves
+# next_run_at forward is the one that enqueues the run
+class JobSchedule(db.Model):
+    __tablename__ = 'job_schedules'
+
+    name = db.Column(db.String(50), primary_key=True)
+    next_run_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<JobSchedule {self.name} {self.next_run_at}>'
+
+
+# Single row rewritten on the primary by `flask replicas sync`; the copy a
+# replica holds tells how far behind the primary that replica is
+class ReplicaHeartbeat(db.Model):
+    __tablename__ = 'replica_heartbeat'
+
+    id = db.Column(db.Integer, primary_key=True)
+    beat_at = db.Column(db.DateTime, nullable=False)
+
+    def __repr__(self):
+        return f'<ReplicaHeartbeat {self.beat_at}>'
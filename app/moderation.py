@@ -0,0 +1,79 @@
+from datetime import datetime
+from sqlalchemy import update, select, or_
+from app import db
+from app.models import Item, User, SwapRequest, ITEM_STATUSES
+from app.http_cache import touch_catalog
+from app.events import record_swap_events
+
+
+# Ids bound per UPDATE ... WHERE id IN (...), well below SQLite's
+# 32766 host parameter limit
+MODERATION_CHUNK = 5000
+
+
+def _chunks(ids):
+    for start in range(0, len(ids), MODERATION_CHUNK):
+        yield ids[start:start + MODERATION_CHUNK]
+
+
+def set_item_status(item_ids, status):
+    """Move listings to `status` with set-based UPDATEs and return how many changed.
+
+    Thousands of ids cost one statement per MODERATION_CHUNK, never a
+    SELECT plus an UPDATE per row. Listings already in `status` are left
+    alone by the WHERE clause, so repeating a bulk action is harmless.
+    Taking listings out of the public feed also declines the pending
+    swaps they are part of, in the same transaction.
+    """
+    if status not in ITEM_STATUSES:
+        raise ValueError(f'Unknown status {status!r}')
+    ids = sorted(set(item_ids))
+    now = datetime.utcnow()
+    changed = 0
+
+    try:
+        for chunk in _chunks(ids):
+            changed += db.session.execute(
+                update(Item)
+                .where(Item.id.in_(chunk), Item.status != status)
+                .values(status=status, updated_at=now)  # New validators for the listing page
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if status != 'approved':
+                declined = db.session.execute(
+                    update(SwapRequest)
+                    .where(
+                        SwapRequest.status == 'pending',
+                        or_(SwapRequest.item_id.in_(chunk), SwapRequest.offered_item_id.in_(chunk))
+                    )
+                    .values(status='declined')
+                    .returning(SwapRequest.id)
+                    .execution_options(synchronize_session=False)
+                ).scalars().all()
+                record_swap_events('declined', declined)
+        if changed:
+            touch_catalog()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    db.session.expire_all()
+    return changed
+
+
+def resolve_users(keys):
+    """Map user ids, usernames or emails to user ids with one query per chunk"""
+    keys = set(keys)
+    numeric = [int(key) for key in keys if key.isdigit()]
+    names = [key for key in keys if not key.isdigit()]
+    found = {}
+    for chunk in _chunks(numeric):
+        for user_id, in db.session.execute(select(User.id).where(User.id.in_(chunk))):
+            found[str(user_id)] = user_id
+    for chunk in _chunks(names):
+        rows = db.session.execute(select(User.id, User.username, User.email)
+                                  .where(or_(User.username.in_(chunk), User.email.in_(chunk))))
+        for user_id, username, email in rows:
+            found[username] = found[email] = user_id
+    return {key: found[key] for key in keys if key in found}
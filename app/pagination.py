@@ -0,0 +1,65 @@
+import base64
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import or_, and_
+
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor'])
+
+
+def encode_cursor(created_at, row_id):
+    """Pack the (created_at, id) position of a row into an opaque URL-safe token"""
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Unpack a cursor token, raises ValueError when it is malformed"""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, row_id = base64.urlsafe_b64decode(padded.encode()).decode().split('|')
+        return datetime.fromisoformat(created_at), int(row_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+def keyset_paginate(query, model, cursor=None, limit=24, ascending=False):
+    """Return one page of `query` ordered newest first by (created_at, id).
+
+    Instead of OFFSET the cursor is the position of the last row already seen,
+    so every page is a bounded index range scan no matter how deep the client
+    has scrolled. `ascending` walks oldest first instead (work queues).
+    """
+    if cursor:
+        created_at, row_id = decode_cursor(cursor)
+        if ascending:
+            query = query.filter(or_(
+                model.created_at > created_at,
+                and_(model.created_at == created_at, model.id > row_id)
+            ))
+        else:
+            query = query.filter(or_(
+                model.created_at < created_at,
+                and_(model.created_at == created_at, model.id < row_id)
+            ))
+
+    if ascending:
+        query = query.order_by(model.created_at.asc(), model.id.asc())
+    else:
+        query = query.order_by(model.created_at.desc(), model.id.desc())
+
+    # Fetch one extra row to find out whether another page exists
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+    return KeysetPage(rows, next_cursor)
+
+
+def get_page_size(args, default, maximum):
+    """Read a `limit` query argument and clamp it to 1..maximum"""
+    limit = args.get('limit', default, type=int)
+    return max(1, min(limit or default, maximum))
@@ -0,0 +1,103 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HashingBusy(RuntimeError):
+    """The hashing pool is saturated; the caller should retry later"""
+
+
+def _lower_thread_priority(nice):
+    # Linux keeps a nice value per thread, so this deprioritises just the
+    # hashing thread and request threads keep the CPU during a login storm
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), nice)
+    except (AttributeError, OSError):
+        pass
+
+
+class PasswordHasher:
+    """Runs password KDFs on a small bounded thread pool.
+
+    scrypt and PBKDF2 release the GIL, so `workers` hashes run truly in
+    parallel while request threads wait on their result. At most
+    `workers + queue_limit` jobs are accepted at once; beyond that, or
+    when a queued job is not done within `timeout` seconds, HashingBusy
+    is raised immediately instead of piling more CPU work on the worker.
+    workers=0 hashes inline on the calling thread (the old behaviour).
+    """
+
+    def __init__(self, method, workers=2, queue_limit=16, timeout=5.0, nice=0):
+        self.method = method
+        self.timeout = timeout
+        self._policy = None
+        self._executor = None
+        self._slots = None
+        if workers:
+            self._executor = ThreadPoolExecutor(workers, thread_name_prefix='rewear-hash',
+                                                initializer=_lower_thread_priority if nice else None,
+                                                initargs=(nice,) if nice else ())
+            self._slots = threading.BoundedSemaphore(workers + queue_limit)
+
+    def _run(self, fn, *args):
+        if self._executor is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise HashingBusy('password hashing queue is full')
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(self.timeout)
+        except FutureTimeout:
+            future.cancel()  # Drop it if it has not started yet
+            raise HashingBusy('password hashing timed out')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, stored, password):
+        return self._run(check_password_hash, stored, password)
+
+    @property
+    def policy(self):
+        """The method prefix of hashes made now, e.g. 'scrypt:32768:8:1'"""
+        if self._policy is None:
+            # werkzeug fills in default parameters, so ask it once for the full prefix
+            self._policy = self._run(generate_password_hash, '', self.method).split('$', 1)[0]
+        return self._policy
+
+    def needs_rehash(self, stored):
+        return stored.split('$', 1)[0] != self.policy
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _hasher():
+    return current_app.extensions['passwords']
+
+
+def hash_password(password):
+    return _hasher().hash(password)
+
+
+def verify_password(stored, password):
+    return _hasher().verify(stored, password)
+
+
+def needs_rehash(stored):
+    """True when `stored` was made with a different algorithm or cost than PASSWORD_HASH_METHOD"""
+    return _hasher().needs_rehash(stored)
+
+
+def init_passwords(app):
+    app.extensions['passwords'] = PasswordHasher(
+        app.config['PASSWORD_HASH_METHOD'],
+        workers=app.config['PASSWORD_HASH_WORKERS'],
+        queue_limit=app.config['PASSWORD_HASH_QUEUE'],
+        timeout=app.config['PASSWORD_HASH_TIMEOUT'],
+        nice=app.config['PASSWORD_HASH_NICE'],
+    )
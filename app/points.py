@@ -0,0 +1,204 @@
+import random
+import time
+from collections import Counter
+from datetime import datetime
+import click
+from flask import current_app
+from sqlalchemy import select, update, delete, insert, bindparam, func
+from sqlalchemy.dialects import sqlite, postgresql
+from app import db
+from app.models import User, PointsEntry, PointsShard
+from app.identity import mark_identity_stale
+from app.jobs import task
+
+# Upserts that add to an existing shard row, per dialect
+_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+class InsufficientPoints(Exception):
+    """The payer's balance does not cover the amount"""
+
+
+def _balance_of(users):
+    """users.points plus the user's unfolded shard credits, for a Core users table"""
+    shards = PointsShard.__table__
+    return users.c.points + select(func.coalesce(func.sum(shards.c.balance), 0)) \
+        .where(shards.c.user_id == users.c.id).scalar_subquery()
+
+
+def get_balances(user_ids):
+    """{user_id: spendable balance} in one query; unknown ids are left out"""
+    user_ids = list(user_ids)
+    if not user_ids:
+        return {}
+    return dict(db.session.execute(select(User.id, User.balance).where(User.id.in_(user_ids))).all())
+
+
+def get_balance(user_id):
+    return get_balances([user_id]).get(user_id, 0)
+
+
+def _append_entries(entries):
+    """Ledger rows for (user_id, delta, reason, ref_id) tuples in one executemany"""
+    if not entries:
+        return
+    now = datetime.utcnow()
+    db.session.execute(insert(PointsEntry.__table__), [
+        {'user_id': user_id, 'delta': delta, 'reason': reason, 'ref_id': ref_id, 'created_at': now}
+        for user_id, delta, reason, ref_id in entries
+    ])
+    for user_id, _, _, _ in entries:
+        mark_identity_stale(user_id)
+
+
+def _add_to_shards(amounts):
+    """Add {user_id: amount} to one random shard row per user"""
+    shards = PointsShard.__table__
+    stmt = _INSERTS[db.engine.dialect.name](shards)
+    stmt = stmt.on_conflict_do_update(index_elements=['user_id', 'shard'],
+                                      set_={'balance': shards.c.balance + stmt.excluded.balance})
+    count = current_app.config['POINTS_SHARDS']
+    db.session.execute(stmt, [{'user_id': user_id, 'shard': random.randrange(count), 'balance': amount}
+                              for user_id, amount in amounts.items()])
+
+
+def _take(amounts):
+    """Subtract {user_id: amount} from users.points where the balance covers it.
+
+    The check and the write are one UPDATE per user, so two concurrent
+    spends can't both pass it. Returns the number of users debited.
+    """
+    users = User.__table__
+    return db.session.execute(
+        update(users)
+        .where(users.c.id == bindparam('b_user_id'), _balance_of(users) >= bindparam('b_amount'))
+        .values(points=users.c.points - bindparam('b_amount')),
+        [{'b_user_id': user_id, 'b_amount': amount} for user_id, amount in amounts.items()]
+    ).rowcount
+
+
+def credit_points(amounts, reason, ref_id=None):
+    """Credit {user_id: amount} in the current transaction.
+
+    Credits land on a random shard row of the user instead of users.points,
+    so credits to the same user from concurrent transactions rarely wait
+    on each other.
+    """
+    amounts = {user_id: amount for user_id, amount in amounts.items() if amount > 0}
+    if amounts:
+        _add_to_shards(amounts)
+        _append_entries([(user_id, amount, reason, ref_id) for user_id, amount in amounts.items()])
+
+
+def debit_points(user_id, amount, reason, ref_id=None):
+    """Take `amount` from a user in the current transaction, or raise InsufficientPoints"""
+    if amount <= 0:
+        return
+    if not _take({user_id: amount}):
+        raise InsufficientPoints('Not enough points')
+    _append_entries([(user_id, -amount, reason, ref_id)])
+
+
+def transfer_points(payer_id, payee_id, amount, reason='transfer', ref_id=None):
+    """Move points between users in the current transaction.
+
+    The payer's row is the only one locked; the payee, often a popular
+    seller receiving many transfers at once, is credited on a shard.
+    """
+    debit_points(payer_id, amount, reason, ref_id)
+    credit_points({payee_id: amount}, reason, ref_id)
+
+
+def adjust_points(deltas, reason='admin', attempts=3):
+    """Apply {user_id: delta} in one transaction and commit.
+
+    Credits go to the shards. Debits are clamped so no balance goes below
+    zero; when a balance drops between reading it and taking from it, the
+    whole adjustment is retried. Returns the number of users adjusted.
+    """
+    credits = {user_id: delta for user_id, delta in deltas.items() if delta > 0}
+    for attempt in range(attempts):
+        balances = get_balances(user_id for user_id, delta in deltas.items() if delta < 0)
+        debits = {user_id: min(-deltas[user_id], balance) for user_id, balance in balances.items() if balance > 0}
+        try:
+            if debits and _take(debits) != len(debits):
+                db.session.rollback()
+                continue
+            credit_points(credits, reason)
+            _append_entries([(user_id, -amount, reason, None) for user_id, amount in debits.items()])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        # Users asked to lose points they don't have count as adjusted (to zero)
+        return len(credits) + len(balances)
+    raise InsufficientPoints('Balances kept changing, adjustment not applied')
+
+
+def compact_points(batch=1000):
+    """Fold the shard rows of up to `batch` users into users.points and commit.
+
+    The shard rows are deleted first, with RETURNING, and exactly what was
+    deleted is added to users.points in the same transaction, so credits
+    arriving meanwhile start fresh shard rows and are never lost. Balances
+    read the same before and after. Returns the number of users folded.
+    """
+    shards, users = PointsShard.__table__, User.__table__
+    try:
+        folded = db.session.execute(
+            delete(shards)
+            .where(shards.c.user_id.in_(select(shards.c.user_id).distinct().limit(batch)))
+            .returning(shards.c.user_id, shards.c.balance)
+        ).all()
+        totals = Counter()
+        for user_id, balance in folded:
+            totals[user_id] += balance
+        if totals:
+            db.session.execute(
+                update(users).where(users.c.id == bindparam('b_user_id'))
+                .values(points=users.c.points + bindparam('b_amount')),
+                [{'b_user_id': user_id, 'b_amount': amount} for user_id, amount in totals.items()]
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(totals)
+
+
+def compact_all(batch=1000):
+    """Compact until no shard rows are left; returns the number of users folded"""
+    total = 0
+    while True:
+        folded = compact_points(batch)
+        total += folded
+        if folded < batch:
+            return total
+
+
+@task('points.compact')
+def compact_points_job(batch=None):
+    return compact_all(batch or current_app.config['POINTS_COMPACT_BATCH'])
+
+
+def init_points(app):
+    """Register `flask points compact`"""
+    @app.cli.group('points')
+    def points_group():
+        """Points ledger maintenance."""
+
+    @points_group.command('compact')
+    @click.option('--loop', is_flag=True, help='Keep compacting every --interval seconds.')
+    @click.option('--interval', type=float, default=None, help='Seconds between passes (POINTS_COMPACT_INTERVAL).')
+    @click.option('--batch', type=int, default=None, help='Users per transaction (POINTS_COMPACT_BATCH).')
+    def compact_command(loop, interval, batch):
+        """Fold sharded credits into users.points."""
+        interval = interval or app.config['POINTS_COMPACT_INTERVAL']
+        batch = batch or app.config['POINTS_COMPACT_BATCH']
+        while True:
+            started = time.perf_counter()
+            folded = compact_all(batch)
+            click.echo(f'folded {folded} users in {(time.perf_counter() - started) * 1000:.0f} ms')
+            if not loop:
+                return
+            time.sleep(interval)
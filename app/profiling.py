@@ -0,0 +1,250 @@
+import cProfile
+import glob
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from flask import g, request, render_template, send_from_directory, abort
+from app.identity import get_current_user
+
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Flame graph viewers: https://www.speedscope.app and flamegraph.pl both read these
+SPEEDSCOPE_SCHEMA = 'https://www.speedscope.app/file-format-schema.json'
+
+
+def _short_path(filename):
+    if filename.startswith(_PROJECT_ROOT + os.sep):
+        return os.path.relpath(filename, _PROJECT_ROOT)
+    marker = 'site-packages' + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    return filename
+
+
+_frame_keys = {}
+
+
+def _frame_key(code):
+    key = _frame_keys.get(code)
+    if key is None:
+        key = _frame_keys[code] = (code.co_qualname, _short_path(code.co_filename), code.co_firstlineno)
+    return key
+
+
+class StackSampler:
+    """Samples the stack of one thread from a helper thread.
+
+    The profiled thread runs unmodified; every interval the helper reads
+    its current frame through sys._current_frames() and counts the call
+    path, so the overhead is a few microseconds per sample rather than a
+    hook on every function call.
+    """
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.duration = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='rewear-profiler', daemon=True)
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.duration = time.perf_counter() - self._started
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(_frame_key(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[tuple(stack)] += 1
+
+
+def _label(key):
+    qualname, filename, line = key
+    # ';' separates frames in the collapsed format
+    return f'{qualname} ({filename}:{line})'.replace(';', ':')
+
+
+def write_collapsed(path, stacks):
+    """Brendan Gregg's folded format: root;...;leaf <count> per line"""
+    with open(path, 'w') as f:
+        for stack, count in sorted(stacks.items()):
+            f.write(';'.join(_label(key) for key in stack) + f' {count}\n')
+
+
+def write_speedscope(path, stacks, interval, name):
+    frames, index = [], {}
+    samples, weights = [], []
+    for stack, count in stacks.items():
+        sample = []
+        for key in stack:
+            if key not in index:
+                index[key] = len(frames)
+                frames.append({'name': key[0], 'file': key[1], 'line': key[2]})
+            sample.append(index[key])
+        samples.append(sample)
+        weights.append(round(count * interval * 1000, 3))
+    document = {
+        '$schema': SPEEDSCOPE_SCHEMA,
+        'name': name,
+        'exporter': 'rewear',
+        'shared': {'frames': frames},
+        'profiles': [{
+            'type': 'sampled',
+            'name': name,
+            'unit': 'milliseconds',
+            'startValue': 0,
+            'endValue': round(sum(weights), 3),
+            'samples': samples,
+            'weights': weights,
+        }],
+    }
+    with open(path, 'w') as f:
+        json.dump(document, f, separators=(',', ':'))
+
+
+class Capture:
+    __slots__ = ('id', 'mode', 'trigger', 'profiler', 'started')
+
+    def __init__(self, mode, trigger, interval):
+        self.id = f'{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-{secrets.token_hex(3)}'
+        self.mode = mode
+        self.trigger = trigger
+        self.started = time.time()
+        if mode == 'cprofile':
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        else:
+            self.profiler = StackSampler(threading.get_ident(), interval)
+            self.profiler.start()
+
+
+def list_captures(directory, limit=None):
+    """Metadata of the stored captures, newest first"""
+    captures = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.meta.json')), reverse=True)[:limit]:
+        try:
+            with open(path) as f:
+                captures.append(json.load(f))
+        except (OSError, ValueError):
+            continue  # Removed by another worker's pruning
+    return captures
+
+
+def _prune(directory, keep):
+    metas = sorted(glob.glob(os.path.join(directory, '*.meta.json')), reverse=True)
+    for meta in metas[keep:]:
+        for path in glob.glob(meta[:-len('.meta.json')] + '.*'):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+def init_profiling(app):
+    # Disabled means no hooks or routes at all, so requests pay nothing
+    if not app.config['PROFILING_ENABLED']:
+        return
+    directory = app.config['PROFILE_DIR'] or os.path.join(app.instance_path, 'profiles')
+    os.makedirs(directory, exist_ok=True)
+    sample_rate = app.config['PROFILE_SAMPLE_RATE']
+    interval = app.config['PROFILE_INTERVAL_MS'] / 1000
+
+    def requested_mode():
+        value = request.headers.get('X-Profile') or request.args.get('_profile')
+        if not value:
+            return None
+        # Anyone else asking is ignored rather than refused, so the flag leaks nothing
+        user = get_current_user()
+        if user is None or not user.is_admin:
+            return None
+        return 'cprofile' if value == 'cprofile' else 'sample'
+
+    @app.before_request
+    def start_profile():
+        mode = requested_mode()
+        if mode is not None:
+            g._profile = Capture(mode, 'requested', interval)
+        elif sample_rate and random.random() < sample_rate:
+            g._profile = Capture(app.config['PROFILE_MODE'], 'sampled', interval)
+
+    @app.after_request
+    def announce_profile(response):
+        capture = g.get('_profile')
+        if capture is not None:
+            response.headers['X-Profile-Id'] = capture.id
+        return response
+
+    @app.teardown_request
+    def finish_profile(exc):
+        capture = g.pop('_profile', None)
+        if capture is None:
+            return
+        profiler = capture.profiler
+        base = os.path.join(directory, capture.id)
+        name = f'{request.method} {request.full_path.rstrip("?")}'
+        if capture.mode == 'cprofile':
+            profiler.disable()
+            duration = time.time() - capture.started
+            profiler.dump_stats(f'{base}.pstats')
+            files, samples = [f'{capture.id}.pstats'], None
+        else:
+            profiler.stop()
+            duration = profiler.duration
+            write_collapsed(f'{base}.folded', profiler.stacks)
+            write_speedscope(f'{base}.speedscope.json', profiler.stacks, interval, name)
+            files, samples = [f'{capture.id}.speedscope.json', f'{capture.id}.folded'], sum(profiler.stacks.values())
+
+        meta = {
+            'id': capture.id,
+            'request': name,
+            'endpoint': request.endpoint,
+            'mode': capture.mode,
+            'trigger': capture.trigger,
+            'started': capture.started,
+            'duration_ms': round(duration * 1000, 2),
+            'samples': samples,
+            'error': repr(exc) if exc is not None else None,
+            'files': files,
+        }
+        # Statement and render totals when the request was also sampled by metrics
+        metrics = g.get('_metrics')
+        if metrics is not None:
+            meta.update(statements=metrics.statements, db_ms=round(metrics.db_time * 1000, 2),
+                        render_ms=round(metrics.render_time * 1000, 2))
+        # Written last: listings only pick up captures whose files are complete
+        with open(f'{base}.meta.json', 'w') as f:
+            json.dump(meta, f)
+        _prune(directory, app.config['PROFILE_KEEP'])
+
+    from app.routes.auth import admin_required
+
+    @app.route('/admin/profiles')
+    @admin_required
+    def listProfiles():
+        captures = list_captures(directory, app.config['PROFILE_KEEP'])
+        return render_template('admin/profiles.html', captures=captures, sample_rate=sample_rate)
+
+    @app.route('/admin/profiles/<path:filename>')
+    @admin_required
+    def downloadProfile(filename):
+        if not filename.endswith(('.folded', '.speedscope.json', '.pstats')):
+            abort(404)
+        return send_from_directory(directory, filename, as_attachment=True)
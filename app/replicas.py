@@ -0,0 +1,164 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+import click
+from flask import g, request, session
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.exc import SQLAlchemyError
+from app import db
+from app.database import REPLICA_BIND
+from app.models import ReplicaHeartbeat
+
+HEARTBEAT_ID = 1
+
+# Requests that may read from the replica
+READ_METHODS = ('GET', 'HEAD')
+
+
+def beat():
+    """Rewrite the heartbeat row on the primary and commit"""
+    now = datetime.utcnow()
+    if not db.session.execute(update(ReplicaHeartbeat).where(ReplicaHeartbeat.id == HEARTBEAT_ID)
+                              .values(beat_at=now)).rowcount:
+        db.session.execute(insert(ReplicaHeartbeat).values(id=HEARTBEAT_ID, beat_at=now))
+    db.session.commit()
+    return now
+
+
+def sqlite_path(engine):
+    """Database file of a SQLite engine (None for in-memory and other databases)"""
+    if engine.dialect.name != 'sqlite' or engine.url.database in (None, '', ':memory:'):
+        return None
+    return engine.url.database
+
+
+def copy_sqlite(source, target):
+    """Copy one SQLite database into another with the online backup API.
+
+    Readers of the target see either the old or the new copy, and writers
+    of the source are only held up while the pages are read.
+    """
+    src = sqlite3.connect(source)
+    dst = sqlite3.connect(target, timeout=30)
+    try:
+        src.backup(dst)
+    finally:
+        dst.close()
+        src.close()
+
+
+class ReplicaMonitor:
+    """Replication lag of the replica bind.
+
+    The lag is the age of the heartbeat row as the replica has it, so it
+    keeps growing between checks when replication stalls. The row is re-read
+    at most every `interval` seconds, by whichever request gets there
+    first; an unreachable replica or a missing row means unknown lag.
+    """
+
+    def __init__(self, engine, max_lag, interval):
+        self.engine = engine
+        self.max_lag = max_lag
+        self.interval = interval
+        self.beat_at = None
+        self.checked_at = 0
+        self._lock = threading.Lock()
+
+    def check(self):
+        try:
+            with self.engine.connect() as connection:
+                self.beat_at = connection.execute(
+                    select(ReplicaHeartbeat.beat_at).where(ReplicaHeartbeat.id == HEARTBEAT_ID)).scalar()
+        except SQLAlchemyError:
+            self.beat_at = None
+        self.checked_at = time.monotonic()
+
+    @property
+    def lag(self):
+        """Seconds the replica is behind, or None when unknown"""
+        if self.beat_at is None:
+            return None
+        return max(0.0, (datetime.utcnow() - self.beat_at).total_seconds())
+
+    def fresh(self):
+        """Whether reads may go to the replica now"""
+        if time.monotonic() - self.checked_at >= self.interval and self._lock.acquire(blocking=False):
+            try:
+                self.check()
+            finally:
+                self._lock.release()
+        lag = self.lag
+        return lag is not None and lag <= self.max_lag
+
+
+def get_replica_engine(app):
+    with app.app_context():
+        return db.engines.get(REPLICA_BIND)
+
+
+def init_replicas(app):
+    """Read GET requests from the replica bind when one is configured, and `flask replicas`"""
+    engine = get_replica_engine(app)
+    if engine is not None:
+        monitor = ReplicaMonitor(engine, app.config['REPLICA_MAX_LAG'], app.config['REPLICA_LAG_CHECK_INTERVAL'])
+        app.extensions['replica_monitor'] = monitor
+        window = app.config['REPLICA_READ_YOUR_WRITES']
+
+        if engine.dialect.name == 'sqlite':
+            @event.listens_for(engine, 'connect')
+            def read_only(dbapi_connection, connection_record):
+                # A write routed here by mistake fails instead of forking the copy
+                dbapi_connection.execute('PRAGMA query_only = 1')
+
+        @app.before_request
+        def route_reads():
+            if request.method in READ_METHODS and time.time() >= session.get('primary_until', 0) \
+                    and monitor.fresh():
+                g.read_from_replica = True
+
+        @app.after_request
+        def read_own_writes(response):
+            # Whoever just wrote reads from the primary until any replica
+            # fresh enough to be used has their change
+            if g.get('db_wrote'):
+                session['primary_until'] = time.time() + window
+            return response
+
+    @app.cli.group('replicas')
+    def replicas_group():
+        """Read replica heartbeat and local copies."""
+
+    @replicas_group.command('sync')
+    @click.option('--loop', is_flag=True, help='Keep syncing every --interval seconds.')
+    @click.option('--interval', type=float, default=None, help='Seconds between passes (REPLICA_SYNC_INTERVAL).')
+    def sync_command(loop, interval):
+        """Beat the heartbeat on the primary; copy it over a SQLite replica."""
+        if engine is None:
+            raise click.ClickException('No replica configured (REPLICA_DATABASE_URL)')
+        interval = interval or app.config['REPLICA_SYNC_INTERVAL']
+        source, target = sqlite_path(db.engine), sqlite_path(engine)
+        while True:
+            started = time.perf_counter()
+            beat()
+            if source and target:
+                copy_sqlite(source, target)
+                click.echo(f'copied {source} -> {target} in {(time.perf_counter() - started) * 1000:.0f} ms')
+            else:
+                click.echo('heartbeat written, replication copies it')
+            if not loop:
+                return
+            time.sleep(interval)
+
+    @replicas_group.command('status')
+    def status_command():
+        """Print the replica's lag."""
+        if engine is None:
+            raise click.ClickException('No replica configured (REPLICA_DATABASE_URL)')
+        monitor = app.extensions['replica_monitor']
+        monitor.check()
+        lag = monitor.lag
+        state = 'unknown lag (unreachable or never synced)' if lag is None else f'{lag:.1f}s behind'
+        click.echo(f"replica {engine.url.render_as_string(hide_password=True)}: {state}, "
+                   f"{'serving reads' if monitor.fresh() else 'reads go to the primary'} "
+                   f"(max lag {monitor.max_lag:g}s)")
@@ -0,0 +1,126 @@
+from flask import render_template, Blueprint, redirect, url_for, request, flash, jsonify, current_app
+from app.models import Item, ITEM_STATUSES
+from app.routes.auth import admin_required, get_current_identity
+from app.pagination import keyset_paginate, get_page_size
+from app.moderation import set_item_status, resolve_users
+from app.points import adjust_points, InsufficientPoints
+from sqlalchemy.orm import joinedload
+
+admin = Blueprint('admin', __name__)
+
+# Button/API action -> status the listings end up in
+MODERATION_ACTIONS = {'approve': 'approved', 'reject': 'rejected', 'requeue': 'pending'}
+
+def wants_json():
+    return request.is_json or request.accept_mimetypes.best == 'application/json'
+
+def get_queue_page(status, cursor):
+    per_page = get_page_size(request.args, current_app.config['MODERATION_PAGE_SIZE'], current_app.config['MAX_MODERATION_PAGE_SIZE'])
+    query = Item.query.filter(Item.status == status).options(joinedload(Item.owner))
+    # Pending work is reviewed oldest first so nothing waits forever
+    return keyset_paginate(query, Item, cursor, per_page, ascending=(status == 'pending'))
+
+@admin.route("/")
+@admin_required
+def moderationQueue():
+    status = request.args.get('status', 'pending')
+    if status not in ITEM_STATUSES:
+        status = 'pending'
+
+    try:
+        page = get_queue_page(status, request.args.get('cursor'))
+    except ValueError:
+        page = get_queue_page(status, None)
+
+    # Range count on the (status, created_at, id) index
+    pending_total = Item.query.filter(Item.status == 'pending').count()
+
+    return render_template("admin/admin.html",
+                           current_user=get_current_identity(),
+                           items=page.items,
+                           next_cursor=page.next_cursor,
+                           status=status,
+                           statuses=ITEM_STATUSES,
+                           pending_total=pending_total,
+                           profiling_enabled='listProfiles' in current_app.view_functions)
+
+@admin.route("/items/moderate", methods=["POST"])
+@admin_required
+def moderateItems():
+    """Approve, reject or requeue many listings at once (form or JSON)"""
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        action = payload.get('action')
+        raw_ids = payload.get('item_ids') or []
+    else:
+        action = request.form.get('action')
+        raw_ids = request.form.getlist('item_ids')
+
+    try:
+        item_ids = [int(item_id) for item_id in raw_ids]
+    except (TypeError, ValueError):
+        item_ids = None
+
+    if action not in MODERATION_ACTIONS or not item_ids:
+        if wants_json():
+            return jsonify({'error': 'Expected an action (approve/reject/requeue) and item_ids'}), 400
+        flash('Select at least one listing and an action.', 'warning')
+        return redirect(url_for('admin.moderationQueue', status=request.form.get('status', 'pending')))
+
+    status = MODERATION_ACTIONS[action]
+    changed = set_item_status(item_ids, status)
+
+    if wants_json():
+        return jsonify({'status': status, 'requested': len(set(item_ids)), 'updated': changed})
+    flash(f'{changed} listing{"s" if changed != 1 else ""} {status}.', 'success')
+    # The moved rows left the queue, so its first page now holds the next batch
+    return redirect(url_for('admin.moderationQueue', status=request.form.get('status', 'pending')))
+
+@admin.route("/users/points", methods=["POST"])
+@admin_required
+def adjustUserPoints():
+    """Bulk point adjustments.
+
+    Form: `adjustments` with one "<user id, username or email> <+/-points>"
+    per line. JSON: {"adjustments": {"<user>": delta, ...}}.
+    """
+    requested = {}
+    invalid = []
+    if request.is_json:
+        payload = request.get_json(silent=True) or {}
+        entries = (payload.get('adjustments') or {}).items()
+    else:
+        entries = []
+        for line in request.form.get('adjustments', '').splitlines():
+            parts = line.split()
+            if parts:
+                entries.append((parts[0], parts[1] if len(parts) == 2 else None))
+
+    for key, delta in entries:
+        try:
+            requested[str(key)] = requested.get(str(key), 0) + int(delta)
+        except (TypeError, ValueError):
+            invalid.append(str(key))
+
+    user_ids = resolve_users(requested)
+    unknown = sorted(set(requested) - set(user_ids)) + invalid
+
+    # Several spellings of one user (id and username) add up
+    deltas = {}
+    for key, user_id in user_ids.items():
+        deltas[user_id] = deltas.get(user_id, 0) + requested[key]
+    try:
+        updated = adjust_points(deltas)
+    except InsufficientPoints as e:
+        if wants_json():
+            return jsonify({'error': str(e)}), 409
+        flash(str(e), 'danger')
+        return redirect(url_for('admin.moderationQueue'))
+
+    if wants_json():
+        return jsonify({'updated': updated, 'unknown': unknown}), 400 if unknown and not updated else 200
+    if updated:
+        flash(f'Adjusted points for {updated} user{"s" if updated != 1 else ""}.', 'success')
+    if unknown:
+        flash(f'Skipped unknown users or malformed lines: {", ".join(unknown[:20])}', 'warning')
+    return redirect(url_for('admin.moderationQueue'))
@@ -0,0 +1,340 @@
+import json
+from datetime import datetime
+from functools import wraps
+from flask import Blueprint, request, current_app
+from werkzeug.exceptions import HTTPException
+from sqlalchemy import select, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
+from app import db
+from app.models import Item, User, SwapRequest
+from app.routes.auth import get_current_identity
+from app.pagination import get_page_size
+from app.search import search_items
+from app.dashboard import get_swap_stats, get_pending_counts, RECENT_OUTGOING_LIMIT
+from app.swaps import complete_swap, decline_swap, cancel_swap, load_offer_state, load_swap_pair, SwapConflict
+from app.fragments import invalidate_items
+from app.events import record_swap_events
+from app.points import get_balance
+from app.http_cache import get_catalog_state, make_etag, not_modified, with_validators
+from app.images import item_image
+
+api = Blueprint('api', __name__)
+
+# Listing fields a client can select with ?fields=, and the column behind each
+ITEM_COLUMNS = {
+    'id': Item.id,
+    'user_id': Item.user_id,
+    'title': Item.title,
+    'description': Item.description,
+    'category': Item.category,
+    'size': Item.size,
+    'points_cost': Item.points_cost,
+    'status': Item.status,
+    'image_url': Item.image_url,
+    'created_at': Item.created_at,
+    'updated_at': Item.updated_at,
+}
+# Computed fields and the columns they are computed from
+ITEM_DERIVED = {'owner': ('user_id',), 'image': ('image_url', 'image_hash')}
+_ITEM_SOURCES = dict(ITEM_COLUMNS, image_hash=Item.image_hash)
+
+# The same fields /items/page returns
+DEFAULT_ITEM_FIELDS = ('id', 'title', 'category', 'size', 'points_cost', 'image_url', 'user_id', 'created_at')
+
+SWAP_FIELDS = ('id', 'requester_id', 'item_id', 'offered_item_id', 'status', 'created_at', 'updated_at')
+SWAP_COLUMNS = [getattr(SwapRequest, name) for name in SWAP_FIELDS]
+
+
+def api_response(payload, status=200):
+    """Compact JSON, without the key sorting and indenting jsonify does in debug"""
+    return current_app.response_class(json.dumps(payload, separators=(',', ':')), status=status,
+                                      mimetype='application/json')
+
+def api_error(message, status):
+    return api_response({'error': message}, status)
+
+@api.errorhandler(HTTPException)
+def apiHttpError(e):
+    return api_error(e.description, e.code)
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if get_current_identity() is None:
+            return api_error('Authentication required', 401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def get_payload():
+    """JSON body, or form fields for simple clients"""
+    return request.get_json(silent=True) or request.form
+
+def parse_fields():
+    """Fields from ?fields=a,b,c in the order asked, raises ValueError for unknown ones"""
+    raw = request.args.get('fields')
+    if not raw:
+        return DEFAULT_ITEM_FIELDS
+    fields = tuple(dict.fromkeys(name.strip() for name in raw.split(',') if name.strip()))
+    unknown = [name for name in fields if name not in ITEM_COLUMNS and name not in ITEM_DERIVED]
+    if unknown or not fields:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}; choose from "
+                         f"{', '.join(list(ITEM_COLUMNS) + list(ITEM_DERIVED))}")
+    return fields
+
+def parse_ids(raw):
+    """Ids from ?ids=1,2,3 in the order asked, None when absent"""
+    if raw is None:
+        return None
+    try:
+        ids = list(dict.fromkeys(int(value) for value in raw.split(',') if value.strip()))
+    except ValueError:
+        raise ValueError('ids must be comma separated integers')
+    limit = current_app.config['API_MAX_BATCH']
+    if not ids or len(ids) > limit:
+        raise ValueError(f'Between 1 and {limit} ids per request')
+    return ids
+
+def item_columns(fields, *required):
+    """Columns to select for `fields`: only those, plus what derived fields and paging need"""
+    names = []
+    for name in required + fields:
+        names.extend(ITEM_DERIVED.get(name, (name,)))
+    return [_ITEM_SOURCES[name] for name in dict.fromkeys(names)]
+
+def serialize_items(rows, fields):
+    """Dicts of `fields` from column rows or Item objects.
+
+    Owner names for the whole batch come from one extra query, and only
+    when `owner` was asked for.
+    """
+    owners = {}
+    if 'owner' in fields and rows:
+        user_ids = {row.user_id for row in rows}
+        owners = dict(db.session.execute(select(User.id, User.username).where(User.id.in_(user_ids))).all())
+
+    plain = [name for name in fields if name in ITEM_COLUMNS]
+    result = []
+    for row in rows:
+        data = {}
+        for name in plain:
+            value = getattr(row, name)
+            data[name] = value.isoformat() if isinstance(value, datetime) else value
+        if 'owner' in fields:
+            data['owner'] = owners.get(row.user_id)
+        if 'image' in fields:
+            data['image'] = item_image(row)
+        result.append(data)
+    return result
+
+def serialize_swaps(rows):
+    return [{name: value.isoformat() if isinstance(value, datetime) else value
+             for name, value in zip(SWAP_FIELDS, row)} for row in rows]
+
+def load_visible_items(ids, fields, viewer, *required):
+    """{id: row} of the listings among `ids` the viewer may see.
+
+    Approved listings are public; owners also see their own pending or
+    rejected ones and admins see everything, as on the item page.
+    """
+    query = db.session.query(*item_columns(fields, 'id', *required)).filter(Item.id.in_(ids))
+    if not (viewer and viewer.is_admin):
+        visible = Item.status == 'approved'
+        if viewer:
+            visible = or_(visible, Item.user_id == viewer.id)
+        query = query.filter(visible)
+    return {row.id: row for row in query}
+
+def load_swap(swap_id):
+    """The request with its wanted item (whose owner may accept or decline it)"""
+    return db.session.get(SwapRequest, swap_id, options=[joinedload(SwapRequest.item)])
+
+def get_swap_row(swap_id):
+    return db.session.execute(select(*SWAP_COLUMNS).where(SwapRequest.id == swap_id)).first()
+
+@api.route("/items")
+def listItems():
+    """Listings feed (keyset paginated, searchable) or a batch by ?ids="""
+    try:
+        fields = parse_fields()
+        ids = parse_ids(request.args.get('ids'))
+    except ValueError as e:
+        return api_error(str(e), 400)
+
+    viewer = get_current_identity()
+    catalog_version, catalog_changed_at = get_catalog_state()
+    # Batches may include the viewer's own unapproved listings, the feed never does
+    etag = make_etag('api-items', catalog_version, sorted(request.args.items(multi=True)),
+                     ids is not None and viewer and (viewer.id, viewer.is_admin))
+    cached = not_modified(etag, catalog_changed_at)
+    if cached:
+        return cached
+
+    if ids is not None:
+        rows = load_visible_items(ids, fields, viewer)
+        payload = {
+            'items': serialize_items([rows[item_id] for item_id in ids if item_id in rows], fields),
+            'missing': [item_id for item_id in ids if item_id not in rows],
+        }
+    else:
+        per_page = get_page_size(request.args, current_app.config['API_PAGE_SIZE'], current_app.config['MAX_API_PAGE_SIZE'])
+        try:
+            page = search_items(request.args.get('q', '').strip(), request.args.get('category', '').strip(),
+                                request.args.get('size', '').strip(), request.args.get('cursor'), per_page,
+                                columns=item_columns(fields, 'created_at', 'id'))
+        except ValueError:
+            return api_error('Invalid cursor', 400)
+        payload = {'items': serialize_items(page.items, fields), 'next_cursor': page.next_cursor}
+
+    return with_validators(api_response(payload), etag, catalog_changed_at)
+
+@api.route("/items/<int:item_id>")
+def getItem(item_id):
+    """One listing, plus what the viewer can offer for it"""
+    try:
+        fields = parse_fields()
+    except ValueError as e:
+        return api_error(str(e), 400)
+
+    viewer = get_current_identity()
+    row = load_visible_items([item_id], fields, viewer, 'user_id').get(item_id)
+    if row is None:
+        return api_error('Listing not found', 404)
+
+    payload = {'item': serialize_items([row], fields)[0]}
+    if viewer and viewer.id != row.user_id:
+        offerable, pending_swap = load_offer_state(viewer.id, item_id)
+        payload['swap'] = {
+            'offerable_item_ids': [it.id for it in offerable],
+            'pending_swap_id': pending_swap and pending_swap.id,
+        }
+
+    # A single row: validating against the body itself is as cheap as anything else
+    catalog_version, catalog_changed_at = get_catalog_state()
+    etag = make_etag('api-item', catalog_version, payload)
+    cached = not_modified(etag, catalog_changed_at)
+    if cached:
+        return cached
+    return with_validators(api_response(payload), etag, catalog_changed_at)
+
+@api.route("/dashboard")
+@api_login_required
+def getDashboard():
+    """The viewer's listings, swap requests and counters, as plain columns"""
+    try:
+        fields = parse_fields()
+    except ValueError as e:
+        return api_error(str(e), 400)
+    user_id = get_current_identity().id
+
+    items = db.session.query(*item_columns(fields, 'id')).filter(Item.user_id == user_id) \
+        .order_by(Item.created_at.desc(), Item.id.desc()).all()
+    incoming = db.session.execute(
+        select(*SWAP_COLUMNS).join(Item, SwapRequest.item_id == Item.id)
+        .where(Item.user_id == user_id, SwapRequest.status == 'pending')
+        .order_by(SwapRequest.created_at.desc())
+    ).all()
+    outgoing = db.session.execute(
+        select(*SWAP_COLUMNS).where(SwapRequest.requester_id == user_id)
+        .order_by(SwapRequest.created_at.desc(), SwapRequest.id.desc()).limit(RECENT_OUTGOING_LIMIT)
+    ).all()
+
+    response = api_response({
+        'items': serialize_items(items, fields),
+        'incoming': serialize_swaps(incoming),
+        'outgoing': serialize_swaps(outgoing),
+        'points': get_balance(user_id),
+        'stats': get_swap_stats(user_id),
+        'pending_counts': {str(item_id): count for item_id, count in get_pending_counts(user_id).items()},
+    })
+    response.cache_control.private = True
+    response.cache_control.no_store = True
+    return response
+
+@api.route("/items/<int:item_id>/swaps", methods=["POST"])
+@api_login_required
+def createSwap(item_id):
+    """Offer one of the viewer's listings for `item_id`: {"offered_item_id": ...}"""
+    user_id = get_current_identity().id
+    try:
+        offered_item_id = int(get_payload().get('offered_item_id'))
+    except (TypeError, ValueError):
+        return api_error('offered_item_id is required', 400)
+
+    pair = load_swap_pair(user_id, item_id, offered_item_id)
+    if item_id not in pair or offered_item_id not in pair:
+        return api_error('Listing not found', 404)
+    requested_item, _, existing_request = pair[item_id]
+    offered_item, pending_offer, _ = pair[offered_item_id]
+
+    if offered_item.user_id != user_id:
+        return api_error('You can only offer your own items', 403)
+    if requested_item.user_id == user_id:
+        return api_error('You cannot swap with your own item', 403)
+    if requested_item.status != 'approved' or offered_item.status != 'approved':
+        return api_error('Only approved listings can be swapped', 409)
+    if existing_request:
+        return api_error('You already have a pending swap request for this item', 409)
+    if pending_offer:
+        return api_error('This item is already offered in another pending swap', 409)
+
+    swap_request = SwapRequest(requester_id=user_id, item_id=item_id, offered_item_id=offered_item_id, status='pending')
+    db.session.add(swap_request)
+    try:
+        db.session.flush()
+        record_swap_events('created', [swap_request.id])
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        return api_error('This item is already offered in another pending swap', 409)
+    return api_response({'swap': serialize_swaps([get_swap_row(swap_request.id)])[0]}, 201)
+
+@api.route("/swaps/<int:swap_id>/accept", methods=["POST"])
+@api_login_required
+def acceptSwap(swap_id):
+    user_id = get_current_identity().id
+    swap_request = load_swap(swap_id)
+    if swap_request is None:
+        return api_error('Swap request not found', 404)
+    if swap_request.item.user_id != user_id:
+        return api_error('You are not authorized to accept this swap', 403)
+    if swap_request.status != 'pending':
+        return api_error('This swap request is no longer pending', 409)
+
+    item_ids = (swap_request.item_id, swap_request.offered_item_id)
+    try:
+        complete_swap(swap_id, user_id)
+    except SwapConflict as e:
+        return api_error(str(e), 409)
+    invalidate_items(*item_ids)
+    return api_response({'swap': serialize_swaps([get_swap_row(swap_id)])[0]})
+
+@api.route("/swaps/<int:swap_id>/decline", methods=["POST"])
+@api_login_required
+def declineSwap(swap_id):
+    swap_request = load_swap(swap_id)
+    if swap_request is None:
+        return api_error('Swap request not found', 404)
+    if swap_request.item.user_id != get_current_identity().id:
+        return api_error('You are not authorized to decline this swap', 403)
+
+    try:
+        decline_swap(swap_id)
+    except SwapConflict as e:
+        return api_error(str(e), 409)
+    return api_response({'swap': serialize_swaps([get_swap_row(swap_id)])[0]})
+
+@api.route("/swaps/<int:swap_id>/cancel", methods=["POST"])
+@api_login_required
+def cancelSwap(swap_id):
+    swap_request = db.session.get(SwapRequest, swap_id)
+    if swap_request is None:
+        return api_error('Swap request not found', 404)
+    if swap_request.requester_id != get_current_identity().id:
+        return api_error('You are not authorized to cancel this swap', 403)
+
+    try:
+        cancel_swap(swap_id)
+    except SwapConflict as e:
+        return api_error(str(e), 409)
+    return '', 204
@@ -1,7 +1,10 @@
 from flask import render_template, Blueprint, redirect, url_for, request, flash, session, jsonify
 from app import db
 from app.models import User
-from werkzeug.security import check_password_hash, generate_password_hash
+from sqlalchemy import update
+from app.identity import get_current_user, get_current_identity, remember_user, forget_user
+from app.passwords import hash_password, verify_password, needs_rehash, HashingBusy
+from app.points import credit_points
 from functools import wraps
 
 auth = Blueprint('auth', __name__)
@@ -15,24 +18,22 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-# def admin_required(f):
-#     @wraps(f)
-#     def decorated_function(*args, **kwargs):
-#         if 'user_id' not in session:
-#             flash('Please log in to access this page.', 'warning')
-#             return redirect(url_for('auth.login'))
-        
-#         if not session.get('is_admin', False):
-#             flash('Admin privileges required to access this page.', 'danger')
-#             return redirect(url_for('item.dashboard'))
-        
-#         return f(*args, **kwargs)
-#     return decorated_function
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'user_id' not in session:
+            flash('Please log in to access this page.', 'warning')
+            return redirect(url_for('auth.login'))
+
+        # Checked against the row on every request, never the session snapshot,
+        # so a demoted or deleted admin loses access immediately
+        user = get_current_user()
+        if user is None or not user.is_admin:
+            flash('Admin privileges required to access this page.', 'danger')
+            return redirect(url_for('item.dashboard'))
 
-def get_current_user():
-    if 'user_id' in session:
-        return User.query.get(session['user_id'])
-    return None
+        return f(*args, **kwargs)
+    return decorated_function
 
 def logout_required(f):  #For auth pages
     @wraps(f)
@@ -92,21 +93,31 @@ def register_post():
             flash('Username already taken.', 'danger')
             return render_template("auth/register.html")                        #!Modification may be required
         
+        # Nothing to write until the password is hashed, so don't hold a connection meanwhile
+        db.session.close()
+
         # Create new user
         new_user = User(
             username=username,
             email=email,
-            password=generate_password_hash(password),
-            points=20,  # Starting points
+            password=hash_password(password),
+            points=0,
             is_admin=False
         )
         
         db.session.add(new_user)
+        db.session.flush()
+        credit_points({new_user.id: 20}, 'signup')  # Starting points, on the ledger like every other movement
         db.session.commit()
         
         flash('Registration successful! Please log in.', 'success')
         return redirect(url_for('auth.login'))
-        
+
+    except HashingBusy:
+        db.session.rollback()
+        flash('We are very busy right now, please try again in a moment.', 'warning')
+        return render_template("auth/register.html"), 503, {'Retry-After': '2'}
+
     except Exception as e:
         db.session.rollback()
         flash('An error occurred during registration. Please try again.', 'danger')
@@ -133,19 +144,27 @@ def login_post():
             flash('Please enter both email and password.', 'danger')
             return render_template("auth/login.html")                   #!Modification may be required
         
-        # Find user
+        # Find user, then hand the connection back to the pool while the
+        # slow hash check runs (the detached row keeps its loaded fields)
         user = User.query.filter_by(email=email).first()
+        db.session.close()
         
         # Check credentials
-        if not user or not check_password_hash(user.password, password):
+        if not user or not verify_password(user.password, password):
             flash('Invalid email or password.', 'danger')
             return render_template("auth/login.html")                   #!Modification may be required
-        
+
+        # Upgrade hashes made under an older PASSWORD_HASH_METHOD while we have the password
+        try:
+            if needs_rehash(user.password):
+                user.password = hash_password(password)
+                db.session.execute(update(User).where(User.id == user.id).values(password=user.password))
+                db.session.commit()
+        except HashingBusy:
+            db.session.rollback()  # Retried at the next login
+
         # Log in user
-        session['user_id'] = user.id
-        session['username'] = user.username
-        session['is_admin'] = user.is_admin
-        session['user_points'] = user.points
+        remember_user(user)
         
         # Set session to permanent if remember me is checked
         if remember_me:
@@ -159,7 +178,11 @@ def login_post():
             return redirect(next_page)
         
         return redirect(url_for('item.index'))                   #!Modification may be required
-        
+
+    except HashingBusy:
+        flash('We are very busy right now, please try again in a moment.', 'warning')
+        return render_template("auth/login.html"), 503, {'Retry-After': '2'}
+
     except Exception as e:
         flash('An error occurred during login. Please try again.', 'danger')
         print(e)
@@ -168,6 +191,6 @@ def login_post():
 @auth.route("/logout")
 @login_required
 def logout():
-    session.clear()
+    forget_user()
     flash('You have been logged out.', 'info')
     return redirect(url_for('root'))
\ No newline at end of file
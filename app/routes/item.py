@@ -1,29 +1,105 @@
-from flask import render_template, Blueprint, redirect, url_for, request, flash, session, jsonify
+from flask import render_template, Blueprint, redirect, url_for, request, flash, session, jsonify, current_app, abort
 from app import db
-from app.models import Item, User, SwapRequest
-from app.routes.auth import login_required, get_current_user
+from app.models import Item, User, SwapRequest, ITEM_CATEGORIES, ITEM_SIZES
+from app.routes.auth import login_required, get_current_user, get_current_identity
+from app.pagination import get_page_size
+from app.search import search_items
+from app.dashboard import load_dashboard
+from app.swaps import complete_swap, decline_swap, cancel_swap, load_offer_state, load_swap_pair, SwapConflict
+from app.fragments import invalidate_items
+from app.events import record_swap_events, latest_event_id
+from app.http_cache import get_catalog_state, make_etag, not_modified, with_validators
+from app.images import accept_upload, schedule_processing, ImageRejected
+from app.streaming import render_page
 from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload
 from datetime import datetime
 
 item = Blueprint('item', __name__)
 
+def get_listing_filters():
+    """Search text and facet filters from the query string"""
+    return {
+        'q': request.args.get('q', '').strip(),
+        'category': request.args.get('category', '').strip(),
+        'size': request.args.get('size', '').strip()
+    }
+
+def get_listings_page(filters, cursor=None):
+    """Load one page of the listings feed, narrowed by search text and facets"""
+    per_page = get_page_size(request.args, current_app.config['ITEMS_PER_PAGE'], current_app.config['MAX_ITEMS_PER_PAGE'])
+    return search_items(filters['q'], filters['category'], filters['size'], cursor, per_page)
+
+def get_uploaded_image():
+    """(digest, bytes) of the photo posted with a listing form, or None"""
+    upload = request.files.get('image')
+    if not upload or not upload.filename:
+        return None
+    return accept_upload(upload)
+
 @item.route("/")
 def index():
-    #Get all index listings from db
+    #Get the first (or cursor-selected) page of listings from db
+    filters = get_listing_filters()
+
+    # Answer revalidations from the catalog version before querying or rendering
+    catalog_version, catalog_changed_at = get_catalog_state()
+    etag = make_etag('index', catalog_version, sorted(request.args.items(multi=True)), get_current_identity())
+    cached = not_modified(etag, catalog_changed_at)
+    if cached:
+        return cached
+
     try:
-        # Get all approved items from database
-        items = Item.query.all()  # Add .filter_by(status='approved') when you implement admin approval
-        current_user = get_current_user()
-        
-        return render_template("items/index.html", current_user=current_user, items=items)
+        try:
+            page = get_listings_page(filters, request.args.get('cursor'))
+        except ValueError:
+            # Stale or hand-edited cursor, start again from the first page
+            page = get_listings_page(filters)
+        current_user = get_current_identity()
+        
+        return with_validators(render_page("items/index.html", current_user=current_user, items=page.items, next_cursor=page.next_cursor,
+                                           filters=filters, categories=ITEM_CATEGORIES, sizes=ITEM_SIZES),
+                               etag, catalog_changed_at)
     except Exception as e:
         flash('Error loading listings', 'danger')
-        return render_template("items/index.html", current_user=get_current_user(), items=[])
+        return render_template("items/index.html", current_user=get_current_identity(), items=[], next_cursor=None,
+                               filters=filters, categories=ITEM_CATEGORIES, sizes=ITEM_SIZES)
+
+@item.route("/page")
+def listingsPage():
+    """Next page of the listings feed (or of search results) as JSON"""
+    catalog_version, catalog_changed_at = get_catalog_state()
+    etag = make_etag('page', catalog_version, sorted(request.args.items(multi=True)), get_current_identity())
+    cached = not_modified(etag, catalog_changed_at)
+    if cached:
+        return cached
+
+    try:
+        page = get_listings_page(get_listing_filters(), request.args.get('cursor'))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    current_user = get_current_identity()
+    return with_validators(jsonify({
+        'items': [{
+            'id': it.id,
+            'title': it.title,
+            'category': it.category,
+            'size': it.size,
+            'points_cost': it.points_cost,
+            'image_url': it.image_url,
+            'user_id': it.user_id,
+            'created_at': it.created_at.isoformat()
+        } for it in page.items],
+        'html': render_template("items/_listing_cards.html", current_user=current_user, items=page.items),
+        'next_cursor': page.next_cursor
+    }), etag, catalog_changed_at)
 
 @item.route("/new")
 @login_required
 def renderNewPage():
-    current_user = get_current_user()
+    current_user = get_current_identity()
     return render_template("items/new.html", current_user=current_user)
 
 @item.route("/", methods=["POST"])
@@ -57,6 +133,12 @@ def createListing():
             flash('Invalid size selected', 'danger')
             return redirect(url_for('item.renderNewPage'))
 
+        try:
+            upload = get_uploaded_image()
+        except ImageRejected as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('item.renderNewPage'))
+
         # Create new Listing
         new_item = Item(
             user_id=current_user.id,
@@ -70,8 +152,13 @@ def createListing():
         
         db.session.add(new_item)
         db.session.commit()
+        invalidate_items(new_item.id)
 
-        flash('Listing created successfully!', 'success')    #!Not for AI: "It will be available after admin approval."
+        # Resizing runs as a background job, the placeholder shows until it's done
+        if upload:
+            schedule_processing(new_item.id, *upload)
+
+        flash('Listing created! It will be available after admin approval.', 'success')
         return redirect(url_for('item.index'))
 
     except Exception as e:
@@ -82,38 +169,35 @@ def createListing():
     
 @item.route("/<int:item_id>")
 def showListing(item_id):
-    current_item = Item.query.get_or_404(item_id)
-    current_user = get_current_user()
-    
+    current_item = Item.query.options(joinedload(Item.owner)).get_or_404(item_id)
+    current_user = get_current_identity()
+
+    # Listings awaiting (or refused) approval are only visible to their owner and admins
+    if current_item.status != 'approved' and not (current_user and (current_user.id == current_item.user_id or current_user.is_admin)):
+        abort(404)
+
     # Get user's items for swap modal (exclude the current item and items with pending swaps)
+    # and their pending request for this item, from one join on the pending offers
     user_items = []
     pending_swap = None
     
     if current_user and current_user.id != current_item.user_id:
-        # Check if user already has pending swap request for this item
-        pending_swap = SwapRequest.query.filter_by(
-            requester_id=current_user.id,
-            item_id=item_id,
-            status='pending'
-        ).first()
-        
-        # Get user's available items (not currently in pending swap requests as offered items)
-        pending_offered_items = db.session.query(SwapRequest.offered_item_id).filter_by(
-            requester_id=current_user.id,
-            status='pending'
-        ).subquery()
-        
-        user_items = Item.query.filter(
-            Item.user_id == current_user.id,
-            Item.id != item_id,
-            ~Item.id.in_(pending_offered_items)
-        ).all()
+        user_items, pending_swap = load_offer_state(current_user.id, item_id)
 
-    return render_template("items/show.html", 
+    # Everything the page shows is known now, so revalidate before rendering
+    etag = make_etag('show', current_item.id, current_item.updated_at, current_item.user_id, current_item.owner.username,
+                     current_user, [(it.id, it.updated_at) for it in user_items],
+                     pending_swap and (pending_swap.id, pending_swap.offered_item.title))
+    cached = not_modified(etag, current_item.updated_at)
+    if cached:
+        return cached
+
+    return with_validators(render_template("items/show.html", 
                          item=current_item, 
                          current_user=current_user,
                          user_items=user_items,
-                         pending_swap=pending_swap)
+                         pending_swap=pending_swap),
+                           etag, current_item.updated_at)
 
 @item.route("/<int:item_id>/edit")
 @login_required
@@ -161,6 +245,12 @@ def upadateListing(item_id):  # Kept your typo as requested
             flash('Points cost must be a positive number', 'danger')
             return redirect(url_for('item.renderEditPage', item_id=item_id))
 
+        try:
+            upload = get_uploaded_image()
+        except ImageRejected as e:
+            flash(str(e), 'danger')
+            return redirect(url_for('item.renderEditPage', item_id=item_id))
+
         # Update Listing
         current_item.title = title
         current_item.description = description
@@ -168,10 +258,16 @@ def upadateListing(item_id):  # Kept your typo as requested
         current_item.size = size
         current_item.image_url = image_url if image_url else None
         current_item.points_cost = points_cost
+        if image_url:
+            current_item.image_hash = None  # A pasted link replaces the uploaded photo
 
         #!Not for AI: Admin here
 
         db.session.commit()
+        invalidate_items(item_id)
+
+        if upload:
+            schedule_processing(item_id, *upload)
 
         flash('Listing updated successfully!', 'success')
         return redirect(url_for('item.showListing', item_id=item_id))
@@ -193,8 +289,11 @@ def deleteListing(item_id):
             flash('You are not authorized to delete this listing', 'danger')
             return redirect(url_for('item.showListing', item_id=item_id))
         
+        # Pending requests for it are deleted with it (cascade): tell their requesters
+        record_swap_events('cancelled', [sr.id for sr in current_item.swap_requests if sr.status == 'pending'])
         db.session.delete(current_item)
         db.session.commit()
+        invalidate_items(item_id)
         
         flash('Listing deleted successfully!', 'success')
         return redirect(url_for('item.dashboard'))
@@ -209,21 +308,19 @@ def deleteListing(item_id):
 @login_required
 def dashboard():
     current_user = get_current_user()
-    
-    # Get user's items
-    user_items = Item.query.filter_by(user_id=current_user.id).all()
-    
-    # Get swap requests user has made
-    outgoing_requests = SwapRequest.query.filter_by(requester_id=current_user.id).all()
-    
-    # Get swap requests for user's items
-    incoming_requests = SwapRequest.query.join(Item, SwapRequest.item_id == Item.id).filter(Item.user_id == current_user.id).all()
-    
-    return render_template("items/dashboard.html", 
-                         current_user=current_user,
-                         user_items=user_items,
-                         outgoing_requests=outgoing_requests,
-                         incoming_requests=incoming_requests)
+    config = current_app.config
+
+    # Read before anything the page shows, so the live updates stream replays
+    # every swap event the page may have missed (at worst one it already shows)
+    events_since = latest_event_id() if config['EVENTS_WSGI_STREAM'] or config['EVENTS_SERVER'] else None
+
+    # Items, swap graph and counters are loaded in a fixed number of queries;
+    # when streaming, items and incoming requests are fetched as the page renders
+    batch_size = config['STREAM_BATCH_SIZE'] if config['STREAM_PAGES'] else None
+    return render_page("items/dashboard.html", 
+                       current_user=current_user,
+                       events_since=events_since,
+                       **load_dashboard(current_user, batch_size))
 
 # Swap System Routes
 @item.route("/<int:item_id>/request-swap", methods=["POST"])
@@ -231,16 +328,23 @@ def dashboard():
 def requestSwap(item_id):
     """User A requests to swap their item for User B's item"""
     try:
-        current_user = get_current_user()
-        requested_item = Item.query.get_or_404(item_id)
+        current_user = get_current_identity()
         offered_item_id = request.form.get('offered_item_id', type=int)
         
+        # Both items and the pending state that decides the request, in one query
+        pair = load_swap_pair(current_user.id, item_id, offered_item_id)
+        if item_id not in pair:
+            abort(404)
+        requested_item, _, existing_request = pair[item_id]
+        
         # Validation
         if not offered_item_id:
             flash('Please select an item to offer', 'danger')
             return redirect(url_for('item.showListing', item_id=item_id))
         
-        offered_item = Item.query.get_or_404(offered_item_id)
+        if offered_item_id not in pair:
+            abort(404)
+        offered_item, pending_offer, _ = pair[offered_item_id]
         
         # Check if user owns the offered item
         if offered_item.user_id != current_user.id:
@@ -251,24 +355,18 @@ def requestSwap(item_id):
         if requested_item.user_id == current_user.id:
             flash('You cannot swap with your own item', 'danger')
             return redirect(url_for('item.showListing', item_id=item_id))
+
+        # Only listings that passed moderation can change hands
+        if requested_item.status != 'approved' or offered_item.status != 'approved':
+            flash('Only approved listings can be swapped', 'warning')
+            return redirect(url_for('item.showListing', item_id=item_id))
         
         # Check if swap request already exists
-        existing_request = SwapRequest.query.filter_by(
-            requester_id=current_user.id,
-            item_id=item_id,
-            status='pending'
-        ).first()
-        
         if existing_request:
             flash('You already have a pending swap request for this item', 'warning')
             return redirect(url_for('item.showListing', item_id=item_id))
         
         # Check if offered item is already in a pending swap
-        pending_offer = SwapRequest.query.filter_by(
-            offered_item_id=offered_item_id,
-            status='pending'
-        ).first()
-        
         if pending_offer:
             flash('This item is already offered in another pending swap', 'warning')
             return redirect(url_for('item.showListing', item_id=item_id))
@@ -281,10 +379,20 @@ def requestSwap(item_id):
             status='pending'
         )
         
+        # Read before the commit expires them, so the flash costs no reload
+        message = f'Swap request sent! You offered "{offered_item.title}" for "{requested_item.title}"'
         db.session.add(swap_request)
-        db.session.commit()
+        try:
+            db.session.flush()
+            record_swap_events('created', [swap_request.id])
+            db.session.commit()
+        except IntegrityError:
+            # Offered concurrently in another request: uq_swap_requests_pending_offer kept only one
+            db.session.rollback()
+            flash('This item is already offered in another pending swap', 'warning')
+            return redirect(url_for('item.showListing', item_id=item_id))
         
-        flash(f'Swap request sent! You offered "{offered_item.title}" for "{requested_item.title}"', 'success')
+        flash(message, 'success')
         return redirect(url_for('item.showListing', item_id=item_id))
         
     except Exception as e:
@@ -310,26 +418,17 @@ def acceptSwap(swap_id):
             flash('This swap request is no longer pending', 'warning')
             return redirect(url_for('item.dashboard'))
         
-        # Perform the swap - exchange item ownership
-        requested_item = swap_request.item
-        offered_item = swap_request.offered_item
-        
-        # Store original owners
-        original_requested_owner = requested_item.user_id
-        original_offered_owner = offered_item.user_id
-        
-        # Swap ownership
-        requested_item.user_id = original_offered_owner
-        offered_item.user_id = original_requested_owner
+        # Perform the swap - guarded ownership exchange, conflicting requests are declined
+        complete_swap(swap_id, current_user.id)
+        invalidate_items(swap_request.item_id, swap_request.offered_item_id)
         
-        # Update swap status
-        swap_request.status = 'completed'
-        
-        db.session.commit()
-        
-        flash(f'Swap completed! You exchanged "{requested_item.title}" for "{offered_item.title}"', 'success')
+        flash(f'Swap completed! You exchanged "{swap_request.item.title}" for "{swap_request.offered_item.title}"', 'success')
         return redirect(url_for('item.dashboard'))
         
+    except SwapConflict as e:
+        flash(f'{e}. Nothing was exchanged.', 'warning')
+        return redirect(url_for('item.dashboard'))
+
     except Exception as e:
         db.session.rollback()
         flash('An error occurred while completing the swap', 'danger')
@@ -348,15 +447,13 @@ def declineSwap(swap_id):
             flash('You are not authorized to decline this swap', 'danger')
             return redirect(url_for('item.dashboard'))
         
-        # Check if swap is still pending
-        if swap_request.status != 'pending':
-            flash('This swap request is no longer pending', 'warning')
+        # Only declined while still pending: accepting it at the same time wins or loses cleanly
+        try:
+            decline_swap(swap_id)
+        except SwapConflict as e:
+            flash(str(e), 'warning')
             return redirect(url_for('item.dashboard'))
         
-        # Update swap status
-        swap_request.status = 'declined'
-        db.session.commit()
-        
         flash('Swap request declined', 'info')
         return redirect(url_for('item.dashboard'))
         
@@ -378,15 +475,13 @@ def cancelSwap(swap_id):
             flash('You are not authorized to cancel this swap', 'danger')
             return redirect(url_for('item.dashboard'))
         
-        # Check if swap is still pending
-        if swap_request.status != 'pending':
-            flash('This swap request cannot be cancelled', 'warning')
+        # Delete the swap request, unless it was accepted, declined or expired meanwhile
+        try:
+            cancel_swap(swap_id)
+        except SwapConflict as e:
+            flash(str(e), 'warning')
             return redirect(url_for('item.dashboard'))
         
-        # Delete the swap request
-        db.session.delete(swap_request)
-        db.session.commit()
-        
         flash('Swap request cancelled', 'info')
         return redirect(url_for('item.dashboard'))
         
@@ -0,0 +1,157 @@
+import re
+import click
+from sqlalchemy import event, text, table, column, literal_column, bindparam
+from app import db
+from app.models import Item, ITEM_CATEGORIES, ITEM_SIZES
+from app.pagination import keyset_paginate, KeysetPage
+
+
+# External-content FTS5 index over items.title/items.description. The
+# triggers keep it in sync with the items table inside the same transaction,
+# and the prefix indexes make "as you type" prefix queries cheap.
+SEARCH_TABLE = 'items_fts'
+SEARCH_TRIGGERS = ('items_fts_ai', 'items_fts_ad', 'items_fts_au')
+
+SEARCH_DDL = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS items_fts USING fts5(
+        title, description,
+        content='items', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_ai AFTER INSERT ON items BEGIN
+        INSERT INTO items_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_ad AFTER DELETE ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS items_fts_au AFTER UPDATE OF title, description ON items BEGIN
+        INSERT INTO items_fts(items_fts, rowid, title, description) VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO items_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END""",
+]
+
+# Title matches weigh ten times more than description matches. Stored in
+# the index config, so it is only written when the index is (re)built:
+# rewriting it changes the schema under concurrent readers
+SEARCH_RANK = "INSERT INTO items_fts(items_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')"
+
+# Ranked results are paged by offset, so cap how deep a client can go
+MAX_SEARCH_OFFSET = 1000
+MAX_SEARCH_TERMS = 8
+
+items_fts = table(SEARCH_TABLE, column('rowid'), column('rank'))
+
+_index_ready = False
+
+
+def is_search_table(name):
+    """True for the FTS table and its shadow tables (kept out of migrations)"""
+    return name == SEARCH_TABLE or name.startswith(SEARCH_TABLE + '_')
+
+
+def ensure_search_index(connection, rebuild=False):
+    """Create the FTS table and triggers if missing, rebuilding from items when new.
+
+    A missing trigger (e.g. left behind by an interrupted bulk load) also
+    means a rebuild: items written without it never reached the index.
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+
+    names = (SEARCH_TABLE,) + SEARCH_TRIGGERS
+    found = connection.execute(
+        text("SELECT count(*) FROM sqlite_master WHERE name IN :names").bindparams(bindparam('names', expanding=True)),
+        {'names': list(names)}
+    ).scalar()
+
+    if found == len(names) and not rebuild:
+        return True
+
+    for statement in SEARCH_DDL:
+        connection.exec_driver_sql(statement)
+    connection.exec_driver_sql(SEARCH_RANK)
+    connection.exec_driver_sql("INSERT INTO items_fts(items_fts) VALUES ('rebuild')")
+    return True
+
+
+@event.listens_for(Item.__table__, 'after_create')
+def create_search_index(target, connection, **kw):
+    ensure_search_index(connection)
+
+
+def build_match_query(q):
+    """Turn free text into an FTS5 query: every term must match, as a prefix"""
+    terms = re.findall(r'\w+', q, re.UNICODE)[:MAX_SEARCH_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_items(q='', category='', size='', cursor=None, limit=24, status='approved', columns=None):
+    """Search listings by text with optional category/size facets.
+
+    Without search text this is the plain keyset feed narrowed by the facets.
+    With search text the FTS index drives the query and results come back in
+    bm25 order; the cursor is then the offset of the next result. Only
+    listings in `status` (approved by default) are returned. With `columns`
+    (which must include created_at and id) the page holds plain rows of
+    those columns instead of Item objects.
+    """
+    global _index_ready
+
+    query = db.session.query(*columns) if columns else Item.query
+    query = query.filter(Item.status == status)
+    if category in ITEM_CATEGORIES:
+        query = query.filter(Item.category == category)
+    if size in ITEM_SIZES:
+        query = query.filter(Item.size == size)
+
+    match = build_match_query(q) if q else ''
+    if not match:
+        return keyset_paginate(query, Item, cursor, limit)
+
+    try:
+        offset = int(cursor) if cursor else 0
+    except ValueError:
+        raise ValueError('Invalid cursor')
+    if offset < 0 or offset > MAX_SEARCH_OFFSET:
+        raise ValueError('Invalid cursor')
+
+    if db.engine.dialect.name != 'sqlite':
+        # No FTS5 outside SQLite, fall back to a simple substring match
+        for term in re.findall(r'\w+', q, re.UNICODE)[:MAX_SEARCH_TERMS]:
+            pattern = f'%{term}%'
+            query = query.filter(Item.title.ilike(pattern) | Item.description.ilike(pattern))
+        query = query.order_by(Item.created_at.desc(), Item.id.desc())
+    else:
+        if not _index_ready:
+            with db.engine.begin() as connection:
+                ensure_search_index(connection)
+            _index_ready = True
+
+        query = query.join(items_fts, items_fts.c.rowid == Item.id) \
+            .filter(literal_column(SEARCH_TABLE).op('MATCH')(match)) \
+            .order_by(items_fts.c.rank, Item.id)
+
+    rows = query.offset(offset).limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit and offset + limit <= MAX_SEARCH_OFFSET:
+        rows = rows[:limit]
+        next_cursor = str(offset + limit)
+
+    return KeysetPage(rows[:limit], next_cursor)
+
+
+def init_search(app):
+    """Register `flask search index`"""
+    @app.cli.group('search')
+    def search_group():
+        """Listing search."""
+
+    @search_group.command('index')
+    def index_command():
+        """Create (or rebuild) the full-text search index for items."""
+        with db.engine.begin() as connection:
+            if ensure_search_index(connection, rebuild=True):
+                click.echo('Search index rebuilt')
+            else:
+                click.echo('Full-text index is only used with SQLite, nothing to do')
@@ -0,0 +1,102 @@
+import os
+import time
+import click
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import select, inspect
+
+
+def bytecode_cache_dir(app):
+    """JINJA_BYTECODE_CACHE_DIR, relative paths under the instance folder (None = off)"""
+    directory = app.config.get('JINJA_BYTECODE_CACHE_DIR')
+    if not directory:
+        return None
+    return os.path.join(app.instance_path, directory)
+
+
+def compile_templates(app):
+    """Load every template of the app and its blueprints; returns how many.
+
+    Each one is compiled once and, with a bytecode cache, stored there, so
+    later processes skip the Jinja compiler for it.
+    """
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+
+def init_templates(app):
+    """On-disk bytecode cache for compiled templates, and `flask templates compile`"""
+    directory = bytecode_cache_dir(app)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(directory)
+
+    @app.cli.group('templates')
+    def templates_group():
+        """Template compilation."""
+
+    @templates_group.command('compile')
+    @click.option('--clear', is_flag=True, help='Drop cached bytecode first.')
+    def compile_command(clear):
+        """Compile all templates into JINJA_BYTECODE_CACHE_DIR ahead of serving."""
+        cache = app.jinja_env.bytecode_cache
+        if cache is None:
+            raise click.ClickException('JINJA_BYTECODE_CACHE_DIR is not set')
+        if clear:
+            cache.clear()
+        started = time.perf_counter()
+        count = compile_templates(app)
+        click.echo(f'compiled {count} templates into {bytecode_cache_dir(app)} '
+                   f'in {(time.perf_counter() - started) * 1000:.0f} ms')
+
+
+def init_migrations(app, db):
+    """Flask-Migrate, only where `flask db ...` can use it.
+
+    With DB_MIGRATIONS = 'cli' it is loaded for `flask` commands and left
+    out of serving processes (gunicorn run:myapp), which then don't import
+    Alembic at all; 'always' and 'never' override that.
+    """
+    mode = app.config['DB_MIGRATIONS']
+    if mode == 'never' or (mode == 'cli' and click.get_current_context(silent=True) is None):
+        return
+    from flask_migrate import Migrate
+    from app.search import is_search_table
+    # Keep the FTS5 virtual table and its shadow tables out of autogenerated migrations
+    Migrate(app, db, include_name=lambda name, type_, parent_names: not (type_ == 'table' and is_search_table(name)))
+
+
+def warm_up(app):
+    """Get a new worker through its first-request costs before it takes traffic.
+
+    Loads every template, then requests WARMUP_PATHS plus one listing page
+    in-process: the URL map, database connections, template globals and
+    the fragment cache are all ready afterwards. Skipped before the tables
+    exist; other failures are reported and otherwise ignored. Returns
+    {path: status} and the seconds taken.
+    """
+    from app import db
+    from app.models import Item
+
+    started = time.perf_counter()
+    compile_templates(app)
+    paths = list(app.config['WARMUP_PATHS'])
+    statuses = {}
+    try:
+        with app.app_context():
+            if not inspect(db.engine).has_table(Item.__tablename__):
+                return {'skipped': 'no tables yet'}, time.perf_counter() - started
+            item_id = db.session.scalar(select(Item.id).where(Item.status == 'approved').limit(1))
+            db.session.remove()
+        if item_id is not None:
+            paths.append(f'/items/{item_id}')
+    except Exception as e:
+        statuses['listing'] = type(e).__name__
+    client = app.test_client()
+    for path in paths:
+        try:
+            statuses[path] = client.get(path, buffered=True).status_code
+        except Exception as e:
+            statuses[path] = type(e).__name__
+    return statuses, time.perf_counter() - started
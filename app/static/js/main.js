@@ -168,66 +168,136 @@
     });
   });
 
-  // Enhanced search with debouncing and better UX
+  // Server-side search, facets and infinite scroll for the listings feed.
+  // Every request goes to /items/page, which returns rendered cards plus the
+  // cursor of the following page, so the browser never holds the catalog.
   const search = document.getElementById('searchListings');
+  const filters = document.getElementById('listingFilters');
   const grid = document.getElementById('listingGrid');
-  if (search && grid) {
-    const cards = Array.from(grid.querySelectorAll('.listing-card'));
+  const loadMore = document.getElementById('loadMoreListings');
+  const loadMoreWrap = document.getElementById('loadMoreWrap');
+  if (filters && grid && loadMore && grid.dataset.pageUrl) {
+    let loading = false;
     let searchTimeout;
-    
-    const filter = () => {
-      const q = search.value.trim().toLowerCase();
-      let visibleCount = 0;
-      
-      cards.forEach((card, index) => {
-        const hay = (card.getAttribute('data-title') || '').toLowerCase();
-        const show = !q || hay.includes(q);
-        
-        if (show) {
-          visibleCount++;
-          card.style.display = '';
-          // Stagger animations for better visual effect
-          card.style.animationDelay = `${index * 50}ms`;
-          card.classList.add('fade-in');
-        } else {
-          card.style.display = 'none';
-          card.classList.remove('fade-in');
-        }
+    let requestSeq = 0;
+
+    const currentParams = () => {
+      const params = new URLSearchParams();
+      new FormData(filters).forEach((value, key) => {
+        if (String(value).trim()) params.set(key, String(value).trim());
       });
-      
-      // Show "no results" message if needed
-      let noResultsMsg = grid.querySelector('.no-results');
-      if (visibleCount === 0 && q) {
-        if (!noResultsMsg) {
-          noResultsMsg = document.createElement('div');
-          noResultsMsg.className = 'no-results';
-          noResultsMsg.innerHTML = `
-            <div style="text-align: center; padding: 2rem; color: var(--text-muted);">
-              <p>No items found for "${q}"</p>
-              <button class="btn ghost" onclick="document.getElementById('searchListings').value=''; this.closest('.no-results').remove(); document.querySelectorAll('.listing-card').forEach(c => c.style.display = '');">Clear search</button>
+      return params;
+    };
+
+    const setNextCursor = (cursor) => {
+      grid.dataset.nextCursor = cursor || '';
+      loadMoreWrap.style.display = cursor ? 'flex' : 'none';
+      if (cursor) {
+        const params = currentParams();
+        params.set('cursor', cursor);
+        loadMore.href = `?${params}`;
+      }
+    };
+
+    const fetchPage = async (cursor) => {
+      const url = new URL(grid.dataset.pageUrl, window.location.origin);
+      currentParams().forEach((value, key) => url.searchParams.set(key, value));
+      if (cursor) url.searchParams.set('cursor', cursor);
+      const response = await fetch(url, { headers: { 'Accept': 'application/json' } });
+      if (!response.ok) throw new Error(`HTTP ${response.status}`);
+      return response.json();
+    };
+
+    const loadNextPage = async () => {
+      const cursor = grid.dataset.nextCursor;
+      if (loading || !cursor) return;
+      loading = true;
+      const seq = requestSeq;
+      loadMore.textContent = 'Loading...';
+
+      try {
+        const page = await fetchPage(cursor);
+        // Ignore pages that belong to a search the user has since replaced
+        if (seq !== requestSeq) return;
+        grid.insertAdjacentHTML('beforeend', page.html);
+        setNextCursor(page.next_cursor);
+      } catch (error) {
+        console.warn('Loading more listings failed:', error);
+      } finally {
+        loadMore.textContent = 'Load more';
+        loading = false;
+      }
+    };
+
+    const runSearch = async () => {
+      const seq = ++requestSeq;
+      const params = currentParams();
+      try {
+        const page = await fetchPage(null);
+        if (seq !== requestSeq) return;
+
+        if (page.items.length) {
+          grid.innerHTML = page.html;
+          grid.querySelectorAll('.listing-card').forEach((card, index) => {
+            // Stagger animations for better visual effect
+            card.style.animationDelay = `${Math.min(index, 12) * 50}ms`;
+            card.classList.add('fade-in');
+          });
+        } else {
+          grid.innerHTML = `
+            <div class="card card-body no-results">
+              <p>No items match your search. <a href="?" data-clear-search>Clear filters</a>.</p>
             </div>
           `;
-          grid.appendChild(noResultsMsg);
         }
-      } else if (noResultsMsg) {
-        noResultsMsg.remove();
+        setNextCursor(page.next_cursor);
+        history.replaceState(null, '', params.toString() ? `?${params}` : window.location.pathname);
+      } catch (error) {
+        console.warn('Search failed:', error);
       }
     };
-    
-    const debouncedFilter = () => {
+
+    const debouncedSearch = () => {
       clearTimeout(searchTimeout);
-      searchTimeout = setTimeout(filter, 300);
+      searchTimeout = setTimeout(runSearch, 300);
     };
-    
-    ['input', 'change'].forEach(evt => search.addEventListener(evt, debouncedFilter));
-    
-    // Add keyboard shortcuts
-    search.addEventListener('keydown', (e) => {
-      if (e.key === 'Escape') {
-        search.value = '';
-        filter();
-        search.blur();
-      }
+
+    filters.addEventListener('submit', (e) => {
+      e.preventDefault();
+      clearTimeout(searchTimeout);
+      runSearch();
+    });
+    filters.querySelectorAll('select').forEach(select => select.addEventListener('change', runSearch));
+    if (search) {
+      search.addEventListener('input', debouncedSearch);
+
+      // Add keyboard shortcuts
+      search.addEventListener('keydown', (e) => {
+        if (e.key === 'Escape') {
+          search.value = '';
+          runSearch();
+          search.blur();
+        }
+      });
+    }
+
+    grid.addEventListener('click', (e) => {
+      if (!e.target.matches('[data-clear-search]')) return;
+      e.preventDefault();
+      filters.reset();
+      filters.querySelectorAll('input, select').forEach(field => { field.value = ''; });
+      runSearch();
+    });
+
+    // Start fetching a bit before the user reaches the end of the grid
+    const observer = new IntersectionObserver((entries) => {
+      if (entries.some(entry => entry.isIntersecting)) loadNextPage();
+    }, { rootMargin: '400px 0px' });
+    observer.observe(loadMore);
+
+    loadMore.addEventListener('click', (e) => {
+      e.preventDefault();
+      loadNextPage();
     });
   }
 
@@ -0,0 +1,111 @@
+import zlib
+from flask import Response, current_app, request, render_template, stream_template, get_flashed_messages
+
+try:
+    import brotli
+except ImportError:  # brotli is optional: without it streamed pages are only gzipped
+    brotli = None
+
+
+# Output up to the end of the document head is sent on its own, so the
+# browser fetches stylesheets while the body is still being rendered
+HEAD_END = '</head>'
+
+
+class ChunkCompressor:
+    """Incremental gzip or brotli stream that flushes after every chunk.
+
+    The compression window carries over from chunk to chunk, but each
+    compress() ends with a sync flush, so whatever the client has received
+    decodes completely instead of waiting in the compressor's buffer.
+    """
+
+    def __init__(self, encoding, level):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=level)
+        else:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip framing
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data) + self._compressor.flush()
+        return self._compressor.compress(data) + self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def choose_encoding(accept_encodings):
+    """'br', 'gzip' or None, whichever the client accepts first in that order"""
+    for name in ('br', 'gzip'):
+        if name == 'br' and brotli is None:
+            continue
+        if accept_encodings[name]:
+            return name
+    return None
+
+
+def coalesce(pieces, size):
+    """Join a template stream's many small strings into chunks of about `size` characters"""
+    buffer, length = [], 0
+    in_head = True
+    for piece in pieces:
+        buffer.append(piece)
+        length += len(piece)
+        if length >= size or (in_head and HEAD_END in piece):
+            in_head = in_head and HEAD_END not in piece
+            yield ''.join(buffer)
+            buffer, length = [], 0
+    if buffer:
+        yield ''.join(buffer)
+
+
+def encode(chunks, compressor=None):
+    for chunk in chunks:
+        data = chunk.encode('utf-8')
+        if compressor is None:
+            yield data
+        else:
+            compressed = compressor.compress(data)
+            if compressed:
+                yield compressed
+    if compressor is not None:
+        yield compressor.finish()
+
+
+def stream_page(template_name, **context):
+    """HTML response rendered from template_name while it is being sent.
+
+    Pass iterables that fetch rows in batches (Query.yield_per) in the
+    context, and memory stays bounded by the chunk and batch sizes rather
+    than by the page. Headers go out before rendering starts: the session
+    is saved without anything the template changes in it, and a failure
+    midway cuts the page short instead of showing the error page.
+    """
+    config = current_app.config
+    # Pop flashed messages now, while the session can still be saved without them
+    get_flashed_messages()
+    encoding = choose_encoding(request.accept_encodings)
+    compressor = None
+    if encoding:
+        level = config['STREAM_BROTLI_QUALITY'] if encoding == 'br' else config['STREAM_GZIP_LEVEL']
+        compressor = ChunkCompressor(encoding, level)
+
+    chunks = coalesce(stream_template(template_name, **context), config['STREAM_CHUNK_SIZE'])
+    response = Response(encode(chunks, compressor), mimetype='text/html')
+    response.vary.add('Accept-Encoding')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    # Proxies that buffer responses (nginx) would undo the early head
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+def render_page(template_name, **context):
+    """stream_page() with STREAM_PAGES on, render_template() otherwise"""
+    if current_app.config['STREAM_PAGES']:
+        return stream_page(template_name, **context)
+    return render_template(template_name, **context)
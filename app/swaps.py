@@ -0,0 +1,298 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import update, delete, select, or_, and_, bindparam
+from app import db
+from app.models import Item, SwapRequest
+from app.http_cache import touch_catalog
+from app.events import record_swap_events
+from app.jobs import task
+
+
+# The viewer's own pending request for a listing, as the item page shows it
+PendingSwap = namedtuple('PendingSwap', 'id offered_item')
+
+
+class SwapConflict(Exception):
+    """The swap lost a race: it is no longer pending or an item changed hands"""
+
+
+def load_offer_state(user_id, item_id):
+    """What `user_id` can offer for `item_id`, in one query.
+
+    Returns (offerable items, PendingSwap or None). Every approved item of
+    the user comes back with the pending request it is offered in, if any
+    (uq_swap_requests_pending_offer allows at most one): those without one
+    are offerable, and the one offered for `item_id` is the user's pending
+    request for this listing. A pending request always offers an approved
+    item its requester still owns, since moderation and completed swaps
+    decline the requests they invalidate.
+    """
+    rows = db.session.execute(
+        select(Item, SwapRequest.id, SwapRequest.item_id)
+        .outerjoin(SwapRequest, and_(SwapRequest.offered_item_id == Item.id, SwapRequest.status == 'pending'))
+        .where(Item.user_id == user_id, Item.status == 'approved')
+        .order_by(Item.id)
+    ).all()
+
+    offerable = []
+    pending_swap = None
+    for offered_item, swap_id, wanted_id in rows:
+        if swap_id is None:
+            if offered_item.id != item_id:
+                offerable.append(offered_item)
+        elif wanted_id == item_id and pending_swap is None:
+            pending_swap = PendingSwap(swap_id, offered_item)
+    return offerable, pending_swap
+
+
+def load_swap_pair(user_id, item_id, offered_item_id):
+    """The two items of a new request with the pending state that decides it.
+
+    Returns {item id: (Item, offered in a pending request, already asked
+    for by `user_id`)} for whichever of the two ids exist, from one query
+    whose correlated EXISTS probes run on the swap_requests indexes.
+    """
+    offered_pending = select(SwapRequest.id).where(
+        SwapRequest.offered_item_id == Item.id, SwapRequest.status == 'pending').exists()
+    asked_for = select(SwapRequest.id).where(
+        SwapRequest.item_id == Item.id, SwapRequest.requester_id == user_id, SwapRequest.status == 'pending').exists()
+    rows = db.session.execute(
+        select(Item, offered_pending, asked_for).where(Item.id.in_((item_id, offered_item_id)))
+    ).all()
+    return {row[0].id: tuple(row) for row in rows}
+
+
+def complete_swap(swap_id, owner_id):
+    """Accept a pending swap and exchange item ownership in one transaction.
+
+    Every write is a conditional UPDATE that re-checks the state the caller
+    saw (request still pending, both items still with their expected owners)
+    so two workers accepting conflicting swaps can't both succeed: the loser
+    matches zero rows and gets SwapConflict instead of a lock or a stale
+    read. Every other pending request involving either item is declined in
+    the same transaction, since those offers can no longer be honoured,
+    along with the swap events that notify everyone involved.
+
+    Returns the completed SwapRequest.
+    """
+    swap_request = db.session.get(SwapRequest, swap_id)
+    if swap_request is None or swap_request.status != 'pending':
+        raise SwapConflict('This swap request is no longer pending')
+
+    requester_id = swap_request.requester_id
+    item_ids = (swap_request.item_id, swap_request.offered_item_id)
+
+    try:
+        claimed = db.session.execute(
+            update(SwapRequest)
+            .where(SwapRequest.id == swap_id, SwapRequest.status == 'pending')
+            .values(status='completed')
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if claimed != 1:
+            raise SwapConflict('This swap request is no longer pending')
+
+        # Notifications and declines go first, while the items still show
+        # who owned them when the requests were made
+        record_swap_events('accepted', [swap_id])
+        declined = db.session.execute(
+            update(SwapRequest)
+            .where(
+                SwapRequest.status == 'pending',
+                SwapRequest.id != swap_id,
+                or_(SwapRequest.item_id.in_(item_ids), SwapRequest.offered_item_id.in_(item_ids))
+            )
+            .values(status='declined')
+            .returning(SwapRequest.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        record_swap_events('declined', declined)
+
+        # Flip ownership in a fixed (id) order so concurrent swaps sharing an
+        # item take row locks in the same order on databases that have them
+        new_owner = {swap_request.item_id: (owner_id, requester_id),
+                     swap_request.offered_item_id: (requester_id, owner_id)}
+        for item_id in sorted(item_ids):
+            expected_owner, next_owner = new_owner[item_id]
+            moved = db.session.execute(
+                update(Item)
+                .where(Item.id == item_id, Item.user_id == expected_owner)
+                .values(user_id=next_owner)
+                .execution_options(synchronize_session=False)
+            ).rowcount
+            if moved != 1:
+                raise SwapConflict('One of the items has already been swapped')
+
+        touch_catalog()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # The bulk updates bypassed the identity map, reload what callers may read
+    db.session.expire_all()
+    return swap_request
+
+
+
+def decline_swap(swap_id):
+    """Decline a pending request, with its 'declined' event.
+
+    The status check is part of the UPDATE, so a request accepted,
+    declined or expired since the caller looked raises SwapConflict
+    instead of being overwritten.
+    """
+    try:
+        declined = db.session.execute(
+            update(SwapRequest)
+            .where(SwapRequest.id == swap_id, SwapRequest.status == 'pending')
+            .values(status='declined')
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if declined != 1:
+            raise SwapConflict('This swap request is no longer pending')
+        record_swap_events('declined', [swap_id])
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    db.session.expire_all()
+
+
+def cancel_swap(swap_id):
+    """Delete a pending request, with its 'cancelled' event.
+
+    Like decline_swap, only a request that is still pending is deleted;
+    otherwise SwapConflict and nothing is written.
+    """
+    try:
+        # The event reads the request, so it goes in before the row is deleted
+        record_swap_events('cancelled', [swap_id])
+        deleted = db.session.execute(
+            delete(SwapRequest)
+            .where(SwapRequest.id == swap_id, SwapRequest.status == 'pending')
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if deleted != 1:
+            raise SwapConflict('This swap request is no longer pending')
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    db.session.expire_all()
+
+def complete_cycle(swap_ids):
+    """Execute a ring of pending requests as one ownership rotation.
+
+    `swap_ids` is in ring order: every request offers the item the request
+    before it asked for (and the first offers what the last asked for), so
+    each requester hands over exactly the item they offered and receives
+    exactly the item they asked for. Two requests make a plain mutual swap.
+
+    Same guarantees as complete_swap(): the requests are claimed only while
+    pending, every item moves only from its expected owner, and all other
+    pending requests involving a rotated item are declined, all in one
+    transaction. Raises SwapConflict and changes nothing if any part of
+    the ring went stale.
+    """
+    rows = {row.id: row for row in db.session.execute(
+        select(SwapRequest.id, SwapRequest.requester_id, SwapRequest.item_id, SwapRequest.offered_item_id)
+        .where(SwapRequest.id.in_(swap_ids), SwapRequest.status == 'pending')
+    )}
+    if len(rows) != len(swap_ids) or len(swap_ids) < 2:
+        raise SwapConflict('A request in the ring is no longer pending')
+    ring = [rows[swap_id] for swap_id in swap_ids]
+    for previous, current in zip(ring[-1:] + ring[:-1], ring):
+        if current.offered_item_id != previous.item_id:
+            raise SwapConflict('The requests do not form a ring')
+
+    # Item asked for by ring[j] is handed over by ring[j + 1], its offerer
+    moves = [{'item_id': current.item_id, 'old_owner': following.requester_id, 'new_owner': current.requester_id}
+             for current, following in zip(ring, ring[1:] + ring[:1])]
+    moves.sort(key=lambda move: move['item_id'])
+    item_ids = [move['item_id'] for move in moves]
+    items = Item.__table__
+
+    try:
+        claimed = db.session.execute(
+            update(SwapRequest)
+            .where(SwapRequest.id.in_(swap_ids), SwapRequest.status == 'pending')
+            .values(status='completed')
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if claimed != len(swap_ids):
+            raise SwapConflict('A request in the ring is no longer pending')
+
+        # Before the items move, as in complete_swap
+        record_swap_events('accepted', swap_ids)
+        declined = db.session.execute(
+            update(SwapRequest)
+            .where(
+                SwapRequest.status == 'pending',
+                SwapRequest.id.not_in(swap_ids),
+                or_(SwapRequest.item_id.in_(item_ids), SwapRequest.offered_item_id.in_(item_ids))
+            )
+            .values(status='declined')
+            .returning(SwapRequest.id)
+            .execution_options(synchronize_session=False)
+        ).scalars().all()
+        record_swap_events('declined', declined)
+
+        # One executemany in item id order (see complete_swap on lock order)
+        moved = db.session.execute(
+            update(items)
+            .where(items.c.id == bindparam('item_id'), items.c.user_id == bindparam('old_owner'),
+                   items.c.status == 'approved')
+            .values(user_id=bindparam('new_owner')),
+            moves
+        ).rowcount
+        if moved != len(moves):
+            raise SwapConflict('An item in the ring has changed hands')
+
+        touch_catalog()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    db.session.expire_all()
+    return item_ids
+
+
+@task('swaps.expire')
+def expire_stale_swaps(ttl=None, batch=None):
+    """Expire requests pending for more than `ttl` seconds (SWAP_REQUEST_TTL).
+
+    Oldest first, `batch` (SWAP_EXPIRY_BATCH) per transaction: each one is
+    a single UPDATE ... RETURNING over the partial pending index plus the
+    'expired' events, so the write lock is only held briefly and an
+    interrupted sweep keeps what it did. Expiring frees the offered items
+    for other swaps. Returns the number of requests expired.
+    """
+    config = current_app.config
+    cutoff = datetime.utcnow() - timedelta(seconds=ttl or config['SWAP_REQUEST_TTL'])
+    batch = batch or config['SWAP_EXPIRY_BATCH']
+    total = 0
+    while True:
+        try:
+            stale = select(SwapRequest.id) \
+                .where(SwapRequest.status == 'pending', SwapRequest.created_at < cutoff) \
+                .order_by(SwapRequest.created_at).limit(batch)
+            expired = db.session.execute(
+                update(SwapRequest)
+                .where(SwapRequest.id.in_(stale), SwapRequest.status == 'pending')
+                .values(status='expired')
+                .returning(SwapRequest.id)
+                .execution_options(synchronize_session=False)
+            ).scalars().all()
+            record_swap_events('expired', expired)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        total += len(expired)
+        if len(expired) < batch:
+            return total
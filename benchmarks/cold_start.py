@@ -0,0 +1,130 @@
+"""Time from process start to first responses, per startup configuration.
+
+Each run starts a fresh server process (`python -c` with create_app and
+a threaded werkzeug server, production profile) and measures when it
+accepts connections and when its first response to each of the landing,
+feed and listing pages completes, counted from process start. Modes add
+one cold-start measure at a time:
+
+    migrate    Flask-Migrate loaded at serve time (DB_MIGRATIONS=always), no bytecode cache
+    serve      Flask-Migrate left to `flask` commands
+    bytecode   plus templates precompiled into JINJA_BYTECODE_CACHE_DIR
+    warmup     plus TEMPLATE_WARMUP before the port opens
+
+    python -m benchmarks.cold_start --runs 5
+"""
+import argparse
+import http.client
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from sqlalchemy import select
+from app import db
+from app.dataset import load_synthetic
+from app.models import Item
+from app.startup import compile_templates, init_templates
+from benchmarks.common import make_bench_app
+
+SERVER = """
+import sys
+from werkzeug.serving import make_server
+from app import create_app
+make_server('127.0.0.1', int(sys.argv[1]), create_app('production'), threaded=True).serve_forever()
+"""
+
+MODES = {
+    'migrate': {'DB_MIGRATIONS': 'always', 'JINJA_BYTECODE_CACHE_DIR': '', 'TEMPLATE_WARMUP': '0'},
+    'serve': {'DB_MIGRATIONS': 'cli', 'JINJA_BYTECODE_CACHE_DIR': '', 'TEMPLATE_WARMUP': '0'},
+    'bytecode': {'DB_MIGRATIONS': 'cli', 'TEMPLATE_WARMUP': '0'},
+    'warmup': {'DB_MIGRATIONS': 'cli', 'TEMPLATE_WARMUP': '1'},
+}
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start(env, port):
+    """(process, start time, seconds until the port accepts connections)"""
+    started = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', SERVER, str(port)], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return process, started, time.perf_counter() - started
+        except ConnectionRefusedError:
+            if process.poll() is not None:
+                raise SystemExit(f'server exited with {process.returncode}; run it by hand to see why')
+            time.sleep(0.005)
+
+
+def first_responses(port, paths, started):
+    """Seconds from process start until each path's first response was read"""
+    done = []
+    for path in paths:
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        connection.request('GET', path)
+        response = connection.getresponse()
+        response.read()
+        connection.close()
+        if response.status != 200:
+            raise SystemExit(f'{path} answered {response.status}')
+        done.append(time.perf_counter() - started)
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5, help='process starts per mode (median reported)')
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    app, path = make_bench_app(profile='production')
+    with app.app_context():
+        load_synthetic(200, args.items, 0, seed=args.seed)
+        item_id = db.session.scalar(select(Item.id).where(Item.status == 'approved').limit(1))
+    paths = ['/', '/items/', f'/items/{item_id}']
+
+    cache_dir = tempfile.mkdtemp(prefix='rewear-jinja-')
+    app.config['JINJA_BYTECODE_CACHE_DIR'] = cache_dir  # Absolute, so the instance folder is ignored
+    init_templates(app)
+    started = time.perf_counter()
+    count = compile_templates(app)
+    compiled = time.perf_counter() - started
+    # Same templates again, loaded from the bytecode just written
+    app.jinja_env.cache.clear()
+    started = time.perf_counter()
+    compile_templates(app)
+    loaded = time.perf_counter() - started
+    print(f'db {path}; {count} templates: compiled in {compiled * 1000:.0f} ms, '
+          f'loaded from bytecode ({cache_dir}) in {loaded * 1000:.0f} ms')
+
+    print(f"{'mode':<9} {'port open':>10} " + ' '.join(f'{p[:16]:>16}' for p in paths) + '   (ms from process start, median)')
+    for mode in args.modes.split(','):
+        env = dict(os.environ, DATABASE_URL=f'sqlite:///{path}', JINJA_BYTECODE_CACHE_DIR=cache_dir, METRICS_ENABLED='0')
+        env.update(MODES[mode])
+        opened, firsts = [], []
+        for _ in range(args.runs):
+            port = free_port()
+            process, started, ready = start(env, port)
+            try:
+                firsts.append(first_responses(port, paths, started))
+            finally:
+                process.terminate()
+                process.wait()
+            opened.append(ready)
+        print(f'{mode:<9} {statistics.median(opened) * 1000:>10.0f} ' +
+              ' '.join(f'{statistics.median(run[n] for run in firsts) * 1000:>16.0f}' for n in range(len(paths))))
+
+
+if __name__ == '__main__':
+    main()
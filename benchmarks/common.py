@@ -0,0 +1,23 @@
+import os
+import tempfile
+from app import create_app, db
+
+
+def make_bench_app(path=None, profile='development', **config):
+    """Create the app on a throwaway SQLite file with a fresh schema"""
+    if path is None:
+        path = os.path.join(tempfile.mkdtemp(prefix='rewear-bench-'), 'bench.db')
+    # Benchmarks time cold paths themselves, so no warm-up pass, and no job
+    # worker thread competing with what they measure; nothing scrapes /metrics
+    overrides = {'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}', 'TESTING': True, 'TEMPLATE_WARMUP': False,
+                 'JOBS_EMBEDDED_WORKER': False, 'METRICS_REQUIRE_TOKEN': False}
+    overrides.update(config)
+    app = create_app(profile, overrides)
+    with app.app_context():
+        db.drop_all()
+        db.create_all()
+    return app, path
+
+
+def rate(count, seconds):
+    return count / seconds if seconds > 0 else float('inf')
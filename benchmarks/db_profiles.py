@@ -0,0 +1,95 @@
+"""Mixed read/write throughput of the database config profiles.
+
+Worker threads run a browse-style keyset page read or a small write
+(new listing / ownership change) against the same SQLite file, for each
+profile in turn, and report operations per second and lock errors.
+
+    python -m benchmarks.db_profiles --threads 8 --seconds 5 --write-ratio 0.2
+"""
+import argparse
+import random
+import threading
+import time
+from sqlalchemy import update
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.models import User, Item
+from app.pagination import keyset_paginate
+from benchmarks.common import make_bench_app, rate
+
+
+def seed(users, items):
+    db.session.add_all([User(username=f'u{i}', email=f'u{i}@bench.test', password='x') for i in range(users)])
+    db.session.flush()
+    rows = [{'user_id': 1 + i % users, 'title': f'bench item {i}', 'category': 'male', 'size': 'M', 'status': 'approved'}
+            for i in range(items)]
+    db.session.execute(Item.__table__.insert(), rows)
+    db.session.commit()
+
+
+def worker(app, deadline, write_ratio, users, items, stats, lock, seed_value):
+    rng = random.Random(seed_value)
+    local = {'reads': 0, 'writes': 0, 'errors': 0}
+    with app.app_context():
+        while time.perf_counter() < deadline:
+            try:
+                if rng.random() < write_ratio:
+                    if rng.random() < 0.5:
+                        db.session.add(Item(user_id=rng.randint(1, users), title='new bench item', category='kids', size='S'))
+                    else:
+                        db.session.execute(update(Item).where(Item.id == rng.randint(1, items)).values(user_id=rng.randint(1, users)))
+                    db.session.commit()
+                    local['writes'] += 1
+                else:
+                    keyset_paginate(Item.query.filter(Item.status == 'approved'), Item, None, 24)
+                    local['reads'] += 1
+            except OperationalError:
+                db.session.rollback()
+                local['errors'] += 1
+        db.session.remove()
+    with lock:
+        for key, value in local.items():
+            stats[key] += value
+
+
+def run_profile(profile, args):
+    app, path = make_bench_app(profile=profile)
+    with app.app_context():
+        seed(args.users, args.items)
+        journal_mode = db.session.execute(db.text('PRAGMA journal_mode')).scalar()
+
+    stats = {'reads': 0, 'writes': 0, 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+    threads = [threading.Thread(target=worker, args=(app, deadline, args.write_ratio, args.users, args.items, stats, lock, i))
+               for i in range(args.threads)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    total = stats['reads'] + stats['writes']
+    print(f"{profile:<12} journal={journal_mode:<8} ops/s={rate(total, elapsed):>8.0f}  "
+          f"reads/s={rate(stats['reads'], elapsed):>8.0f}  writes/s={rate(stats['writes'], elapsed):>7.0f}  "
+          f"lock errors={stats['errors']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--profiles', default='development,production', help='comma separated profile names')
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--write-ratio', type=float, default=0.2)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items', type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{args.threads} threads, {args.seconds:g}s per profile, {args.write_ratio:.0%} writes, {args.items} items")
+    for profile in args.profiles.split(','):
+        run_profile(profile.strip(), args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,387 @@
+"""End-to-end latency, throughput and SQL count of the main routes.
+
+Seeds a synthetic dataset, then drives the real app for each scenario
+with concurrent clients: Flask test clients in threads (default, also
+counts SQL statements per request) or HTTP requests against a local
+multi-process server (--server N). Results go to a JSON file; --compare
+checks them against a stored baseline and exits 1 on regressions.
+
+    python -m benchmarks.http_routes --items 20000 --concurrency 8 --output benchmarks/results/latest.json
+    python -m benchmarks.http_routes --compare benchmarks/results/baseline.json
+"""
+import argparse
+import http.client
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+from sqlalchemy import event, insert, select
+from app import db
+from app.dataset import load_synthetic, SYNTHETIC_PASSWORD
+from app.models import User, Item, SwapRequest
+from benchmarks.common import make_bench_app, rate
+
+
+SCENARIOS = ('browse_index', 'show_listing', 'dashboard', 'login_post', 'request_swap', 'accept_swap', 'api_feed', 'api_batch')
+
+# What a mobile feed asks the JSON API for
+API_FEED_FIELDS = 'id,title,points_cost,image_url,created_at'
+API_BATCH_SIZE = 20
+
+# Flagged as a regression when worse than the baseline by more than the
+# tolerance, ignoring latency differences below the noise floor
+LATENCY_NOISE_MS = 1.0
+SQL_NOISE = 0.5
+
+
+class SqlCounter:
+    """Statements executed by the current thread, for the test client mode"""
+
+    def __init__(self, engine):
+        self._local = threading.local()
+        event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        self._local.count = getattr(self._local, 'count', 0) + 1
+
+    @property
+    def count(self):
+        return getattr(self._local, 'count', 0)
+
+
+class TestClientTransport:
+    def __init__(self, app, sql_counter):
+        self.client = app.test_client()
+        self.sql_counter = sql_counter
+
+    def reset(self):
+        self.client.delete_cookie('session')
+
+    def request(self, method, path, form=None):
+        """(status, SQL statements) of one request"""
+        before = self.sql_counter.count
+        response = self.client.open(path, method=method, data=form)
+        response.close()
+        return response.status_code, self.sql_counter.count - before
+
+
+class HttpTransport:
+    """One client of the local server; keeps the session cookie"""
+
+    def __init__(self, port):
+        self.port = port
+        self.cookie = None
+
+    def reset(self):
+        self.cookie = None
+
+    def request(self, method, path, form=None):
+        connection = http.client.HTTPConnection('127.0.0.1', self.port, timeout=30)
+        headers = {'Cookie': self.cookie} if self.cookie else {}
+        body = None
+        if form is not None:
+            body = urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        connection.close()
+        return response.status, None
+
+
+def seed_dataset(app, args):
+    with app.app_context():
+        first_user, first_item, _ = load_synthetic(args.users, args.items, args.swaps, seed=args.seed)
+        # Only approved listings are public and swappable
+        item_ids = db.session.scalars(select(Item.id).where(Item.status == 'approved').order_by(Item.id)).all()
+        owners = dict(db.session.execute(select(Item.id, Item.user_id)).all())
+    return {'first_user': first_user, 'users': args.users, 'item_ids': item_ids, 'owners': owners}
+
+
+def prepare_swaps(app, dataset, clients, per_client):
+    """Dedicated rows for the write scenarios, so clients never conflict.
+
+    Clients log in as users spread over the id range, so both the heavy
+    and the light end of the skewed ownership are measured. For
+    request_swap a client gets its own items to offer; for accept_swap it
+    owns fresh items that pending requests from the last user ask for.
+    """
+    first_user, users = dataset['first_user'], dataset['users']
+    with app.app_context():
+        requester_id = db.session.scalar(select(User.id).order_by(User.id.desc()).limit(1))
+        plans = []
+        for n in range(clients):
+            user_id = first_user + n * max(1, (users - 1) // clients)
+            rows = []
+            for kind in ('offer', 'wanted', 'incoming'):
+                for i in range(per_client):
+                    owner = requester_id if kind == 'incoming' else user_id
+                    rows.append({'user_id': owner, 'title': f'bench {kind} {n}-{i}', 'category': 'male', 'size': 'M',
+                                 'points_cost': 10, 'status': 'approved'})
+            ids = db.session.execute(insert(Item).returning(Item.id, sort_by_parameter_order=True), rows).scalars().all()
+            offers, wanted, incoming = ids[:per_client], ids[per_client:2 * per_client], ids[2 * per_client:]
+
+            swap_ids = db.session.execute(insert(SwapRequest).returning(SwapRequest.id, sort_by_parameter_order=True), [
+                {'requester_id': requester_id, 'item_id': w, 'offered_item_id': o, 'status': 'pending'}
+                for w, o in zip(wanted, incoming)
+            ]).scalars().all()
+            targets = [item_id for item_id in dataset['item_ids']
+                       if dataset['owners'][item_id] != user_id][:per_client * 4]
+            plans.append({'user_id': user_id, 'offers': offers, 'targets': targets, 'swaps': swap_ids})
+        db.session.commit()
+    return plans
+
+
+def email_of(user_id):
+    return f'user{user_id}@example.test'
+
+
+def scenario_requests(name, plan, item_ids, rng):
+    """Endless (method, path, form) requests for one client of a scenario"""
+    if name == 'browse_index':
+        while True:
+            yield 'GET', '/items/', None
+    elif name == 'show_listing':
+        while True:
+            yield 'GET', f'/items/{rng.choice(item_ids)}', None
+    elif name == 'dashboard':
+        while True:
+            yield 'GET', '/items/dashboard', None
+    elif name == 'login_post':
+        while True:
+            yield 'POST', '/auth/login', {'email': email_of(plan['user_id']), 'password': SYNTHETIC_PASSWORD}
+    elif name == 'request_swap':
+        for offered, target in zip(plan['offers'], plan['targets']):
+            yield 'POST', f'/items/{target}/request-swap', {'offered_item_id': offered}
+    elif name == 'accept_swap':
+        for swap_id in plan['swaps']:
+            yield 'POST', f'/items/swap/{swap_id}/accept', None
+    elif name == 'api_feed':
+        while True:
+            category = rng.choice(('', 'male', 'female', 'kids'))
+            yield 'GET', f'/api/v1/items?fields={API_FEED_FIELDS}&category={category}', None
+    elif name == 'api_batch':
+        while True:
+            ids = ','.join(str(item_id) for item_id in rng.sample(item_ids, API_BATCH_SIZE))
+            yield 'GET', f'/api/v1/items?ids={ids}&fields={API_FEED_FIELDS}', None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def run_scenario(name, transports, plans, item_ids, args):
+    needs_login = name not in ('browse_index', 'show_listing', 'login_post', 'api_feed', 'api_batch')
+    results = [None] * len(transports)
+
+    def client(n):
+        rng = random.Random(args.seed * 1000 + n)
+        transport = transports[n]
+        requests = scenario_requests(name, plans[n], item_ids, rng)
+        latencies, statements, errors = [], [], 0
+        for i, (method, path, form) in enumerate(requests):
+            if i >= args.warmup + args.requests:
+                break
+            if name == 'login_post':
+                transport.reset()  # login is only accepted when logged out
+            started = time.perf_counter()
+            try:
+                status, sql = transport.request(method, path, form)
+            except Exception:
+                status, sql = 599, None
+            elapsed = time.perf_counter() - started
+            if i < args.warmup:
+                continue
+            latencies.append(elapsed * 1000)
+            if sql is not None:
+                statements.append(sql)
+            if status >= 400:
+                errors += 1
+        results[n] = (latencies, statements, errors)
+
+    if needs_login:
+        for n, transport in enumerate(transports):
+            transport.request('POST', '/auth/login', {'email': email_of(plans[n]['user_id']), 'password': SYNTHETIC_PASSWORD})
+
+    threads = [threading.Thread(target=client, args=(n,)) for n in range(len(transports))]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(value for result in results for value in result[0])
+    statements = [value for result in results for value in result[1]]
+    return {
+        'requests': len(latencies),
+        'errors': sum(result[2] for result in results),
+        'throughput_rps': round(rate(len(latencies), elapsed), 1),
+        'p50_ms': round(percentile(latencies, 0.50), 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95), 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99), 2) if latencies else None,
+        'mean_ms': round(sum(latencies) / len(latencies), 2) if latencies else None,
+        'sql_per_request': round(sum(statements) / len(statements), 2) if statements else None,
+    }
+
+
+def serve(app, listener):
+    import logging
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    make_server('127.0.0.1', listener.getsockname()[1], app, fd=listener.fileno()).serve_forever()
+
+
+def start_workers(app, processes):
+    """Pre-forked worker processes accepting on one shared socket, like a
+    gunicorn sync worker pool (werkzeug's own processes= mode forks per
+    request, which measures fork cost and cold caches instead of the app)"""
+    listener = socket.socket()
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(128)
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=serve, args=(app, listener), daemon=True) for _ in range(processes)]
+    for worker in workers:
+        worker.start()
+    return listener.getsockname()[1], workers
+
+
+def wait_for_server(port, timeout=15):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('benchmark server did not start')
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance):
+    """Print a side by side table, return the list of regressions"""
+    regressions = []
+    for key in ('mode', 'profile', 'dataset', 'concurrency'):
+        if results['meta'][key] != baseline['meta'].get(key):
+            print(f"warning: {key} differs from the baseline ({baseline['meta'].get(key)} -> {results['meta'][key]})")
+    print(f"\n{'scenario':<14} {'p95 ms':>18} {'req/s':>18} {'sql/req':>14}")
+    for name, current in results['scenarios'].items():
+        base = baseline['scenarios'].get(name)
+        if not base:
+            continue
+        flags = []
+        if current['p95_ms'] and base['p95_ms'] and current['p95_ms'] > base['p95_ms'] * (1 + tolerance) \
+                and current['p95_ms'] - base['p95_ms'] > LATENCY_NOISE_MS:
+            flags.append('p95')
+        if base['throughput_rps'] and current['throughput_rps'] < base['throughput_rps'] * (1 - tolerance):
+            flags.append('throughput')
+        if current['sql_per_request'] is not None and base['sql_per_request'] is not None \
+                and current['sql_per_request'] > base['sql_per_request'] + SQL_NOISE:
+            flags.append('sql')
+        regressions.extend(f'{name}: {flag}' for flag in flags)
+        print(f"{name:<14} {base['p95_ms']:>8} -> {current['p95_ms']:<7} {base['throughput_rps']:>8} -> {current['throughput_rps']:<7} "
+              f"{str(base['sql_per_request']):>5} -> {str(current['sql_per_request']):<5} {'REGRESSION ' + ','.join(flags) if flags else ''}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help='comma separated subset of ' + ', '.join(SCENARIOS))
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=20000)
+    parser.add_argument('--swaps', type=int, default=50000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per client and scenario')
+    parser.add_argument('--warmup', type=int, default=10, help='untimed requests per client before read scenarios')
+    parser.add_argument('--profile', default='production')
+    parser.add_argument('--server', type=int, default=0, metavar='PROCESSES', help='benchmark a local server with this many worker processes')
+    parser.add_argument('--output', help='write results JSON here')
+    parser.add_argument('--compare', metavar='BASELINE', help='flag regressions against this results file')
+    parser.add_argument('--tolerance', type=float, default=0.10)
+    args = parser.parse_args()
+    scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+
+    app, path = make_bench_app(profile=args.profile)
+    started = time.perf_counter()
+    dataset = seed_dataset(app, args)
+    plans = prepare_swaps(app, dataset, args.concurrency, args.warmup + args.requests)
+    print(f"Seeded {args.users} users, {args.items} items, {args.swaps} swaps in {time.perf_counter() - started:.1f}s ({path})")
+
+    workers = []
+    if args.server:
+        with app.app_context():
+            db.engine.dispose()
+        port, workers = start_workers(app, args.server)
+        wait_for_server(port)
+        make_transport = lambda: HttpTransport(port)
+    else:
+        with app.app_context():
+            sql_counter = SqlCounter(db.engine)
+        make_transport = lambda: TestClientTransport(app, sql_counter)
+
+    results = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'mode': f'server x{args.server}' if args.server else 'test client',
+            'profile': args.profile,
+            'dataset': {'users': args.users, 'items': args.items, 'swaps': args.swaps, 'seed': args.seed},
+            'concurrency': args.concurrency,
+            'requests_per_client': args.requests,
+        },
+        'scenarios': {},
+    }
+
+    print(f"{'scenario':<14} {'reqs':>6} {'err':>4} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'sql/req':>8}")
+    try:
+        for name in scenarios:
+            transports = [make_transport() for _ in range(args.concurrency)]
+            stats = run_scenario(name, transports, plans, dataset['item_ids'], args)
+            results['scenarios'][name] = stats
+            print(f"{name:<14} {stats['requests']:>6} {stats['errors']:>4} {stats['throughput_rps']:>8} {stats['p50_ms']:>8} "
+                  f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {str(stats['sql_per_request']):>8}")
+    finally:
+        for worker in workers:
+            worker.terminate()
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}: " + ', '.join(regressions))
+            raise SystemExit(1)
+        print('\nNo regressions')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Stale-swap expiry sweep and background job throughput.
+
+sweep: --swaps pending requests, --stale of them older than the TTL, are
+expired by swaps.expire with each of --batches as SWAP_EXPIRY_BATCH (the
+same seeded data each time), reporting rows per second and the mean time
+one batch transaction holds the write lock. The swap page and
+request-swap lookups (load_offer_state, load_swap_pair) and the per-item
+pending counts of the dashboard are timed before and after.
+
+throughput: --jobs jobs sleeping --job-ms each (standing in for image
+resizing or other slow side effects) are run by each of --processes
+forked worker processes sharing the jobs table; every job has to run
+exactly once.
+
+    python -m benchmarks.job_queue --swaps 50000 --stale 0.8 --batches 100,1000,5000
+    python -m benchmarks.job_queue --skip-sweep --jobs 1000 --processes 1,2,4,8
+"""
+import argparse
+import math
+import multiprocessing
+import random
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
+from app import db
+from app.dashboard import get_pending_counts
+from app.dataset import load_synthetic, load_rows
+from app.jobs import task, enqueue, JobWorker
+from app.models import Item, SwapRequest, Job
+from app.swaps import expire_stale_swaps, load_offer_state, load_swap_pair
+from benchmarks.common import make_bench_app, rate
+
+TTL = 14 * 86400
+
+# Runs of bench.sleep across all worker processes (shared through the fork)
+_runs = multiprocessing.get_context('fork').Value('i', 0)
+
+
+@task('bench.sleep')
+def sleep_job(seconds):
+    time.sleep(seconds)
+    with _runs.get_lock():
+        _runs.value += 1
+
+
+def seed_swaps(app, args):
+    """Pending requests between random pairs of items; returns (count, lookup probes)"""
+    rng = random.Random(args.seed)
+    with app.app_context():
+        load_synthetic(args.users, args.items, 0, seed=args.seed)
+        items = db.session.execute(select(Item.id, Item.user_id).where(Item.status == 'approved')
+                                   .order_by(Item.id)).all()
+        rng.shuffle(items)
+        now = datetime.utcnow()
+        rows = []
+        for (wanted, owner), (offered, requester) in zip(items[0::2], items[1::2]):
+            if owner == requester:
+                continue
+            age = TTL + rng.randint(1, 30 * 86400) if rng.random() < args.stale else rng.randint(0, TTL - 3600)
+            rows.append({'requester_id': requester, 'item_id': wanted, 'offered_item_id': offered,
+                         'status': 'pending', 'created_at': now - timedelta(seconds=age)})
+            if len(rows) == args.swaps:
+                break
+        load_rows(SwapRequest.__table__, rows)
+    probes = [(rng.choice(items)[1], rng.choice(items)[0], rng.choice(items)[0]) for _ in range(args.probes)]
+    return len(rows), probes
+
+
+def time_lookups(app, probes):
+    """Mean microseconds of load_offer_state, load_swap_pair and get_pending_counts"""
+    totals = [0.0, 0.0, 0.0]
+    with app.app_context():
+        for user_id, item_id, offered_id in probes:
+            calls = (lambda: load_offer_state(user_id, item_id),
+                     lambda: load_swap_pair(user_id, item_id, offered_id),
+                     lambda: get_pending_counts(user_id))
+            for n, call in enumerate(calls):
+                started = time.perf_counter()
+                call()
+                totals[n] += time.perf_counter() - started
+            db.session.rollback()
+    return [total / len(probes) * 1e6 for total in totals]
+
+
+def sweep(args):
+    for batch in (int(value) for value in args.batches.split(',')):
+        app, path = make_bench_app(METRICS_ENABLED=False, SWAP_REQUEST_TTL=TTL, SWAP_EXPIRY_BATCH=batch)
+        count, probes = seed_swaps(app, args)
+        before = time_lookups(app, probes)
+        with app.app_context():
+            started = time.perf_counter()
+            expired = expire_stale_swaps()
+            elapsed = time.perf_counter() - started
+            pending = db.session.scalar(select(func.count()).select_from(SwapRequest)
+                                        .where(SwapRequest.status == 'pending'))
+        after = time_lookups(app, probes)
+        transactions = max(1, math.ceil(expired / batch))
+        print(f'batch {batch:>5}: expired {expired} of {count} pending in {elapsed * 1000:.0f} ms '
+              f'({rate(expired, elapsed):.0f}/s, {elapsed / transactions * 1000:.1f} ms per transaction), '
+              f'{pending} left | offer state {before[0]:.0f} -> {after[0]:.0f} us, swap pair '
+              f'{before[1]:.0f} -> {after[1]:.0f} us, pending counts {before[2]:.0f} -> {after[2]:.0f} us')
+    print(f'db {path}')
+
+
+def _work(app):
+    JobWorker(app).run(once=True)
+
+
+def throughput(args):
+    context = multiprocessing.get_context('fork')
+    for processes in (int(value) for value in args.processes.split(',')):
+        app, path = make_bench_app(METRICS_ENABLED=False, JOB_SCHEDULE={}, JOBS_POLL_INTERVAL=0.05,
+                                   SQLITE_PRAGMAS={'journal_mode': 'WAL', 'busy_timeout': 10000})
+        with app.app_context():
+            for _ in range(args.jobs):
+                enqueue('bench.sleep', {'seconds': args.job_ms / 1000})
+            db.session.commit()
+            db.engine.dispose()  # No pooled connections across the fork
+        _runs.value = 0
+        workers = [context.Process(target=_work, args=(app,)) for _ in range(processes)]
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - started
+        with app.app_context():
+            done = db.session.scalar(select(func.count()).select_from(Job).where(Job.status == 'done', Job.attempts == 1))
+        print(f'{processes:>2} processes: {args.jobs} jobs of {args.job_ms:g} ms in {elapsed:.2f}s '
+              f'({rate(args.jobs, elapsed):.0f}/s), ran {_runs.value} times, {done} done on the first attempt')
+    print(f'db {path}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--items', type=int, default=60000)
+    parser.add_argument('--swaps', type=int, default=20000, help='pending requests to seed')
+    parser.add_argument('--stale', type=float, default=0.8, help='fraction of them past the TTL')
+    parser.add_argument('--batches', default='100,1000,5000', help='comma separated SWAP_EXPIRY_BATCH values')
+    parser.add_argument('--probes', type=int, default=500, help='lookups timed before and after')
+    parser.add_argument('--jobs', type=int, default=400)
+    parser.add_argument('--job-ms', type=float, default=20)
+    parser.add_argument('--processes', default='1,2,4', help='comma separated worker process counts')
+    parser.add_argument('--skip-sweep', action='store_true')
+    parser.add_argument('--skip-throughput', action='store_true')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if not args.skip_sweep:
+        sweep(args)
+    if not args.skip_throughput:
+        throughput(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+"""Browse latency while a burst of logins hashes passwords concurrently.
+
+Browser threads fetch the listings page for --duration seconds on an
+idle app, then again while --logins threads post to /auth/login as fast
+as they can. Each mode swaps in a password hasher: `inline` hashes on
+the request thread like the original code, `pool` uses the bounded,
+deprioritised hashing pool from the config. With the pool the browse
+percentiles should barely move during the burst, while surplus logins
+are turned away with 503 instead of queueing for CPU.
+
+    python -m benchmarks.login_burst --logins 16 --duration 5
+    python -m benchmarks.login_burst --modes pool --workers 1 --queue 4
+"""
+import argparse
+import random
+import threading
+import time
+from app.dataset import load_synthetic, SYNTHETIC_PASSWORD
+from app.passwords import PasswordHasher
+from benchmarks.common import make_bench_app, rate
+from benchmarks.http_routes import percentile
+
+
+def browse(app, stop, latencies):
+    client = app.test_client()
+    while not stop.is_set():
+        started = time.perf_counter()
+        response = client.get('/items/')
+        latencies.append(time.perf_counter() - started)
+        assert response.status_code == 200, response.status_code
+
+
+def login(app, stop, users, seed, outcomes, latencies):
+    rng = random.Random(seed)
+    while not stop.is_set():
+        # A fresh client per attempt: logged in clients are bounced by logout_required
+        client = app.test_client()
+        email = f'user{rng.randint(1, users)}@example.test'
+        started = time.perf_counter()
+        response = client.post('/auth/login', data={'email': email, 'password': SYNTHETIC_PASSWORD})
+        elapsed = time.perf_counter() - started
+        if response.status_code == 302:
+            outcomes['ok'] += 1
+            latencies.append(elapsed)
+        elif response.status_code == 503:
+            outcomes['rejected'] += 1
+        else:
+            outcomes['failed'] += 1
+
+
+def run_phase(app, args, logins):
+    stop = threading.Event()
+    browse_latencies, login_latencies = [], []
+    outcomes = {'ok': 0, 'rejected': 0, 'failed': 0}
+    threads = [threading.Thread(target=browse, args=(app, stop, browse_latencies)) for _ in range(args.browsers)]
+    threads += [threading.Thread(target=login, args=(app, stop, args.users, args.seed * 100 + n, outcomes, login_latencies))
+                for n in range(logins)]
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    return sorted(browse_latencies), sorted(login_latencies), outcomes
+
+
+def ms(value):
+    return f'{value * 1000:7.1f}' if value is not None else '      -'
+
+
+def report(label, browse_latencies, login_latencies, outcomes, duration):
+    line = (f'{label:<14} browse {rate(len(browse_latencies), duration):6.0f}/s'
+            f'  p50 {ms(percentile(browse_latencies, 0.5))}  p95 {ms(percentile(browse_latencies, 0.95))}'
+            f'  p99 {ms(percentile(browse_latencies, 0.99))} ms')
+    if outcomes['ok'] or outcomes['rejected'] or outcomes['failed']:
+        line += (f' | logins {rate(outcomes["ok"], duration):5.1f}/s ok, {outcomes["rejected"]} rejected,'
+                 f' {outcomes["failed"]} failed, p50 {ms(percentile(login_latencies, 0.5)).strip()} ms')
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--items', type=int, default=2000)
+    parser.add_argument('--browsers', type=int, default=2, help='threads fetching the listings page')
+    parser.add_argument('--logins', type=int, default=16, help='threads posting logins during the burst')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per phase')
+    parser.add_argument('--modes', default='inline,pool', help='comma separated: inline, pool')
+    parser.add_argument('--method', help='PASSWORD_HASH_METHOD (default from config)')
+    parser.add_argument('--workers', type=int, help='PASSWORD_HASH_WORKERS for the pool mode')
+    parser.add_argument('--queue', type=int, help='PASSWORD_HASH_QUEUE for the pool mode')
+    parser.add_argument('--profile', default='development', help='config profile (development/production)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    overrides = {'METRICS_ENABLED': False}
+    if args.method:
+        overrides['PASSWORD_HASH_METHOD'] = args.method
+    if args.workers is not None:
+        overrides['PASSWORD_HASH_WORKERS'] = args.workers
+    if args.queue is not None:
+        overrides['PASSWORD_HASH_QUEUE'] = args.queue
+    app, path = make_bench_app(profile=args.profile, **overrides)
+    config = app.config
+    with app.app_context():
+        load_synthetic(args.users, args.items, 0, seed=args.seed)
+
+    print(f"method {config['PASSWORD_HASH_METHOD']}, {args.browsers} browsers, {args.logins} login threads, "
+          f"{args.duration:g}s per phase, {args.profile} profile, db {path}")
+    for mode in args.modes.split(','):
+        if mode == 'pool':
+            hasher = PasswordHasher(config['PASSWORD_HASH_METHOD'], config['PASSWORD_HASH_WORKERS'],
+                                    config['PASSWORD_HASH_QUEUE'], config['PASSWORD_HASH_TIMEOUT'],
+                                    config['PASSWORD_HASH_NICE'])
+            label = f"pool ({config['PASSWORD_HASH_WORKERS']}+{config['PASSWORD_HASH_QUEUE']})"
+        else:
+            hasher = PasswordHasher(config['PASSWORD_HASH_METHOD'], workers=0)
+            label = 'inline'
+        previous, app.extensions['passwords'] = app.extensions['passwords'], hasher
+        previous.shutdown()
+
+        report(f'{mode} idle', *run_phase(app, args, 0), args.duration)
+        report(f'{label} burst', *run_phase(app, args, args.logins), args.duration)
+        hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+"""Concurrent point transfers into a few hot sellers, by shard count.
+
+--threads workers each run transfers of 1 point from a random payer to
+one of --sellers popular sellers, so every credit targets a handful of
+users. Each shard count in --shards gets a fresh database; the run
+reports transfers per second, then compacts the shards and checks that no
+point was created or lost.
+
+    python -m benchmarks.points_ledger --threads 8 --shards 1,4,16
+    python -m benchmarks.points_ledger --database-url postgresql://localhost/rewear_bench
+
+SQLite serializes all writers on one database lock, so shard rows can't
+help there; row-level locking databases are where the counters matter.
+"""
+import argparse
+import random
+import threading
+import time
+from sqlalchemy import select, func
+from sqlalchemy.exc import OperationalError
+from app import db
+from app.dataset import load_rows
+from app.models import User, PointsEntry
+from app.points import transfer_points, compact_all, get_balance, InsufficientPoints
+from benchmarks.common import make_bench_app, rate
+
+
+def worker(app, transfers, payers, sellers, seed, stats, lock):
+    rng = random.Random(seed)
+    done = {'completed': 0, 'insufficient': 0, 'errors': 0}
+    with app.app_context():
+        for _ in range(transfers):
+            try:
+                transfer_points(rng.randint(1, payers), payers + rng.randint(1, sellers), 1, 'redeem')
+                db.session.commit()
+                done['completed'] += 1
+            except InsufficientPoints:
+                db.session.rollback()
+                done['insufficient'] += 1
+            except OperationalError:
+                db.session.rollback()
+                done['errors'] += 1
+        db.session.remove()
+    with lock:
+        for key, value in done.items():
+            stats[key] += value
+
+
+def run(args, shards):
+    overrides = {'POINTS_SHARDS': shards, 'METRICS_ENABLED': False}
+    if args.database_url:
+        overrides['SQLALCHEMY_DATABASE_URI'] = args.database_url
+    app, path = make_bench_app(profile=args.profile, **overrides)
+    users = args.payers + args.sellers
+    with app.app_context():
+        load_rows(User.__table__, ({'id': u, 'username': f'u{u}', 'email': f'u{u}@bench.test', 'password': 'x',
+                                    'points': args.balance if u <= args.payers else 0} for u in range(1, users + 1)))
+        total_before = db.session.scalar(select(func.sum(User.balance)))
+
+    stats = {'completed': 0, 'insufficient': 0, 'errors': 0}
+    lock = threading.Lock()
+    per_thread = args.transfers // args.threads
+    threads = [threading.Thread(target=worker, args=(app, per_thread, args.payers, args.sellers, args.seed + n, stats, lock))
+               for n in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        started = time.perf_counter()
+        for _ in range(args.reads):
+            get_balance(args.payers + 1)
+        read_sharded = (time.perf_counter() - started) / args.reads
+        started = time.perf_counter()
+        folded = compact_all(args.batch)
+        compacted = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(args.reads):
+            get_balance(args.payers + 1)
+        read_folded = (time.perf_counter() - started) / args.reads
+        total_after = db.session.scalar(select(func.sum(User.balance)))
+        ledger_sum = db.session.scalar(select(func.coalesce(func.sum(PointsEntry.delta), 0)))
+
+    print(f"{shards:>3} shards: {stats['completed']:>6} transfers in {elapsed:6.2f}s "
+          f"({rate(stats['completed'], elapsed):6.0f}/s), {stats['insufficient']} insufficient, "
+          f"{stats['errors']} db errors | hot balance read {read_sharded * 1e6:.0f} us sharded, "
+          f"{read_folded * 1e6:.0f} us folded | compacted {folded} users in {compacted * 1000:.0f} ms | "
+          + ('consistent' if total_after == total_before and ledger_sum == 0 else
+             f'BROKEN: total {total_before} -> {total_after}, ledger sum {ledger_sum}'))
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--transfers', type=int, default=8000, help='total transfers across threads')
+    parser.add_argument('--shards', default='1,4,16', help='comma separated POINTS_SHARDS values to compare')
+    parser.add_argument('--payers', type=int, default=5000)
+    parser.add_argument('--sellers', type=int, default=5, help='hot sellers every transfer pays')
+    parser.add_argument('--balance', type=int, default=1000, help='starting points per payer')
+    parser.add_argument('--batch', type=int, default=1000, help='POINTS_COMPACT_BATCH')
+    parser.add_argument('--reads', type=int, default=1000, help='balance reads timed per state')
+    parser.add_argument('--database-url', default=None, help='run against this database (dropped and recreated!)')
+    parser.add_argument('--profile', default='development', help='config profile (development/production)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    print(f'{args.threads} threads, {args.transfers} transfers from {args.payers} payers to {args.sellers} sellers')
+    for shards in (int(value) for value in args.shards.split(',')):
+        path = run(args, shards)
+    print(f'db {args.database_url or path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Time to first byte, total time and peak memory of the dashboard, buffered vs streamed.
+
+For each size in --items, one user gets that many listings and a pending
+swap request for every --request-every'th of them, and their dashboard is
+requested in-process with STREAM_PAGES off (render_template) and on
+(chunked, rows fetched STREAM_BATCH_SIZE at a time). Times are medians of
+--runs requests; peak memory is what tracemalloc saw allocated during one
+more request, and "on wire" is the body size (buffered pages are sent
+uncompressed, streamed ones with the --encoding the client accepts).
+
+    python -m benchmarks.streamed_pages --items 1000,5000,20000 --encoding gzip
+"""
+import argparse
+import statistics
+import time
+import tracemalloc
+from sqlalchemy import select
+from app import db
+from app.dataset import load_synthetic, load_rows, SYNTHETIC_PASSWORD
+from app.models import User, Item, SwapRequest
+from benchmarks.common import make_bench_app
+
+
+def seed(app, items, request_every):
+    with app.app_context():
+        first_user, _, _ = load_synthetic(2, 0, 0)
+        owner, requester = first_user, first_user + 1
+        load_rows(Item.__table__, ({'user_id': owner if n < items else requester, 'title': f'bench item {n}',
+                                    'description': 'A well loved jacket, barely worn. ' * 4, 'category': 'male',
+                                    'size': 'M', 'points_cost': 10, 'status': 'approved'}
+                                   for n in range(2 * items)))
+        ids = db.session.scalars(select(Item.id).order_by(Item.id)).all()
+        load_rows(SwapRequest.__table__, ({'requester_id': requester, 'item_id': ids[n], 'offered_item_id': ids[items + n],
+                                           'status': 'pending'} for n in range(0, items, request_every)))
+        return db.session.scalar(select(User.email).where(User.id == owner))
+
+
+def fetch(client, encoding):
+    """(seconds to first chunk, seconds to last, bytes on wire)"""
+    started = time.perf_counter()
+    response = client.get('/items/dashboard', headers={'Accept-Encoding': encoding}, buffered=False)
+    first, size = None, 0
+    for chunk in response.response:
+        if first is None:
+            first = time.perf_counter() - started
+        size += len(chunk)
+    response.close()
+    if response.status_code != 200:
+        raise SystemExit(f'dashboard answered {response.status_code}')
+    return first, time.perf_counter() - started, size
+
+
+def measure(args, items, stream):
+    app, path = make_bench_app(STREAM_PAGES=stream, STREAM_BATCH_SIZE=args.batch, METRICS_ENABLED=False)
+    email = seed(app, items, args.request_every)
+    client = app.test_client()
+    client.post('/auth/login', data={'email': email, 'password': SYNTHETIC_PASSWORD})
+    fetch(client, args.encoding)  # Templates compiled, fragment cache and connections warm
+
+    runs = [fetch(client, args.encoding) for _ in range(args.runs)]
+    tracemalloc.start()
+    fetch(client, args.encoding)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (statistics.median(run[0] for run in runs), statistics.median(run[1] for run in runs),
+            runs[0][2], peak, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', default='1000,5000,20000', help='comma separated listing counts for the user')
+    parser.add_argument('--request-every', type=int, default=10, help='one pending incoming request per this many items')
+    parser.add_argument('--encoding', default='gzip', help="Accept-Encoding sent ('gzip', 'br' or '' for none)")
+    parser.add_argument('--batch', type=int, default=200, help='STREAM_BATCH_SIZE')
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f"{'items':>6} {'mode':<9} {'first byte':>11} {'total':>9} {'on wire':>10} {'peak mem':>10}")
+    for items in (int(value) for value in args.items.split(',')):
+        for stream in (False, True):
+            first, total, size, peak, path = measure(args, items, stream)
+            print(f"{items:>6} {'streamed' if stream else 'buffered':<9} {first * 1000:>8.1f} ms {total * 1000:>6.0f} ms "
+                  f"{size / 1024:>7.0f} KB {peak / 1024 / 1024:>7.1f} MB")
+    print(f'db {path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+"""Multi-threaded contention benchmark for accepting swaps.
+
+Every target item gets several competing pending offers and worker threads
+race to accept them all. A correct engine completes exactly one swap per
+target and declines the rest; --naive runs the old read-check-write logic
+for comparison.
+
+    python -m benchmarks.swap_contention --threads 8 --targets 300 --offers 4
+"""
+import argparse
+import queue
+import random
+import threading
+import time
+from sqlalchemy.exc import OperationalError
+from werkzeug.security import generate_password_hash
+from app import db
+from app.models import User, Item, SwapRequest
+from app.swaps import complete_swap, SwapConflict
+from benchmarks.common import make_bench_app, rate
+
+
+def seed(targets, offers):
+    """One owner + target item per target, `offers` requesters bidding on each"""
+    password = generate_password_hash('bench')
+    owners = [User(username=f'owner{i}', email=f'owner{i}@bench.test', password=password) for i in range(targets)]
+    requesters = [User(username=f'req{i}', email=f'req{i}@bench.test', password=password) for i in range(targets * offers)]
+    db.session.add_all(owners + requesters)
+    db.session.flush()
+
+    target_items = [Item(user_id=o.id, title=f'target {i}', category='male', size='M') for i, o in enumerate(owners)]
+    offer_items = [Item(user_id=r.id, title=f'offer {i}', category='female', size='S') for i, r in enumerate(requesters)]
+    db.session.add_all(target_items + offer_items)
+    db.session.flush()
+
+    swaps = []
+    for t, target in enumerate(target_items):
+        for k in range(offers):
+            offer = offer_items[t * offers + k]
+            swaps.append(SwapRequest(requester_id=offer.user_id, item_id=target.id, offered_item_id=offer.id))
+    db.session.add_all(swaps)
+    db.session.commit()
+    return [(s.id, target_items[i // offers].user_id) for i, s in enumerate(swaps)]
+
+
+def naive_accept(swap_id, owner_id):
+    """The original acceptSwap logic: check in Python, then write"""
+    swap_request = db.session.get(SwapRequest, swap_id)
+    if swap_request.status != 'pending' or swap_request.item.user_id != owner_id:
+        raise SwapConflict('no longer pending')
+    requested_item, offered_item = swap_request.item, swap_request.offered_item
+    requested_item.user_id, offered_item.user_id = offered_item.user_id, requested_item.user_id
+    swap_request.status = 'completed'
+    db.session.commit()
+
+
+def worker(app, jobs, accept, stats, lock):
+    with app.app_context():
+        while True:
+            try:
+                swap_id, owner_id = jobs.get_nowait()
+            except queue.Empty:
+                return
+            outcome = 'completed'
+            try:
+                accept(swap_id, owner_id)
+            except SwapConflict:
+                outcome = 'conflicts'
+            except OperationalError:
+                db.session.rollback()
+                outcome = 'errors'
+            finally:
+                db.session.remove()
+            with lock:
+                stats[outcome] += 1
+
+
+def check_invariants():
+    """Return a list of human readable violations (empty when consistent)"""
+    violations = []
+    completed = SwapRequest.query.filter_by(status='completed').all()
+    per_item = {}
+    for s in completed:
+        for item_id in (s.item_id, s.offered_item_id):
+            per_item[item_id] = per_item.get(item_id, 0) + 1
+    doubled = [item_id for item_id, n in per_item.items() if n > 1]
+    if doubled:
+        violations.append(f'{len(doubled)} items completed in more than one swap')
+
+    for s in completed:
+        if s.item.user_id != s.requester_id:
+            violations.append(f'swap {s.id}: requested item not owned by requester')
+            break
+
+    swapped = set(per_item)
+    dangling = SwapRequest.query.filter(
+        SwapRequest.status == 'pending',
+        SwapRequest.item_id.in_(swapped) | SwapRequest.offered_item_id.in_(swapped)
+    ).count() if swapped else 0
+    if dangling:
+        violations.append(f'{dangling} pending requests still reference swapped items')
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--targets', type=int, default=300)
+    parser.add_argument('--offers', type=int, default=4, help='competing offers per target item')
+    parser.add_argument('--naive', action='store_true', help='use the old read-check-write accept')
+    parser.add_argument('--profile', default='development', help='config profile (development/production)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    app, path = make_bench_app(profile=args.profile)
+    with app.app_context():
+        jobs_list = seed(args.targets, args.offers)
+    random.Random(args.seed).shuffle(jobs_list)
+
+    jobs = queue.Queue()
+    for job in jobs_list:
+        jobs.put(job)
+
+    accept = naive_accept if args.naive else complete_swap
+    stats = {'completed': 0, 'conflicts': 0, 'errors': 0}
+    lock = threading.Lock()
+    threads = [threading.Thread(target=worker, args=(app, jobs, accept, stats, lock)) for _ in range(args.threads)]
+
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        violations = check_invariants()
+
+    attempts = len(jobs_list)
+    print(f"engine:      {'naive' if args.naive else 'guarded'} ({args.threads} threads, {args.profile} profile, db {path})")
+    print(f"attempts:    {attempts} accepts on {args.targets} contested items")
+    print(f"completed:   {stats['completed']} (expected {args.targets})")
+    print(f"conflicts:   {stats['conflicts']}")
+    print(f"db errors:   {stats['errors']}")
+    print(f"elapsed:     {elapsed:.3f}s")
+    print(f"throughput:  {rate(attempts, elapsed):.0f} attempts/s, {rate(stats['completed'], elapsed):.0f} accepts/s")
+    print('consistency: ' + ('OK' if not violations else 'BROKEN - ' + '; '.join(violations)))
+
+
+if __name__ == '__main__':
+    main()
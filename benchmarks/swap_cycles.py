@@ -0,0 +1,117 @@
+"""Matching pass over a large pending-request graph with planted swap rings.
+
+Seeds --pending random pending requests (each offering its own item for a
+random item of another user, as the request form allows) plus --rings
+planted rings of 2..--max-length requests, then measures the initial
+graph load, a full matching pass, executing the rings, and an
+incremental pass after --new more requests arrive.
+
+    python -m benchmarks.swap_cycles --pending 300000 --rings 2000
+"""
+import argparse
+import random
+import time
+from sqlalchemy import select
+from app import db
+from app.dataset import load_rows
+from app.matching import SwapMatcher
+from app.models import User, Item, SwapRequest
+from benchmarks.common import make_bench_app, rate
+
+
+def seed(users, pending, rings, max_length, rng):
+    """Random requests over a functional graph, then the planted rings.
+
+    Returns the planted rings as lists of (requester, wanted item) pairs.
+    """
+    load_rows(User.__table__, ({'id': u, 'username': f'u{u}', 'email': f'u{u}@bench.test', 'password': 'x'}
+                               for u in range(1, users + 1)))
+
+    # One offered item per random request, plus as many never offered
+    item_count = pending + pending // 2
+    owners = [0] + [rng.randint(1, users) for _ in range(item_count)]
+    load_rows(Item.__table__, ({'id': i, 'user_id': owners[i], 'title': f'item {i}', 'category': 'male', 'size': 'M',
+                                'status': 'approved'} for i in range(1, item_count + 1)))
+
+    def random_requests():
+        for offered in range(1, pending + 1):
+            wanted = rng.randint(1, item_count)
+            while owners[wanted] == owners[offered]:
+                wanted = rng.randint(1, item_count)
+            yield {'requester_id': owners[offered], 'item_id': wanted, 'offered_item_id': offered}
+    load_rows(SwapRequest.__table__, random_requests())
+    return plant_rings(rings, max_length, users, item_count + 1, rng)
+
+
+def plant_rings(rings, max_length, users, first_item, rng):
+    """Rings of fresh items: request j offers the item request j-1 wants"""
+    planted, items, requests = [], [], []
+    next_item = first_item
+    for _ in range(rings):
+        length = rng.randint(2, max_length)
+        members = rng.sample(range(1, users + 1), length)
+        ring_items = list(range(next_item, next_item + length))
+        next_item += length
+        items += [{'id': item_id, 'user_id': owner, 'title': f'ring item {item_id}', 'category': 'female',
+                   'size': 'S', 'status': 'approved'} for item_id, owner in zip(ring_items, members)]
+        ring = []
+        for j, owner in enumerate(members):
+            wanted = ring_items[(j + 1) % length]
+            requests.append({'requester_id': owner, 'item_id': wanted, 'offered_item_id': ring_items[j]})
+            ring.append((owner, wanted))
+        planted.append(ring)
+    load_rows(Item.__table__, items)
+    load_rows(SwapRequest.__table__, requests)
+    return planted
+
+
+def check_rings(rings):
+    """Ids of planted rings whose requesters did not end up with what they asked for"""
+    owners = dict(db.session.execute(select(Item.id, Item.user_id).where(
+        Item.id.in_([wanted for ring in rings for _, wanted in ring]))).all())
+    return [n for n, ring in enumerate(rings) if any(owners[wanted] != requester for requester, wanted in ring)]
+
+
+def report(label, stats):
+    print(f"{label:<12} {stats['pending']:>8} pending, {stats['changed']:>7} read | sync {stats['sync_s'] * 1000:8.1f} ms"
+          f" | search {stats['search_s'] * 1000:7.1f} ms | {stats['cycles']:>5} rings, {stats['executed']} executed"
+          f" in {stats['execute_s'] * 1000:.0f} ms ({rate(stats['executed'], stats['execute_s']):.0f}/s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--pending', type=int, default=300000, help='random pending requests')
+    parser.add_argument('--rings', type=int, default=2000, help='planted rings of 2..max-length requests')
+    parser.add_argument('--new', type=int, default=200, help='rings planted after the first pass')
+    parser.add_argument('--max-length', type=int, default=5)
+    parser.add_argument('--budget', type=int, default=1000, help='SWAP_CYCLE_SEARCH_BUDGET')
+    parser.add_argument('--overlap', type=float, default=1.0, help='SWAP_MATCH_OVERLAP seconds')
+    parser.add_argument('--profile', default='development', help='config profile (development/production)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    app, path = make_bench_app(profile=args.profile, METRICS_ENABLED=False)
+    with app.app_context():
+        started = time.perf_counter()
+        planted = seed(args.users, args.pending, args.rings, args.max_length, rng)
+        print(f'seeded {args.pending} random + {sum(map(len, planted))} ringed pending requests '
+              f'in {time.perf_counter() - started:.1f}s (db {path})')
+
+        # Let the seeding writes age out of the re-read window, like a quiet moment in production
+        time.sleep(args.overlap)
+        matcher = SwapMatcher(args.max_length, args.budget, args.overlap)
+        report('first pass', matcher.run_pass())
+
+        item_count = db.session.scalar(select(Item.id).order_by(Item.id.desc()).limit(1))
+        added = plant_rings(args.new, args.max_length, args.users, item_count + 1, rng)
+        report('incremental', matcher.run_pass())
+        report('idle', matcher.run_pass())
+
+        broken = check_rings(planted + added)
+        print(f'planted rings completed: {len(planted) + len(added) - len(broken)} of {len(planted) + len(added)}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""Idle cost and delivery latency of parked swap event streams.
+
+Starts the stream server in a child process (`flask events serve`'s
+asyncio loop, or a thread-per-connection WSGI server for comparison),
+opens --connections logged-in Server-Sent Events streams against it, and
+reports the server's memory and CPU while they sit idle. Then a writer
+creates --events swap requests between subscribed users, --pace seconds
+apart, and measures how long each event takes to reach every stream of
+its requester and owner.
+
+    python -m benchmarks.swap_events --connections 2000 --server async
+    python -m benchmarks.swap_events --connections 2000 --server wsgi
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import re
+import resource
+import selectors
+import socket
+import time
+from app import db
+from app.dataset import load_rows
+from app.events import EventStreamServer, get_broker, record_swap_events
+from app.models import User, Item, SwapRequest
+from benchmarks.common import make_bench_app, rate
+
+SWAP_ID = re.compile(rb'"swap_id":(\d+)')
+
+
+def serve(app, kind, port):
+    if kind == 'async':
+        asyncio.run(EventStreamServer(app, get_broker(app)).serve('127.0.0.1', port))
+    else:
+        from werkzeug.serving import make_server
+        make_server('127.0.0.1', port, app, threaded=True).serve_forever()
+
+
+def process_stats(pid):
+    """(resident MB, thread count, CPU seconds) from /proc"""
+    with open(f'/proc/{pid}/status') as f:
+        status = dict(line.split(':', 1) for line in f)
+    with open(f'/proc/{pid}/stat') as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    ticks = int(fields[11]) + int(fields[12])  # utime + stime
+    return (int(status['VmRSS'].split()[0]) / 1024, int(status['Threads']),
+            ticks / os.sysconf('SC_CLK_TCK'))
+
+
+def open_streams(app, port, user_ids):
+    """One connected stream per user id; returns {socket: user id}"""
+    serializer = app.session_interface.get_signing_serializer(app)
+    cookie_name = app.config['SESSION_COOKIE_NAME']
+    streams = {}
+    for user_id in user_ids:
+        sock = socket.create_connection(('127.0.0.1', port))
+        cookie = serializer.dumps({'user_id': user_id})
+        sock.sendall(f"GET {app.config['EVENTS_PATH']} HTTP/1.1\r\nHost: localhost\r\n"
+                     f"Cookie: {cookie_name}={cookie}\r\n\r\n".encode())
+        streams[sock] = user_id
+    # Wait for every response head, so all of them are subscribed
+    for sock in streams:
+        sock.settimeout(30)
+        head = b''
+        while b'\r\n\r\n' not in head:
+            chunk = sock.recv(4096)
+            if not chunk:
+                raise SystemExit(f'stream closed before its response head: {head[:80]!r}')
+            head += chunk
+        if not head.startswith(b'HTTP/1.1 200'):
+            raise SystemExit(f'stream refused: {head.splitlines()[0]!r}')
+        sock.setblocking(False)
+    return streams
+
+
+def deliver(app, streams, count, pace, timeout, rng):
+    """Create `count` swap requests and time each event to every stream that should get it"""
+    by_user = {}
+    for sock, user_id in streams.items():
+        by_user.setdefault(user_id, []).append(sock)
+    users = list(by_user)
+    selector = selectors.DefaultSelector()
+    for sock in streams:
+        selector.register(sock, selectors.EVENT_READ)
+
+    waiting = {}  # swap id -> (sent at, sockets yet to receive it)
+    latencies = []
+    sent = 0
+    next_send = time.perf_counter()
+    give_up = None
+    while sent < count or waiting:
+        now = time.perf_counter()
+        if sent < count and now >= next_send:
+            requester, owner = rng.sample(users, 2)
+            offered = Item(user_id=requester, title='offer', category='male', size='M', status='approved')
+            db.session.add(offered)
+            db.session.flush()
+            swap_request = SwapRequest(requester_id=requester, item_id=owner, offered_item_id=offered.id)
+            db.session.add(swap_request)
+            db.session.flush()
+            record_swap_events('created', [swap_request.id])
+            db.session.commit()
+            waiting[swap_request.id] = (time.perf_counter(), set(by_user[requester] + by_user[owner]))
+            sent += 1
+            next_send += pace
+            if sent == count:
+                give_up = time.perf_counter() + timeout
+        elif give_up is not None and now > give_up:
+            break
+        wait = max(0, next_send - time.perf_counter()) if sent < count else 0.05
+        for key, _ in selector.select(wait):
+            try:
+                data = key.fileobj.recv(65536)
+            except BlockingIOError:
+                continue
+            arrived = time.perf_counter()
+            for swap_id in SWAP_ID.findall(data):
+                entry = waiting.get(int(swap_id))
+                if entry is None or key.fileobj not in entry[1]:
+                    continue
+                entry[1].discard(key.fileobj)
+                latencies.append(arrived - entry[0])
+                if not entry[1]:
+                    del waiting[int(swap_id)]
+    missing = sum(len(socks) for _, socks in waiting.values())
+    return sorted(latencies), missing
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000 if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connections', type=int, default=2000, help='open streams')
+    parser.add_argument('--users', type=int, default=1000, help='streams are spread over this many users')
+    parser.add_argument('--server', choices=('async', 'wsgi'), default='async')
+    parser.add_argument('--port', type=int, default=5071)
+    parser.add_argument('--idle', type=float, default=10.0, help='seconds to sample idle CPU')
+    parser.add_argument('--events', type=int, default=200)
+    parser.add_argument('--pace', type=float, default=0.02, help='seconds between created requests')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='EVENTS_POLL_INTERVAL')
+    parser.add_argument('--timeout', type=float, default=10.0, help='seconds to wait for the last deliveries')
+    parser.add_argument('--profile', default='development', help='config profile (development/production)')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    wanted = args.connections * 2 + 256  # Both ends live on this machine
+    if soft < wanted:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(wanted, hard), hard))
+
+    rng = random.Random(args.seed)
+    app, path = make_bench_app(profile=args.profile, METRICS_ENABLED=False,
+                               EVENTS_POLL_INTERVAL=args.poll_interval, EVENTS_STREAM_MAX_AGE=3600,
+                               EVENTS_WSGI_STREAM=args.server == 'wsgi')
+    users = min(args.users, args.connections)
+    with app.app_context():
+        load_rows(User.__table__, ({'id': u, 'username': f'u{u}', 'email': f'u{u}@bench.test', 'password': 'x'}
+                                   for u in range(1, users + 1)))
+        # Item n belongs to user n: the item a request for user n asks for
+        load_rows(Item.__table__, ({'id': u, 'user_id': u, 'title': f'item {u}', 'category': 'male', 'size': 'M',
+                                    'status': 'approved'} for u in range(1, users + 1)))
+        db.engine.dispose()  # No pooled connections across the fork
+
+    server = multiprocessing.get_context('fork').Process(target=serve, args=(app, args.server, args.port), daemon=True)
+    server.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', args.port)).close()
+            break
+        except ConnectionRefusedError:
+            time.sleep(0.05)
+    time.sleep(0.2)
+    base_rss, base_threads, _ = process_stats(server.pid)
+    print(f'{args.server} server (pid {server.pid}, db {path}): {base_rss:.1f} MB, {base_threads} threads before streams')
+
+    started = time.perf_counter()
+    streams = open_streams(app, args.port, [1 + n % users for n in range(args.connections)])
+    opened = time.perf_counter() - started
+    rss, threads, cpu_before = process_stats(server.pid)
+    print(f'{args.connections} streams for {users} users opened in {opened:.1f}s '
+          f'({rate(args.connections, opened):.0f}/s): {rss:.1f} MB (+{(rss - base_rss) * 1024 / args.connections:.1f} KB'
+          f' per stream), {threads} threads')
+
+    time.sleep(args.idle)
+    _, _, cpu_after = process_stats(server.pid)
+    print(f'idle for {args.idle:.0f}s: server CPU {(cpu_after - cpu_before) / args.idle * 100:.1f}%')
+
+    with app.app_context():
+        started = time.perf_counter()
+        latencies, missing = deliver(app, streams, args.events, args.pace, args.timeout, rng)
+        elapsed = time.perf_counter() - started
+    print(f'{args.events} events, {len(latencies)} deliveries in {elapsed:.1f}s ({missing} missed): '
+          f'p50 {percentile(latencies, 0.5):.0f} ms, p90 {percentile(latencies, 0.9):.0f} ms, '
+          f'p99 {percentile(latencies, 0.99):.0f} ms, max {percentile(latencies, 1):.0f} ms')
+
+    for sock in streams:
+        sock.close()
+    server.terminate()
+    server.join()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,246 @@
+import os
+
+
+def _database_url(default):
+    url = os.environ.get('DATABASE_URL', default)
+    # Some hosts still hand out the pre-SQLAlchemy-1.4 scheme
+    if url.startswith('postgres://'):
+        url = 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+class Config:
+    """Settings shared by every profile"""
+    SQLALCHEMY_DATABASE_URI = _database_url('sqlite:///site.db')
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    SQLALCHEMY_ENGINE_OPTIONS = {}
+
+    # PRAGMAs applied to every new SQLite connection (ignored for other databases)
+    SQLITE_PRAGMAS = {}
+
+    # Read replica: with REPLICA_DATABASE_URL set, GET requests read from it
+    # while its heartbeat is at most REPLICA_MAX_LAG seconds old (re-read
+    # every REPLICA_LAG_CHECK_INTERVAL), otherwise from the primary. Writes
+    # always go to the primary, and a user who wrote reads from it for the
+    # next REPLICA_READ_YOUR_WRITES seconds. `flask replicas sync --loop`
+    # writes the heartbeat and, for a SQLite replica, copies the primary
+    # file over it every REPLICA_SYNC_INTERVAL seconds
+    REPLICA_DATABASE_URL = os.environ.get('REPLICA_DATABASE_URL')
+    SQLALCHEMY_BINDS = {'replica': REPLICA_DATABASE_URL} if REPLICA_DATABASE_URL else {}
+    REPLICA_MAX_LAG = float(os.environ.get('REPLICA_MAX_LAG', 5))
+    REPLICA_LAG_CHECK_INTERVAL = float(os.environ.get('REPLICA_LAG_CHECK_INTERVAL', 1))
+    REPLICA_READ_YOUR_WRITES = float(os.environ.get('REPLICA_READ_YOUR_WRITES', REPLICA_MAX_LAG))
+    REPLICA_SYNC_INTERVAL = float(os.environ.get('REPLICA_SYNC_INTERVAL', 2))
+
+    # Session configuration
+    SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-in-production'
+    PERMANENT_SESSION_LIFETIME = 3600  # 1 hour
+    IDENTITY_SNAPSHOT_TTL = 300  # Seconds a session user snapshot is reused (checked against the row's version)
+    # Seconds a worker reuses its last read of a user's version and balance
+    # before checking the row again; changes made by other workers show up
+    # within this long, 0 checks the row on every request
+    IDENTITY_VERIFY_INTERVAL = float(os.environ.get('IDENTITY_VERIFY_INTERVAL', 2))
+
+    # Password hashing: any werkzeug method string ('scrypt', 'scrypt:65536:8:1',
+    # 'pbkdf2:sha256:600000'); stored hashes made differently are upgraded at
+    # the next login. Each process hashes on PASSWORD_HASH_WORKERS niced
+    # threads (0 = inline) and turns logins away once PASSWORD_HASH_QUEUE
+    # more are waiting, so a login storm can't take every request thread
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', 2))
+    PASSWORD_HASH_QUEUE = int(os.environ.get('PASSWORD_HASH_QUEUE', 16))
+    PASSWORD_HASH_TIMEOUT = float(os.environ.get('PASSWORD_HASH_TIMEOUT', 5))
+    PASSWORD_HASH_NICE = int(os.environ.get('PASSWORD_HASH_NICE', 10))
+
+    # Listings feed page size
+    ITEMS_PER_PAGE = int(os.environ.get('ITEMS_PER_PAGE', 24))
+    MAX_ITEMS_PER_PAGE = 100
+
+    # JSON API (/api/v1): feed page size and ids per ?ids= batch
+    API_PAGE_SIZE = int(os.environ.get('API_PAGE_SIZE', 50))
+    MAX_API_PAGE_SIZE = 200
+    API_MAX_BATCH = int(os.environ.get('API_MAX_BATCH', 100))
+
+    # Admin moderation queue page size (bulk actions apply to a whole page)
+    MODERATION_PAGE_SIZE = int(os.environ.get('MODERATION_PAGE_SIZE', 100))
+    MAX_MODERATION_PAGE_SIZE = 1000
+
+    # Rendered per-item card HTML kept in each worker
+    FRAGMENT_CACHE_MAX_ENTRIES = int(os.environ.get('FRAGMENT_CACHE_MAX_ENTRIES', 10000))
+    FRAGMENT_CACHE_MAX_BYTES = int(os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+
+    # HTTP caching of browse pages: anonymous responses are public for this
+    # long, and RELEASE changes every validator when markup is redeployed
+    BROWSE_CACHE_MAX_AGE = int(os.environ.get('BROWSE_CACHE_MAX_AGE', 30))
+    BROWSE_CACHE_SHARED_MAX_AGE = int(os.environ.get('BROWSE_CACHE_SHARED_MAX_AGE', 60))
+    CACHE_RELEASE = os.environ.get('RELEASE', '')
+
+    # Uploaded listing photos: stored under static/<UPLOAD_URL_PATH>, resized by the images.process job
+    UPLOAD_URL_PATH = 'uploads'
+    MAX_CONTENT_LENGTH = 10 * 1024 * 1024
+
+    # Multi-party swaps (`flask swaps match`): rings of up to SWAP_CYCLE_MAX_LENGTH
+    # pending requests are executed as one ownership rotation. The matcher
+    # follows changed requests every SWAP_MATCH_INTERVAL seconds
+    SWAP_CYCLE_MAX_LENGTH = int(os.environ.get('SWAP_CYCLE_MAX_LENGTH', 5))
+    SWAP_CYCLE_SEARCH_BUDGET = int(os.environ.get('SWAP_CYCLE_SEARCH_BUDGET', 1000))
+    SWAP_MATCH_INTERVAL = float(os.environ.get('SWAP_MATCH_INTERVAL', 30))
+    SWAP_MATCH_OVERLAP = float(os.environ.get('SWAP_MATCH_OVERLAP', 10))
+
+    # Swap notifications as Server-Sent Events at EVENTS_PATH. Each process
+    # with open streams tails the swap_events table every EVENTS_POLL_INTERVAL
+    # seconds; streams send a heartbeat every EVENTS_HEARTBEAT seconds and are
+    # closed after EVENTS_STREAM_MAX_AGE (browsers reconnect and replay up to
+    # EVENTS_REPLAY_LIMIT missed events). `flask events serve` holds many
+    # idle streams on one asyncio loop.
+    #
+    # An open stream parks a WSGI worker thread for up to EVENTS_STREAM_MAX_AGE,
+    # so the app itself only serves EVENTS_PATH with EVENTS_WSGI_STREAM (on
+    # for `flask run`). Otherwise run `flask events serve` beside the app with
+    # the same SECRET_KEY and DATABASE_URL, route EVENTS_PATH to it with
+    # response buffering off and set EVENTS_SERVER, e.g. for nginx:
+    #     location /events/swaps {
+    #         proxy_pass http://127.0.0.1:5001;
+    #         proxy_http_version 1.1;
+    #         proxy_set_header Connection '';
+    #         proxy_buffering off;
+    #     }
+    # With neither set, dashboards don't subscribe to live updates at all
+    EVENTS_PATH = '/events/swaps'
+    EVENTS_WSGI_STREAM = os.environ.get('EVENTS_WSGI_STREAM') == '1'
+    EVENTS_SERVER = os.environ.get('EVENTS_SERVER') == '1'
+    EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', 0.5))
+    EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', 15))
+    EVENTS_STREAM_MAX_AGE = float(os.environ.get('EVENTS_STREAM_MAX_AGE', 600))
+    EVENTS_QUEUE_SIZE = 100
+    EVENTS_REPLAY_LIMIT = 200
+    EVENTS_RETENTION = int(os.environ.get('EVENTS_RETENTION', 86400))
+
+    # Points ledger: credits are spread over POINTS_SHARDS counter rows per
+    # user and folded into users.points by `flask points compact`, every
+    # POINTS_COMPACT_INTERVAL seconds in --loop mode, POINTS_COMPACT_BATCH
+    # users per transaction. Changing the shard count needs no migration
+    POINTS_SHARDS = int(os.environ.get('POINTS_SHARDS', 8))
+    POINTS_COMPACT_INTERVAL = float(os.environ.get('POINTS_COMPACT_INTERVAL', 60))
+    POINTS_COMPACT_BATCH = int(os.environ.get('POINTS_COMPACT_BATCH', 1000))
+
+    # Pending swap requests older than SWAP_REQUEST_TTL seconds are expired by
+    # the swaps.expire job every SWAP_EXPIRY_INTERVAL, SWAP_EXPIRY_BATCH per transaction
+    SWAP_REQUEST_TTL = int(os.environ.get('SWAP_REQUEST_TTL', 14 * 86400))
+    SWAP_EXPIRY_INTERVAL = float(os.environ.get('SWAP_EXPIRY_INTERVAL', 300))
+    SWAP_EXPIRY_BATCH = int(os.environ.get('SWAP_EXPIRY_BATCH', 500))
+
+    # Background jobs live in the jobs table and are run by `flask jobs work`
+    # (JOBS_PROCESSES forked workers), or with JOBS_EMBEDDED_WORKER by a thread
+    # in each web process. Idle workers poll every JOBS_POLL_INTERVAL seconds;
+    # a claimed job is leased for JOBS_LEASE seconds, renewed every third of
+    # that while it runs, so only the jobs of a lost worker expire. Failures
+    # are retried after JOBS_RETRY_BACKOFF * 2^(attempt - 1) seconds up to
+    # JOBS_MAX_ATTEMPTS times, and done jobs are deleted after JOBS_RETENTION. JOB_SCHEDULE maps
+    # periodic jobs to the seconds between runs
+    JOBS_EMBEDDED_WORKER = os.environ.get('JOBS_EMBEDDED_WORKER', '0') == '1'
+    JOBS_PROCESSES = int(os.environ.get('JOBS_PROCESSES', 2))
+    JOBS_POLL_INTERVAL = float(os.environ.get('JOBS_POLL_INTERVAL', 1))
+    JOBS_LEASE = int(os.environ.get('JOBS_LEASE', 300))
+    JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+    JOBS_RETRY_BACKOFF = float(os.environ.get('JOBS_RETRY_BACKOFF', 10))
+    JOBS_RETENTION = int(os.environ.get('JOBS_RETENTION', 7 * 86400))
+    JOB_SCHEDULE = {
+        'swaps.expire': SWAP_EXPIRY_INTERVAL,
+        'points.compact': POINTS_COMPACT_INTERVAL,
+        'jobs.prune': 3600,
+    }
+
+    # Streamed HTML: with STREAM_PAGES the listings feed and the dashboard are
+    # rendered while they are sent, in chunks of about STREAM_CHUNK_SIZE
+    # characters after the document head goes out on its own. Dashboard rows
+    # are fetched STREAM_BATCH_SIZE at a time, and chunks are gzip/brotli
+    # compressed and flushed one by one for clients that accept it
+    STREAM_PAGES = os.environ.get('STREAM_PAGES', '0') == '1'
+    STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 16 * 1024))
+    STREAM_BATCH_SIZE = int(os.environ.get('STREAM_BATCH_SIZE', 200))
+    STREAM_GZIP_LEVEL = int(os.environ.get('STREAM_GZIP_LEVEL', 6))
+    STREAM_BROTLI_QUALITY = int(os.environ.get('STREAM_BROTLI_QUALITY', 5))
+
+    # Serve the minified, content-hashed copies written by `flask assets build`
+    STATIC_FINGERPRINTS = True
+
+    # Cold starts: compiled templates are cached as bytecode under
+    # JINJA_BYTECODE_CACHE_DIR (relative to the instance folder, filled ahead
+    # of time by `flask templates compile`); with TEMPLATE_WARMUP a serving
+    # process renders WARMUP_PATHS once before taking traffic. Flask-Migrate
+    # is only loaded for `flask` commands (DB_MIGRATIONS: cli/always/never)
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR')
+    TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', '0') == '1'
+    WARMUP_PATHS = ('/', '/items/', '/auth/login', '/auth/register')
+    DB_MIGRATIONS = os.environ.get('DB_MIGRATIONS', 'cli')
+
+    # Request/SQL instrumentation exposed at /metrics. Histograms cover a
+    # METRICS_SAMPLE_RATE fraction of requests; METRICS_DIR lets every
+    # worker process answer for the whole pool (one directory per host: exited
+    # workers are recognised by pid). Scrapers send METRICS_TOKEN
+    # as a bearer token; with METRICS_REQUIRE_TOKEN the app refuses to start
+    # serving without one rather than expose /metrics to everyone
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1') == '1'
+    METRICS_SAMPLE_RATE = float(os.environ.get('METRICS_SAMPLE_RATE', 1.0))
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    METRICS_REQUIRE_TOKEN = os.environ.get('METRICS_REQUIRE_TOKEN', '0') == '1'
+    SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+
+    # Opt-in request profiler; off registers no hooks at all. When on, admins
+    # capture a request with ?_profile=1 or an X-Profile: 1 header (=cprofile
+    # for a cProfile trace) and PROFILE_SAMPLE_RATE of requests are sampled
+    PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0') == '1'
+    PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0.0))
+    PROFILE_MODE = os.environ.get('PROFILE_MODE', 'sample')  # 'sample' or 'cprofile'
+    PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+    PROFILE_DIR = os.environ.get('PROFILE_DIR')  # Defaults to instance/profiles
+    PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 200))
+
+
+class DevelopmentConfig(Config):
+    DEBUG = True
+    STATIC_FINGERPRINTS = False  # Edits to static files show up without a rebuild
+    JOBS_EMBEDDED_WORKER = os.environ.get('JOBS_EMBEDDED_WORKER', '1') == '1'  # `flask run` alone handles uploads
+    EVENTS_WSGI_STREAM = os.environ.get('EVENTS_WSGI_STREAM', '1') == '1'  # ...and live swap updates
+
+
+class ProductionConfig(Config):
+    JINJA_BYTECODE_CACHE_DIR = os.environ.get('JINJA_BYTECODE_CACHE_DIR', 'jinja-cache')
+    TEMPLATE_WARMUP = os.environ.get('TEMPLATE_WARMUP', '1') == '1'
+    STREAM_PAGES = os.environ.get('STREAM_PAGES', '1') == '1'
+    METRICS_REQUIRE_TOKEN = os.environ.get('METRICS_REQUIRE_TOKEN', '1') == '1'
+
+    # WAL lets readers run alongside the single writer, busy_timeout makes
+    # writers queue instead of failing with "database is locked", and
+    # synchronous=NORMAL is durable across app crashes in WAL mode
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000)),
+        'synchronous': 'NORMAL',
+        'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+        'cache_size': -int(os.environ.get('SQLITE_CACHE_KB', 64 * 1024)),  # negative = KiB
+        'temp_store': 'MEMORY',
+    }
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+        'pool_pre_ping': True,
+    }
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = 'sqlite://'
+
+
+config_by_name = {
+    'development': DevelopmentConfig,
+    'production': ProductionConfig,
+    'testing': TestingConfig,
+}
@@ -1,6 +1,6 @@
 from app import create_app, db
 from app.models import User, Item, SwapRequest
-from werkzeug.security import generate_password_hash
+from app.passwords import hash_password
 import random
 from datetime import datetime, timedelta
 
@@ -27,12 +27,15 @@ def create_sample_users():
         {'username': 'frank_swap', 'email': 'frank@example.com', 'points': 90},
     ]
     
+    # Hashing is deliberately slow, so hash the shared demo password once
+    password_hash = hash_password('password123')
+
     users = []
     for user_data in users_data:
         user = User(
             username=user_data['username'],
             email=user_data['email'],
-            password=generate_password_hash('password123'),
+            password=password_hash,
             points=user_data['points'],
             is_admin=False
         )
@@ -43,7 +46,7 @@ def create_sample_users():
     admin = User(
         username='admin',
         email='admin@rewear.com',
-        password=generate_password_hash('admin123'),
+        password=hash_password('admin123'),
         points=1000,
         is_admin=True
     )
@@ -180,6 +183,7 @@ def create_sample_items(users):
             size=item_data['size'],
             image_url=random.choice(sample_images),
             points_cost=item_data['points_cost'],
+            status='approved',  # Demo listings skip the moderation queue
             created_at=created_date
         )
         items.append(item)
@@ -279,6 +283,7 @@ def populate_sample_data():
         print("\nSample accounts created:")
         print("Admin: admin@rewear.com / admin123")
         print("Users: alice@example.com, bob@example.com, carol@example.com, etc. / password123")
+        print("\nFor capacity testing volumes use `flask dataset generate --users 100000 --items 2000000 --swaps 5000000`")
 
 if __name__ == '__main__':
     populate_sample_data()
@@ -2,4 +2,7 @@ rm -rf instance migrations
 flask db init
 flask db migrate
 flask db upgrade
+flask search index
+flask assets build
+REWEAR_CONFIG=production flask templates compile
 python3 ./sample_data.py
\ No newline at end of file